@@ -1,12 +1,14 @@
 from storage.Index import Index
 from tools.http_request_tool import http_tool
 from tools.coredna.sharpspring_tool import sharpspring_tool
-from tools.webpage_scanner_tool import tag_exists_tool, fetch_field_tool
+from tools.webpage_scanner_tool import analyze_form_tool
 from llama_index.core.agent import ReActAgent
 from llama_index.core import Settings
 from constants import CHUNK_SIZE, OPENAI_EMBEDDING_MODEL, OPENAI_MODEL, ACTION_AGENT_PROMPT
 from llama_index.core.prompts import PromptTemplate
 from llama_index.agent.openai import OpenAIAgent
+from llama_index.core.memory import BaseMemory
+from typing import Optional
 
 
 
@@ -15,8 +17,7 @@ class ActionAgent:
         self.index_handler: Index = index_handler
         self.function_tools = [
             http_tool(),
-            tag_exists_tool(),
-            fetch_field_tool(),
+            analyze_form_tool(),
             sharpspring_tool()
         ]
 
@@ -42,12 +43,14 @@ class ActionAgent:
         print("react action agent created")
         return agent
     
-    def create_openai_agent(self):
+    def create_openai_agent(self, memory: Optional[BaseMemory] = None):
+        # memory: e.g. a persistent ConversationMemory, an in-process ChatMemoryBuffer when None
         agent = OpenAIAgent.from_tools(
             tools=self.function_tools,
             llm=Settings.llm,
             verbose=True,
-            system_prompt=ACTION_AGENT_PROMPT
+            system_prompt=ACTION_AGENT_PROMPT,
+            memory=memory
         )
         print("openai action agent created")
         return agent
@@ -0,0 +1,189 @@
+import logging
+import re
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from storage.EmbeddingCache import get_cached_embed_model
+
+"""
+Zero-LLM routing of a turn to the rag or action agent.
+
+A local intent classifier scores the query with keyword, URL and form-intent heuristics, and with
+the similarity between the query embedding and the embedding of each agent description. The
+description embeddings go through the on-disk embedding cache, so they are computed once and
+reused across restarts. When the classifier is confident, the turn is sent straight to the chosen
+agent and the router LLM call is skipped, otherwise the LLM router decides.
+"""
+
+logger = logging.getLogger(__name__)
+
+RAG_AGENT = "rag_agent"
+ACTION_AGENT = "action_agent"
+
+URL_PATTERN = re.compile(r"(https?://\S+|www\.\S+|\b[a-z0-9-]+(\.[a-z0-9-]+)*\.(com|net|org|io|au|co|dev)\b(/\S*)?)", re.IGNORECASE)
+EMAIL_PATTERN = re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b")
+
+# (pattern, agent, weight)
+KEYWORD_RULES = [
+    (re.compile(r"\b(forms?|input|fields?|embed ?code|tags?|html|element|markup|script)\b", re.IGNORECASE), ACTION_AGENT, 1.0),
+    (re.compile(r"\b(download|submit|sign ?up|subscribe|register|fill( in| out)?)\b", re.IGNORECASE), ACTION_AGENT, 1.0),
+    (re.compile(r"\b(check|scan|fetch|exists?|contains?|http|request|sharpspring)\b", re.IGNORECASE), ACTION_AGENT, 0.5),
+    (re.compile(r"\b(what|how|why|who|which|when|explain|tell me|describe|difference|compare)\b", re.IGNORECASE), RAG_AGENT, 0.75),
+    (re.compile(r"\b(core ?dna|features?|pricing|price|cost|plans?|support|integrations?|cms|platform|docs?|documentation|modules?)\b", re.IGNORECASE), RAG_AGENT, 0.75),
+]
+
+# Follow-ups like "and what about that one?" depend on the conversation, only the LLM router sees it
+FOLLOW_UP_PATTERN = re.compile(r"\b(it|its|that|this|those|these|they|them|one|above|previous|same|again)\b", re.IGNORECASE)
+
+
+class RouteDecision:
+    def __init__(self, agent_name: Optional[str], confidence: float, scores: Dict[str, float], reasons: List[str]) -> None:
+
+        """
+        Initialize the RouteDecision.
+
+        Args:
+            agent_name (Optional[str]): The agent the turn goes to, None when the LLM router should decide.
+            confidence (float): Confidence of the classifier in its best guess, between 0.5 and 1.
+            scores (Dict[str, float]): Score of every agent.
+            reasons (List[str]): The heuristics that fired, for logging.
+        """
+
+        self.agent_name = agent_name
+        self.confidence = confidence
+        self.scores = scores
+        self.reasons = reasons
+
+    def to_dict(self) -> dict:
+        return {"agent": self.agent_name, "confidence": self.confidence, "scores": self.scores, "reasons": self.reasons}
+
+
+class FastRouter:
+    def __init__(self, descriptions: Dict[str, str], confidence_threshold: float, embedding_weight: float = 10.0, embed_model=None) -> None:
+
+        """
+        Initialize the FastRouter.
+
+        Args:
+            descriptions (Dict[str, str]): Description of each agent, keyed by the agent name of the session.
+            confidence_threshold (float): Minimum confidence to skip the LLM router.
+            embedding_weight (float): Weight of the embedding similarity against the heuristics.
+            embed_model (BaseEmbedding): The model used to embed the descriptions and queries, the cached
+                embedding model when missing.
+        """
+
+        self.descriptions = descriptions
+        self.confidence_threshold = confidence_threshold
+        self.embedding_weight = embedding_weight
+        self.embed_model = embed_model
+
+        self._description_embeddings: Optional[Dict[str, np.ndarray]] = None
+        self._lock = threading.Lock()
+
+        self.fast_turns = 0
+        self.llm_turns = 0
+        self.fast_seconds = 0.0
+        self.llm_seconds = 0.0
+        self.routed: Dict[str, int] = {name: 0 for name in descriptions}
+
+    def _embed_model(self):
+        if self.embed_model is None:
+            self.embed_model = get_cached_embed_model()
+        return self.embed_model
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def prepare(self) -> None:
+        """Embed the agent descriptions, served from the embedding cache after the first run."""
+        with self._lock:
+            if self._description_embeddings is not None:
+                return
+            names = list(self.descriptions)
+            embeddings = self._embed_model().get_text_embedding_batch([self.descriptions[name] for name in names])
+            self._description_embeddings = {name: self._normalize(e) for name, e in zip(names, embeddings)}
+
+    def classify(self, query: str, has_history: bool = False) -> RouteDecision:
+
+        """
+        Pick the agent for a turn.
+
+        Args:
+            query (str): The user query.
+            has_history (bool): Whether the session already has turns, follow-ups are left to the LLM router.
+
+        Returns:
+            RouteDecision: The decision, its agent_name is None when the confidence is too low.
+        """
+
+        scores = {name: 0.0 for name in self.descriptions}
+        reasons = []
+
+        def add(agent_name: str, weight: float, reason: str):
+            if agent_name in scores:
+                scores[agent_name] += weight
+                reasons.append(reason)
+
+        if URL_PATTERN.search(query):
+            add(ACTION_AGENT, 2.0, "url")
+        if EMAIL_PATTERN.search(query):
+            add(ACTION_AGENT, 1.5, "email")
+        for pattern, agent_name, weight in KEYWORD_RULES:
+            for match in pattern.finditer(query):
+                add(agent_name, weight, match.group(0).lower())
+
+        try:
+            self.prepare()
+            query_embedding = self._normalize(self._embed_model().get_query_embedding(query))
+            for name, embedding in self._description_embeddings.items():
+                scores[name] += self.embedding_weight * float(query_embedding @ embedding)
+        except Exception:
+            # the heuristics alone still route the obvious turns
+            logger.exception("Fast router could not embed the query")
+
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        margin = scores[ranked[0]] - scores[ranked[1]] if len(ranked) > 1 else float("inf")
+        confidence = float(1.0 / (1.0 + np.exp(-margin)))
+
+        if has_history and FOLLOW_UP_PATTERN.search(query):
+            reasons.append("follow-up")
+            return RouteDecision(None, confidence, scores, reasons)
+
+        agent_name = ranked[0] if confidence >= self.confidence_threshold else None
+        return RouteDecision(agent_name, confidence, scores, reasons)
+
+    def record(self, decision: RouteDecision, elapsed_seconds: float) -> None:
+        """Record how a turn was routed and how long it took to answer, for `stats`."""
+        with self._lock:
+            if decision.agent_name is None:
+                self.llm_turns += 1
+                self.llm_seconds += elapsed_seconds
+            else:
+                self.fast_turns += 1
+                self.fast_seconds += elapsed_seconds
+                self.routed[decision.agent_name] = self.routed.get(decision.agent_name, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            turns = self.fast_turns + self.llm_turns
+            average_fast = self.fast_seconds / self.fast_turns if self.fast_turns else None
+            average_llm = self.llm_seconds / self.llm_turns if self.llm_turns else None
+            saved = None
+            if average_fast is not None and average_llm is not None:
+                saved = max(0.0, average_llm - average_fast) * self.fast_turns
+            return {
+                "confidence_threshold": self.confidence_threshold,
+                "turns": turns,
+                "fast_turns": self.fast_turns,
+                "llm_turns": self.llm_turns,
+                "fast_share": self.fast_turns / turns if turns else 0.0,
+                "fast_routed": dict(self.routed),
+                "average_fast_seconds": average_fast,
+                "average_llm_seconds": average_llm,
+                "estimated_seconds_saved": saved,
+            }
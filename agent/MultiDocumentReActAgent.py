@@ -2,10 +2,18 @@ from llama_index.core import Settings
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from llama_index.core.agent import ReActAgent
 from llama_index.core.prompts import PromptTemplate
+from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.agent.openai import OpenAIAgent
+from llama_index.core.memory import BaseMemory
+from typing import Optional
 
-from constants import MULTI_DOCUMENT_AGENT_PROMPT, CHUNK_SIZE, OPENAI_EMBEDDING_MODEL, OPENAI_MODEL, DEFAULT_QA_PROMPT_TMPL
-from storage.Index import Index
+from constants import (
+    MULTI_DOCUMENT_AGENT_PROMPT, CHUNK_SIZE, OPENAI_EMBEDDING_MODEL, OPENAI_MODEL, DEFAULT_QA_PROMPT_TMPL, TOP_K,
+    CONTEXT_COMPRESSION, CONTEXT_TOKEN_BUDGET, CONTEXT_MIN_SIMILARITY
+)
+from storage.ContextCompressor import ContextCompressor
+from storage.EmbeddingCache import get_cached_embed_model
+from storage.IndexService import RemoteIndex
 
 """
 This agent is ONLY responsible for fetching content from the vector database
@@ -30,7 +38,7 @@ class MultiDocumentReActAgent:
         Initialize the MultiDocumentReActAgent.
 
         Args:
-            index_handler (Index): An instance of the Index class, containing the loaded index to use for the agent.
+            index_handler (RemoteIndex): The collection to use for the agent, an Index with a loaded index works too.
         """
 
         Settings.chunk_size = CHUNK_SIZE
@@ -40,10 +48,9 @@ class MultiDocumentReActAgent:
         # TODO: external vector database connection
 
         # Initialize Index class to handle index operations
-        self.index_handler: Index = index_handler
+        self.index_handler: RemoteIndex = index_handler
 
-        self.index = self.index_handler.get_index()  # This should be an instance of VectorStoreIndex
-        self.index_loaded = self.index is not None 
+        self.index_loaded = self.index_handler.is_loaded()
 
         self.query_engine_tools = []
         self.query_engine = None
@@ -67,7 +74,21 @@ class MultiDocumentReActAgent:
             raise ValueError("Index is not loaded. Ensure the provided index_handler has a loaded index.")
 
         text_qa_template=PromptTemplate(DEFAULT_QA_PROMPT_TMPL)
-        self.query_engine = self.index.as_query_engine(text_qa_template=text_qa_template, llm=Settings.llm)
+        # boilerplate and off-topic sentences of the nodes are dropped before they reach the QA prompt
+        node_postprocessors = []
+        if CONTEXT_COMPRESSION:
+            node_postprocessors.append(ContextCompressor(
+                embed_model=get_cached_embed_model(),
+                token_budget=CONTEXT_TOKEN_BUDGET,
+                min_similarity=CONTEXT_MIN_SIMILARITY
+            ))
+        # nodes are retrieved by the process owning the index, only the synthesis runs here
+        self.query_engine = RetrieverQueryEngine.from_args(
+            retriever=self.index_handler.as_retriever(similarity_top_k=TOP_K),
+            llm=Settings.llm,
+            text_qa_template=text_qa_template,
+            node_postprocessors=node_postprocessors
+        )
 
         self.query_engine_tools = [
             QueryEngineTool(
@@ -104,7 +125,19 @@ class MultiDocumentReActAgent:
         return agent
     
     
-    def create_openai_agent(self):
+    def create_openai_agent(self, memory: Optional[BaseMemory] = None):
+
+        """
+        Create an OpenAI agent using the query engine tools.
+
+        Args:
+            memory (Optional[BaseMemory]): The chat memory of the agent, e.g. a persistent ConversationMemory,
+                an in-process ChatMemoryBuffer when None.
+
+        Returns:
+            OpenAIAgent: The created agent.
+        """
+
         if not self.query_engine_tools:
             raise ValueError("Query engine tools are not created. Call 'create_query_engine_and_tools' first.")
 
@@ -112,7 +145,8 @@ class MultiDocumentReActAgent:
             tools=self.query_engine_tools,
             llm=Settings.llm,
             verbose=True,
-            system_prompt=MULTI_DOCUMENT_AGENT_PROMPT
+            system_prompt=MULTI_DOCUMENT_AGENT_PROMPT,
+            memory=memory
         )
         print("openai rag agent created")
         return agent
@@ -4,6 +4,27 @@ from llama_index.core.selectors import LLMSingleSelector
 from llama_index.core.query_engine.router_query_engine import RouterQueryEngine
 from llama_index.core.objects import ObjectIndex, SimpleToolNodeMapping
 from llama_index.core import VectorStoreIndex
+import threading
+from typing import Optional
+from llama_index.core.memory import BaseMemory
+from storage.EmbeddingCache import get_cached_embed_model
+
+
+# Vector index of the tool descriptions, keyed by the tool names and descriptions.
+# Every session reuses the index built for the first one, the description embeddings are cached on disk.
+_tool_indexes = {}
+_tool_indexes_lock = threading.Lock()
+
+
+def get_tool_index(tools: list) -> VectorStoreIndex:
+    key = tuple((tool.metadata.name, tool.metadata.description) for tool in tools)
+    with _tool_indexes_lock:
+        if key not in _tool_indexes:
+            _tool_indexes[key] = VectorStoreIndex(
+                SimpleToolNodeMapping.from_objects(tools).to_nodes(tools),
+                embed_model=get_cached_embed_model()
+            )
+        return _tool_indexes[key]
 
 
 class RouterAgent:
@@ -11,7 +32,7 @@ class RouterAgent:
         self.tools = agent_tools
         # self.agent = self.create_agent()
         
-    def create_agent(self):
+    def create_agent(self, memory: Optional[BaseMemory] = None):
 
         # selector = LLMSingleSelector.from_defaults()
 
@@ -22,16 +43,19 @@ class RouterAgent:
         #     verbose=True,
         # )
 
+        # the tool nodes are shared, the mapping resolves them to the tools of this session
         tool_mapping = SimpleToolNodeMapping.from_objects(self.tools)
 
-        obj_index = ObjectIndex.from_objects(self.tools, tool_mapping=tool_mapping, index_cls=VectorStoreIndex)
+        obj_index = ObjectIndex(get_tool_index(self.tools), tool_mapping)
 
         retriever = obj_index.as_retriever(similarity_top_k=2)
 
         agent = FnRetrieverOpenAIAgent.from_retriever(
             retriever,
             system_prompt=ROUTER_AGENT_PROMPT,
-            verbose=True
+            verbose=True,
+            # the conversation of the session, an in-process ChatMemoryBuffer when None
+            memory=memory
         )
 
         print("router agent created")
@@ -0,0 +1,229 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+"""
+Session-keyed registry of agent stacks.
+
+Every visitor session gets its own router/rag/action agents, so chat histories are not shared.
+Sessions are kept in an LRU with a TTL, a maximum number of live sessions and an approximate
+byte budget, the least recently used sessions are evicted first.
+"""
+
+
+class AgentSession:
+    def __init__(self, session_id: str, collection_name: str, router_agent, agents: Dict[str, object]) -> None:
+
+        """
+        Initialize the AgentSession.
+
+        Args:
+            session_id (str): The id of the visitor session.
+            collection_name (str): The collection the agents were built for.
+            router_agent: The top level agent answering the queries.
+            agents (Dict[str, object]): The sub agents used as tools by the router agent, keyed by name.
+        """
+
+        self.session_id = session_id
+        self.collection_name = collection_name
+        self.router_agent = router_agent
+        self.agents = agents
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.size_bytes = 0
+        # the guide download in progress (DownloadGuideSession), its questions are answered without the agents
+        self.guide = None
+        # version of the stored progress of the guide download the live run matches
+        self.guide_version = 0
+        # agents are not safe to use from concurrent requests, serialize the turns of a session
+        self.lock = threading.Lock()
+
+    def get_all_agents(self) -> list:
+        return [self.router_agent] + list(self.agents.values())
+
+    def estimate_size(self, base_bytes: int) -> int:
+
+        """
+        Approximate the memory held by this session, based on the chat histories of its agents.
+
+        Args:
+            base_bytes (int): The fixed cost of an agent stack without any history.
+
+        Returns:
+            int: The estimated size in bytes.
+        """
+
+        size = base_bytes
+        for agent in self.get_all_agents():
+            memory = getattr(agent, "memory", None)
+            if memory is None:
+                continue
+            for message in memory.get_all():
+                size += len(str(message.content or "").encode("utf-8"))
+                if message.additional_kwargs:
+                    size += len(json.dumps(message.additional_kwargs, default=str))
+        self.size_bytes = size
+        return size
+
+
+class SessionRegistry:
+    def __init__(
+            self,
+            factory: Callable[[str, str], AgentSession],
+            max_sessions: int,
+            ttl_seconds: float,
+            max_bytes: int,
+            session_base_bytes: int,
+    ) -> None:
+
+        """
+        Initialize the SessionRegistry.
+
+        Args:
+            factory (Callable[[str, str], AgentSession]): Builds a new session from a session id and a collection name.
+            max_sessions (int): Maximum number of live sessions.
+            ttl_seconds (float): Idle time after which a session expires.
+            max_bytes (int): Approximate memory budget for all sessions.
+            session_base_bytes (int): Estimated fixed size of an agent stack, added to the size of its chat history.
+        """
+
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.session_base_bytes = session_base_bytes
+
+        self._sessions: "OrderedDict[str, AgentSession]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _key(session_id: str, collection_name: str) -> str:
+        return f"{collection_name}:{session_id}"
+
+    def get_or_create(self, session_id: str, collection_name: str) -> AgentSession:
+
+        """
+        Return the agent session for the given id, building a new one on a miss.
+
+        Args:
+            session_id (str): The id of the visitor session.
+            collection_name (str): The collection the session queries.
+
+        Returns:
+            AgentSession: The live session.
+        """
+
+        key = self._key(session_id, collection_name)
+        now = time.monotonic()
+
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                session.last_used = now
+                self.hits += 1
+                return session
+            self.misses += 1
+
+        # Build outside of the lock, creating the agents is slow
+        session = self.factory(session_id, collection_name)
+        session.last_used = time.monotonic()
+        session.estimate_size(self.session_base_bytes)
+
+        with self._lock:
+            existing = self._sessions.get(key)
+            if existing is not None:
+                # another request created the same session in the meantime
+                self._sessions.move_to_end(key)
+                return existing
+            self._sessions[key] = session
+            self._total_bytes += session.size_bytes
+            self._enforce_limits(keep=key)
+
+        return session
+
+    def touch(self, session: AgentSession) -> None:
+
+        """
+        Update the size of a session after a chat turn and evict sessions if the budget is exceeded.
+
+        Args:
+            session (AgentSession): The session that was just used.
+        """
+
+        key = self._key(session.session_id, session.collection_name)
+
+        # the size and its delta under the lock, concurrent turns of a session would apply deltas to the same old size
+        with self._lock:
+            if self._sessions.get(key) is not session:
+                return
+            previous_size = session.size_bytes
+            session.estimate_size(self.session_base_bytes)
+            session.last_used = time.monotonic()
+            self._total_bytes += session.size_bytes - previous_size
+            self._enforce_limits(keep=key)
+
+    def remove(self, session_id: str, collection_name: str) -> bool:
+        """Drop a session, returns True if it existed."""
+        with self._lock:
+            session = self._sessions.pop(self._key(session_id, collection_name), None)
+            if session is None:
+                return False
+            self._total_bytes -= session.size_bytes
+            return True
+
+    def remove_collection(self, collection_name: str) -> int:
+        """Drop all sessions of a collection, used when its agents need to be rebuilt."""
+        with self._lock:
+            keys = [key for key, session in self._sessions.items() if session.collection_name == collection_name]
+            for key in keys:
+                self._total_bytes -= self._sessions.pop(key).size_bytes
+            return len(keys)
+
+    def _expire(self, now: float) -> None:
+        # The LRU order is also the last_used order, stop at the first live session
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if now - session.last_used < self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self._total_bytes -= session.size_bytes
+            self.expirations += 1
+
+    def _enforce_limits(self, keep: Optional[str] = None) -> None:
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes):
+            key = next(iter(self._sessions))
+            if key == keep:
+                # never evict the session being served, it is the only one left
+                if len(self._sessions) == 1:
+                    break
+                self._sessions.move_to_end(key)
+                continue
+            session = self._sessions.pop(key)
+            self._total_bytes -= session.size_bytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "live_sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "approx_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
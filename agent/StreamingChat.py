@@ -0,0 +1,137 @@
+import contextvars
+import json
+import queue
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+
+"""
+Helpers to stream an agent answer to the client as Server-Sent Events.
+
+The agent runs in a background thread, tool calls are reported through a callback handler
+and the final answer tokens are forwarded as soon as the LLM produces them.
+"""
+
+# Sentinel pushed to the event queue once the agent has finished (or failed)
+_DONE = object()
+
+
+class StreamingChatHandler(BaseCallbackHandler):
+    def __init__(self, events: queue.Queue) -> None:
+
+        """
+        Initialize the StreamingChatHandler.
+
+        Args:
+            events (queue.Queue): The queue tool call events are pushed to.
+        """
+
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.events = events
+        # Agents share the LLM callback manager, only report events raised by our own thread
+        self.thread_id: Optional[int] = None
+        self._tool_names: Dict[str, str] = {}
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        if event_type != CBEventType.FUNCTION_CALL or threading.get_ident() != self.thread_id:
+            return event_id
+
+        payload = payload or {}
+        tool = payload.get(EventPayload.TOOL)
+        tool_name = getattr(tool, "name", None) or "unknown"
+        self._tool_names[event_id] = tool_name
+        self.events.put(("tool_start", {"tool": tool_name, "arguments": payload.get(EventPayload.FUNCTION_CALL)}))
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        if event_type != CBEventType.FUNCTION_CALL or threading.get_ident() != self.thread_id:
+            return
+
+        payload = payload or {}
+        tool_name = self._tool_names.pop(event_id, "unknown")
+        self.events.put(("tool_end", {"tool": tool_name, "output": str(payload.get(EventPayload.FUNCTION_OUTPUT, ""))}))
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        pass
+
+
+def format_sse(event: str, data: dict) -> str:
+    """Format a single Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_agent_events(agent, query: str, sub_agents: Optional[list] = None) -> Iterator[tuple]:
+
+    """
+    Run `agent.stream_chat(query)` in a background thread and yield events as they happen.
+
+    Args:
+        agent: The top level agent (router agent) to chat with.
+        query (str): The user query.
+        sub_agents (Optional[list]): Agents called as tools by the top level agent, their tool calls are reported as well.
+
+    Yields:
+        tuple: (event name, payload) pairs, event name is one of tool_start, tool_end, token, done or error.
+    """
+
+    events: queue.Queue = queue.Queue()
+    handler = StreamingChatHandler(events)
+
+    # Collect the distinct callback managers, agents built from the same llm share one
+    callback_managers = []
+    for a in [agent] + list(sub_agents or []):
+        callback_manager = getattr(a, "callback_manager", None)
+        if callback_manager is not None and all(callback_manager is not cm for cm in callback_managers):
+            callback_managers.append(callback_manager)
+
+    def run():
+        handler.thread_id = threading.get_ident()
+        for callback_manager in callback_managers:
+            callback_manager.add_handler(handler)
+        try:
+            response = agent.stream_chat(query)
+            tokens = []
+            for token in response.response_gen:
+                tokens.append(token)
+                events.put(("token", {"delta": token}))
+            events.put(("done", {"response": "".join(tokens)}))
+        except Exception as e:
+            events.put(("error", {"error": f"Failed to process query: {str(e)}"}))
+        finally:
+            for callback_manager in callback_managers:
+                callback_manager.remove_handler(handler)
+            events.put(_DONE)
+
+    # the agent runs with the context of the request, e.g. its trace
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+    thread.start()
+
+    while True:
+        event = events.get()
+        if event is _DONE:
+            break
+        yield event
+
+    thread.join()
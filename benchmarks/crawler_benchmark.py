@@ -0,0 +1,75 @@
+"""
+Benchmark of the sitemap crawler against the local test website, no network access needed.
+
+Compares a sequential fetch loop (the behaviour before the async crawler) with the crawler at
+several concurrency levels, and reports pages per second.
+
+Usage:
+    python benchmarks/crawler_benchmark.py --pages 2000 --latency 0.05 --concurrency 8 32 64
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.local_site import LocalSite
+from crawler import SitemapCrawler
+
+
+def sequential_crawl(site: LocalSite, domain: str) -> int:
+    crawler = SitemapCrawler()
+
+    async def entries():
+        async with crawler.session() as session:
+            return await crawler.fetch_sitemap_entries(session, site.sitemap_url, domain)
+
+    urls = [entry["loc"] for entry in asyncio.run(entries())]
+
+    fetched = 0
+    with requests.Session() as session:
+        for url in urls:
+            if session.get(url).status_code == 200:
+                fetched += 1
+    return fetched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="server latency per page in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of pages answered with a 503")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 64])
+    parser.add_argument("--per-host", type=int, default=None, help="per host limit, defaults to the concurrency")
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    with LocalSite(pages=args.pages, latency=args.latency, error_rate=args.error_rate) as site:
+        print(f"{'mode':<20}{'pages':>8}{'failed':>8}{'seconds':>10}{'pages/s':>10}")
+
+        if not args.skip_sequential:
+            start = time.perf_counter()
+            fetched = sequential_crawl(site, site.domain)
+            elapsed = time.perf_counter() - start
+            print(f"{'sequential':<20}{fetched:>8}{args.pages - fetched:>8}{elapsed:>10.2f}{fetched / elapsed:>10.1f}")
+
+        for concurrency in args.concurrency:
+            crawler = SitemapCrawler(
+                concurrency=concurrency,
+                per_host_concurrency=args.per_host or concurrency,
+                backoff=0.05
+            )
+            start = time.perf_counter()
+            documents = crawler.load_data(site.sitemap_url, site.domain)
+            elapsed = time.perf_counter() - start
+            failed = args.pages - len(documents)
+            print(f"{f'async x{concurrency}':<20}{len(documents):>8}{failed:>8}{elapsed:>10.2f}{len(documents) / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
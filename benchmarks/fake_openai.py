@@ -0,0 +1,382 @@
+import base64
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+"""
+Local stand-in for the OpenAI API, used to load test the server offline.
+
+Serves /v1/chat/completions (plain and streamed) and /v1/embeddings in three modes:
+
+    synthetic  answers are made up: the embeddings are hashed character trigrams of the text (deterministic,
+               similar texts get similar vectors), the chat answers reuse words of the prompt, agents given
+               a query tool (an agent or query engine tool) call it once per user turn so the router -> rag
+               agent -> retrieval chain is exercised, the guide question prompt gets a JSON list of questions
+    record     requests are forwarded to the real API, the responses and their latency (the arrival time of
+               every streamed line) are appended to a JSONL file
+    replay     recorded responses are served with their recorded timing, requests that were not recorded
+               get a synthetic answer and are counted as misses
+
+Synthetic latencies are drawn from distributions, see `parse_latency`.
+
+Usage:
+    with FakeOpenAI(chat_latency=parse_latency("lognormal:0.8:0.4"), token_latency=0.02) as fake:
+        os.environ["OPENAI_API_BASE"] = fake.api_base
+"""
+
+EMBEDDING_DIMENSIONS = 1536
+GUIDE_FIELD_PATTERN = re.compile(r"^- (.+?) \(", re.MULTILINE)
+# tools called with the user message, the http tool has the same `input` schema but must not be called with it
+QUERY_TOOL_PATTERN = re.compile(r"(agent|engine)_tool$")
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+
+    """
+    Parse a latency distribution, in seconds.
+
+    Args:
+        spec (str): "fixed:S", "uniform:MIN:MAX", "normal:MEAN:STDDEV" or "lognormal:MEDIAN:SIGMA", a bare number is fixed.
+
+    Returns:
+        Callable[[], float]: A function drawing a latency.
+    """
+
+    name, *values = spec.split(":") if not re.fullmatch(r"[\d.]+", spec) else ("fixed", spec)
+    values = [float(value) for value in values]
+    if name == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if name == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if name == "normal" and len(values) == 2:
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if name == "lognormal" and len(values) == 2:
+        return lambda: values[0] * float(np.exp(random.gauss(0.0, values[1])))
+    raise ValueError(f"Invalid latency distribution '{spec}'")
+
+
+def hashed_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> List[float]:
+    """Unit vector of the hashed character trigrams of a text, the same text always gets the same vector."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    text = f"  {text.lower()}  "
+    for i in range(len(text) - 2):
+        vector[int(hashlib.md5(text[i:i + 3].encode()).hexdigest()[:8], 16) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def request_key(path: str, body: dict) -> str:
+    """Key of a request in the recordings, the body without the transport options."""
+    body = {key: value for key, value in body.items() if key not in ("stream_options", "user", "timeout")}
+    return hashlib.sha256(json.dumps([path, body], sort_keys=True).encode()).hexdigest()
+
+
+def count_tokens(text: str) -> int:
+    # rough estimate, 4 characters per token
+    return max(1, len(text) // 4)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # clients hanging up mid stream (timeouts, cancelled requests) are expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class FakeOpenAI:
+    def __init__(
+            self,
+            chat_latency: Callable[[], float] = lambda: 0.5,
+            token_latency: float = 0.02,
+            embedding_latency: Callable[[], float] = lambda: 0.05,
+            answer_tokens: int = 60,
+            record_path: Optional[str] = None,
+            upstream: str = "https://api.openai.com/v1",
+            upstream_key: Optional[str] = None,
+            replay_path: Optional[str] = None,
+            replay_speed: float = 1.0,
+    ) -> None:
+
+        """
+        Initialize the FakeOpenAI.
+
+        Args:
+            chat_latency (Callable[[], float]): Time to the first token of a chat completion.
+            token_latency (float): Time between two streamed tokens, also added per token to plain completions.
+            embedding_latency (Callable[[], float]): Time of an embedding request.
+            answer_tokens (int): Number of words of a synthetic answer.
+            record_path (Optional[str]): Forward the requests to `upstream` and append the exchanges to this JSONL file.
+            upstream (str): Base URL of the real API in record mode.
+            upstream_key (Optional[str]): API key of the real API in record mode.
+            replay_path (Optional[str]): Serve the exchanges recorded in this JSONL file.
+            replay_speed (float): Recorded latencies are divided by this factor.
+        """
+
+        if record_path and replay_path:
+            raise ValueError("Record and replay are exclusive")
+        if record_path and not upstream_key:
+            raise ValueError("Recording requires the key of the upstream API")
+
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.embedding_latency = embedding_latency
+        self.answer_tokens = answer_tokens
+        self.record_path = record_path
+        self.upstream = upstream.rstrip("/")
+        self.upstream_key = upstream_key
+        self.replay_speed = replay_speed
+
+        # recorded exchanges by request key, served in turn when a request was recorded several times
+        self.recordings: Dict[str, List[dict]] = {}
+        self._replay_positions: Dict[str, int] = {}
+        if replay_path:
+            with open(replay_path) as file:
+                for line in file:
+                    if line.strip():
+                        exchange = json.loads(line)
+                        self.recordings.setdefault(exchange["key"], []).append(exchange)
+
+        self.stats = {
+            "chat": 0, "embeddings": 0, "tool_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "recorded": 0, "replayed": 0, "replay_misses": 0, "errors": 0,
+        }
+        self._lock = threading.Lock()
+        self._server: Optional[_Server] = None
+
+    @property
+    def mode(self) -> str:
+        if self.record_path:
+            return "record"
+        return "replay" if self.recordings else "synthetic"
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def _count(self, **counts: int) -> None:
+        with self._lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+
+    # synthetic responses
+
+    def _chat_message(self, body: dict) -> dict:
+        messages = body.get("messages", [])
+        prompt = "\n".join(str(message.get("content") or "") for message in messages)
+        last_user = max((i for i, message in enumerate(messages) if message.get("role") == "user"), default=-1)
+        user_text = str(messages[last_user].get("content") or "") if last_user >= 0 else prompt
+
+        # one query tool call per user turn, then the answer
+        answered = any(message.get("role") == "tool" for message in messages[last_user + 1:])
+        for tool in body.get("tools") or []:
+            function = tool.get("function", {})
+            if not answered and QUERY_TOOL_PATTERN.search(function.get("name", "")):
+                self._count(tool_calls=1)
+                return {"role": "assistant", "content": None, "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": function["name"], "arguments": json.dumps({"input": user_text})},
+                }]}
+
+        # the guide download workflow asks for one question per "- <field> (...)" line as a JSON list
+        fields = GUIDE_FIELD_PATTERN.findall(prompt)
+        if fields and "JSON" in prompt:
+            return {"role": "assistant", "content": json.dumps([f"What is your {field.lower()}?" for field in fields])}
+
+        words = re.findall(r"[A-Za-z]+", user_text + " " + prompt) or ["answer"]
+        answer = " ".join(words[i % len(words)] for i in range(self.answer_tokens))
+        return {"role": "assistant", "content": f"{answer}."}
+
+    def _synthetic_chat(self, handler: BaseHTTPRequestHandler, body: dict) -> None:
+        message = self._chat_message(body)
+        prompt_tokens = sum(count_tokens(json.dumps(message_in.get("content") or "")) for message_in in body.get("messages", []))
+        pieces = re.findall(r"\S+\s*", message["content"] or "")
+        self._count(chat=1, prompt_tokens=prompt_tokens, completion_tokens=len(pieces))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces), "total_tokens": prompt_tokens + len(pieces)}
+        finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+        completion = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": body.get("model", "gpt-4o")}
+
+        time.sleep(self.chat_latency())
+        if not body.get("stream"):
+            time.sleep(self.token_latency * len(pieces))
+            return self._send_json(handler, {
+                **completion, "object": "chat.completion",
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+                "usage": usage,
+            })
+
+        def chunk(delta: dict, finish: Optional[str] = None) -> dict:
+            return {**completion, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+        self._start_stream(handler)
+        self._send_event(handler, chunk({"role": "assistant", "content": ""}))
+        if message.get("tool_calls"):
+            self._send_event(handler, chunk({"tool_calls": [{"index": 0, **message["tool_calls"][0]}]}))
+        for piece in pieces:
+            self._send_event(handler, chunk({"content": piece}))
+            time.sleep(self.token_latency)
+        self._send_event(handler, chunk({}, finish_reason))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_event(handler, {**completion, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        self._send_line(handler, b"data: [DONE]\n\n")
+
+    def _synthetic_embeddings(self, handler: BaseHTTPRequestHandler, body: dict) -> None:
+        texts = body.get("input")
+        texts = [texts] if isinstance(texts, str) else texts
+        tokens = sum(count_tokens(str(text)) for text in texts)
+        self._count(embeddings=1, prompt_tokens=tokens)
+
+        time.sleep(self.embedding_latency())
+        data = []
+        for index, text in enumerate(texts):
+            embedding = hashed_embedding(str(text), body.get("dimensions") or EMBEDDING_DIMENSIONS)
+            # the openai client asks for base64 unless told otherwise
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        self._send_json(handler, {
+            "object": "list", "data": data, "model": body.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    # record and replay
+
+    def _record(self, handler: BaseHTTPRequestHandler, path: str, body: dict, raw: bytes) -> None:
+        request = urllib.request.Request(
+            self.upstream + path[len("/v1"):], data=raw, method="POST",
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.upstream_key}"}
+        )
+        started_at = time.perf_counter()
+        try:
+            response = urllib.request.urlopen(request, timeout=300)
+        except urllib.error.HTTPError as e:
+            self._count(errors=1)
+            return self._send(handler, e.code, e.read(), "application/json")
+
+        exchange = {"key": request_key(path, body), "path": path, "stream": bool(body.get("stream"))}
+        with response:
+            if exchange["stream"]:
+                # relayed as they arrive, with their arrival time
+                self._start_stream(handler)
+                lines = []
+                for line in response:
+                    lines.append([time.perf_counter() - started_at, line.decode()])
+                    self._send_line(handler, line)
+                exchange["lines"] = lines
+            else:
+                exchange["latency"] = time.perf_counter() - started_at
+                exchange["response"] = json.loads(response.read())
+                self._send_json(handler, exchange["response"])
+
+        with self._lock:
+            self.stats["recorded"] += 1
+            with open(self.record_path, "a") as file:
+                file.write(json.dumps(exchange) + "\n")
+
+    def _replay(self, handler: BaseHTTPRequestHandler, path: str, body: dict) -> bool:
+        key = request_key(path, body)
+        with self._lock:
+            exchanges = self.recordings.get(key)
+            if not exchanges:
+                self.stats["replay_misses"] += 1
+                return False
+            position = self._replay_positions.get(key, 0)
+            self._replay_positions[key] = position + 1
+            self.stats["replayed"] += 1
+        exchange = exchanges[position % len(exchanges)]
+
+        if not exchange["stream"]:
+            time.sleep(exchange["latency"] / self.replay_speed)
+            self._send_json(handler, exchange["response"])
+            return True
+
+        started_at = time.perf_counter()
+        self._start_stream(handler)
+        for offset, line in exchange["lines"]:
+            time.sleep(max(0.0, offset / self.replay_speed - (time.perf_counter() - started_at)))
+            self._send_line(handler, line.encode())
+        return True
+
+    # HTTP
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, body: bytes, content_type: str) -> None:
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _send_json(self, handler: BaseHTTPRequestHandler, data: dict) -> None:
+        self._send(handler, 200, json.dumps(data).encode(), "application/json")
+
+    def _start_stream(self, handler: BaseHTTPRequestHandler) -> None:
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+
+    def _send_line(self, handler: BaseHTTPRequestHandler, line: bytes) -> None:
+        handler.wfile.write(line)
+        handler.wfile.flush()
+
+    def _send_event(self, handler: BaseHTTPRequestHandler, data: dict) -> None:
+        self._send_line(handler, f"data: {json.dumps(data)}\n\n".encode())
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                body = json.loads(raw or b"{}")
+
+                if path not in ("/v1/chat/completions", "/v1/embeddings"):
+                    return fake._send(self, 404, b'{"error": {"message": "Not found"}}', "application/json")
+                if fake.record_path:
+                    return fake._record(self, path, body, raw)
+                if fake.recordings and fake._replay(self, path, body):
+                    return
+                if path == "/v1/embeddings":
+                    return fake._synthetic_embeddings(self, body)
+                fake._synthetic_chat(self, body)
+
+        return Handler
+
+    def start(self) -> "FakeOpenAI":
+        self._server = _Server(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeOpenAI":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
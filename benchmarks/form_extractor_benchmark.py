@@ -0,0 +1,109 @@
+"""
+CPU time and peak memory of finding the form inputs of a page, BeautifulSoup DOM against the streaming FormExtractor.
+
+    bs4:          BeautifulSoup(html.parser) of the whole page, then find_all of the inputs (the former path)
+    stream-full:  FormExtractor over the whole page
+    stream-stop:  FormExtractor stopping once the form holding the inputs is closed (what the tools do)
+    tag-stop:     FormExtractor stopping at the first <form> (check_tag_exists)
+
+The page is a generated marketing page (navigation, sections, inline scripts, a download form part way
+down), or any page given with --url.
+
+Usage:
+    python benchmarks/form_extractor_benchmark.py --sections 400 --form-position 0.3
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.form_extractor import extract_forms, iter_chunks, has_tag, has_form_inputs
+
+
+def marketing_page(sections: int, form_position: float) -> bytes:
+    navigation = "".join(f'<li class="nav-item"><a href="/solutions/{i}">Solution {i}</a></li>' for i in range(60))
+    form = (
+        '<form class="download-guide" action="https://app.sharpspring.com/" method="post">'
+        + "".join(
+            f'<label for="field_{i}">Field {i}</label><input type="text" id="field_{i}" name="field_{1370 + i}" '
+            f'placeholder="Your field {i}" required>'
+            for i in range(6)
+        )
+        + '<input type="hidden" name="field_1390" value="57a3995e-d350-41cf-a5b7-c949acd1d9d9">'
+        + '<input type="hidden" name="embedCode" value="abc123"><button type="submit">Download</button></form>'
+    )
+    body = []
+    for i in range(sections):
+        if i == int(sections * form_position):
+            body.append(form)
+        body.append(
+            f'<section class="block block-{i}"><div class="container"><div class="row"><div class="col-md-6">'
+            f'<h2>Headless commerce feature {i}</h2><p>' + "Composable digital experience platform &amp; CMS. " * 20
+            + '</p><a class="btn" href="/request-a-demo">Request a Demo</a></div><div class="col-md-6">'
+            f'<img src="/images/{i}.png" alt="feature {i}"></div></div></div>'
+            f'<script>window.dataLayer = window.dataLayer || []; dataLayer.push({{"section": {i}}});</script></section>'
+        )
+    html = (
+        f'<!DOCTYPE html><html><head><title>Guide</title></head><body><header><ul class="nav">{navigation}</ul></header>'
+        + "".join(body) + '<footer>GET IN TOUCH TODAY</footer></body></html>'
+    )
+    return html.encode("utf-8")
+
+
+def measure(function, repeat: int) -> tuple:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return float(np.median(timings) * 1000), peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark a real page instead of the generated one")
+    parser.add_argument("--sections", type=int, default=400)
+    parser.add_argument("--form-position", type=float, default=0.3, help="where the form is, 0 top of the page, 1 bottom")
+    parser.add_argument("--prefix", default="field_")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.url:
+        from tools.http_client import http_client
+        content = http_client.get(args.url).content
+    else:
+        content = marketing_page(args.sections, args.form_position)
+    max_bytes = len(content) + 1
+
+    def bs4_inputs():
+        soup = BeautifulSoup(content, "html.parser")
+        return soup.find_all("input", attrs={"name": lambda x: x and x.startswith(args.prefix)})
+
+    cases = {
+        "bs4": bs4_inputs,
+        "stream-full": lambda: extract_forms(iter_chunks(content), max_bytes).form_inputs(args.prefix),
+        "stream-stop": lambda: extract_forms(iter_chunks(content), max_bytes, has_form_inputs(args.prefix)).form_inputs(args.prefix),
+        "tag-stop": lambda: extract_forms(iter_chunks(content), max_bytes, has_tag("form")).tags,
+    }
+
+    found = {len(bs4_inputs()), len(cases["stream-full"]()), len(cases["stream-stop"]())}
+    print(f"page: {len(content) / 1024:.0f} KiB, inputs named {args.prefix}*: {sorted(found)}")
+    print(f"{'path':<14}{'ms':>10}{'peak MiB':>10}")
+    for name, function in cases.items():
+        milliseconds, peak = measure(function, args.repeat)
+        print(f"{name:<14}{milliseconds:>10.2f}{peak:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Guide download through the DownloadGuideWorkflow against the agentic path (ReAct action agent with tools).
+
+Both paths fill the same form of a local page and submit it to a local SharpSpring stand-in. The LLM is
+a stand-in with a fixed latency per call:
+    workflow: one call wording all the questions
+    agent:    the real ReActAgent with the action agent tools and prompt, its LLM replays the calls the
+              agent makes in the prompted flow (analyze_form, one answer per question, sharpspring_tool,
+              http_tool, final answer), so tool execution and prompt growth are real
+
+Reported per download: LLM calls, estimated prompt tokens (4 characters per token) and wall time.
+In production the agentic path also goes through the router agent, --router-calls adds its LLM calls per turn.
+
+Usage:
+    python benchmarks/guide_workflow_benchmark.py --fields 4 --llm-latency 0.8 --runs 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Sequence
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.agent import ReActAgent
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse, CompletionResponse, LLMMetadata, MessageRole
+from llama_index.core.llms import CustomLLM
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+
+import tools.coredna.sharpspring_tool as sharpspring_module
+from constants import ACTION_AGENT_PROMPT
+from tools.coredna.sharpspring_tool import create_sharpspring_url, sharpspring_tool
+from tools.http_request_tool import http_tool
+from tools.webpage_scanner_tool import analyze_form_tool, page_cache
+from workflow.DownloadGuideWorkflow import DownloadGuideSession
+
+class FakeLLM(CustomLLM):
+    """LLM stand-in sleeping a fixed latency per call and answering from a script or a function of the prompt."""
+
+    latency: float = 0.5
+    script: List[str] = []
+    calls: int = 0
+    prompt_tokens: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake", is_chat_model=True)
+
+    def _answer(self, prompt: str) -> str:
+        self.calls += 1
+        self.prompt_tokens += len(prompt) // 4
+        if self.script:
+            return self.script.pop(0)
+        # wording of the workflow questions, one per "- " field line
+        fields = re.findall(r"^- (.+?) \(", prompt, re.MULTILINE)
+        return json.dumps([f"What is your {field.lower()}?" for field in fields])
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self.latency)
+        return CompletionResponse(text=self._answer(prompt))
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self.latency)
+        return CompletionResponse(text=self._answer(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        yield self.complete(prompt)
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        time.sleep(self.latency)
+        prompt = "\n".join(str(message.content) for message in messages)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=self._answer(prompt)))
+
+
+def guide_page(fields: int) -> bytes:
+    names = ["First name", "Last name", "Company", "Job title", "Phone", "Country", "Industry", "Website"]
+    inputs = '<label for="email">Your work email</label><input type="email" id="email" name="field_1" required>'
+    for i in range(1, fields):
+        inputs += f'<label for="f{i}">{names[(i - 1) % len(names)]}</label><input id="f{i}" name="field_{i + 1}" required>'
+    return (
+        '<html><body><h1>The headless CMS guide</h1><form method="post">' + inputs
+        + '<input type="hidden" name="field_99" value="57a3995e-d350-41cf-a5b7-c949acd1d9d9">'
+        + '<input type="hidden" name="embedCode" value="guide123"><button>Download</button></form></body></html>'
+    ).encode()
+
+
+def start_server(page: bytes) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/guide":
+                server.submissions += 1
+            body = page if self.path == "/guide" else b'callback({"success": true})'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.submissions = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def answer_for(field: str) -> str:
+    return "jane@example.com" if field == "field_1" else "Jane"
+
+
+def react_action(tool: str, arguments: dict) -> str:
+    return f"Thought: I need to use a tool to help me answer the question.\nAction: {tool}\nAction Input: {json.dumps(arguments)}"
+
+
+def react_answer(answer: str) -> str:
+    return f"Thought: I can answer without using any more tools.\nAnswer: {answer}"
+
+
+def run_workflow(url: str, latency: float) -> dict:
+    llm = FakeLLM(latency=latency)
+    started_at = time.perf_counter()
+    session = DownloadGuideSession(llm=llm)
+    result = session.start(url)
+    turns = 1
+    while result["status"] == "question":
+        result = session.answer(answer_for(result["field"]))
+        turns += 1
+    return {
+        "status": result["status"],
+        "turns": turns,
+        "llm_calls": llm.calls,
+        "prompt_tokens": llm.prompt_tokens,
+        "seconds": time.perf_counter() - started_at,
+    }
+
+
+def run_agent(url: str, latency: float, fields: int, router_calls: int) -> dict:
+    names = [f"field_{i + 1}" for i in range(fields)]
+    details = {"embedCode": "guide123", **{name: answer_for(name) for name in names}}
+    # the LLM outputs of each turn of the prompted flow
+    scripts = [[react_action("analyze_form_tool", {"url": url}), react_answer(f"What is your {names[0]}?")]]
+    scripts += [[react_answer(f"What is your {name}?")] for name in names[1:]]
+    scripts += [[
+        react_action("sharpspring_tool", {"ss_details": details}),
+        react_action("http_tool", {"url": create_sharpspring_url(details), "method": "get"}),
+        react_answer("Thank you, the guide will be sent to your email."),
+    ]]
+    messages = [f"I would like to download the guide at {url}"] + [answer_for(name) for name in names]
+
+    llm = FakeLLM(latency=latency)
+    agent = ReActAgent.from_tools(
+        tools=[http_tool(), analyze_form_tool(), sharpspring_tool()],
+        llm=llm,
+        context=ACTION_AGENT_PROMPT,
+        max_iterations=20
+    )
+    started_at = time.perf_counter()
+    for message, script in zip(messages, scripts):
+        llm.script = list(script)
+        agent.chat(message)
+        # the router agent picking the action agent and relaying its answer
+        time.sleep(latency * router_calls)
+    return {
+        "status": "submitted",
+        "turns": len(messages),
+        "llm_calls": llm.calls + router_calls * len(messages),
+        "prompt_tokens": llm.prompt_tokens,
+        "seconds": time.perf_counter() - started_at,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fields", type=int, default=4, help="visible fields of the form")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per LLM call")
+    parser.add_argument("--router-calls", type=int, default=0, help="router agent LLM calls per turn added to the agentic path")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    server = start_server(guide_page(args.fields))
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    sharpspring_module.SHARPSPRING_ENDPOINT = base_url + "/ss/"
+    url = base_url + "/guide"
+
+    print(f"{args.fields} fields, {args.llm_latency}s per LLM call, {args.router_calls} router calls per agent turn")
+    print(f"{'path':<10}{'turns':>7}{'LLM calls':>11}{'prompt tok':>12}{'seconds':>10}{'submitted':>11}")
+    for name in ("workflow", "agent"):
+        results = []
+        for _ in range(args.runs):
+            page_cache.clear()
+            submissions = server.submissions
+            if name == "workflow":
+                result = run_workflow(url, args.llm_latency)
+            else:
+                result = run_agent(url, args.llm_latency, args.fields, args.router_calls)
+            result["submitted"] = server.submissions - submissions
+            results.append(result)
+        print(f"{name:<10}{results[0]['turns']:>7}{results[0]['llm_calls']:>11}{results[0]['prompt_tokens']:>12}"
+              f"{np.median([result['seconds'] for result in results]):>10.2f}{results[0]['submitted']:>11}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Throughput and latency of the gunicorn deployment of `server:app` with the OpenAI API replaced by a local
+stand-in (see fake_openai.py), to capacity plan without depending on the live OpenAI latency.
+
+For every server mode (gunicorn worker class) and worker count, the server is started with gunicorn.conf.py
+on a fresh data directory, the curated QA pairs are ingested, and simulated visitors replay a query mix
+for a fixed duration, each visitor starting the next scenario as soon as the previous one ends:
+
+    faq      a curated question of Cleaned_QA_Pairs.csv, answered from the FAQ index
+    rag      a reworded curated question, going through the router and rag agents (or the answer cache)
+    guide    a guide download: /guide on a local page with a form, then /query turns answering its questions
+    sitemap  a sitemap ingestion job on a local site, polled until it ends
+
+Reported per scenario: operations, errors, operations per second and p50/p95/p99 latency (a guide is one
+operation for the whole download). With --stream the chat turns use /query/stream, the time to the first
+token is reported too.
+
+The stand-in answers with made-up text and deterministic embeddings after latencies drawn from the given
+distributions. --record forwards the requests to the real API and saves the exchanges, --replay serves
+them later with their recorded timing, offline.
+
+Usage:
+    python benchmarks/load_test.py --workers 1 2 4 --modes sync gthread --users 16 --duration 60
+    python benchmarks/load_test.py --workers 2 --record traces.jsonl --duration 120
+    python benchmarks/load_test.py --workers 2 4 --replay traces.jsonl
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import FakeOpenAI, parse_latency
+from local_site import LocalSite
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLLECTION = "loadtest"
+SITEMAP_COLLECTION = "loadtest-sitemap"
+REWORDINGS = ["Could you tell me: {question}", "{question} Please explain.", "I was wondering, {question}"]
+
+
+def load_questions(path: str) -> List[str]:
+    with open(path, newline="", encoding="utf-8") as file:
+        return [row["Question"].strip() for row in csv.DictReader(file) if row.get("Question", "").strip()]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ("faq", "rag", "guide", "sitemap"):
+            raise ValueError(f"Unknown scenario '{name}'")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Visitor:
+    """One simulated visitor, runs scenarios back to back and records their latency."""
+
+    def __init__(self, base_url: str, args, site: LocalSite, questions: List[str], seed: int) -> None:
+        self.base_url = base_url
+        self.args = args
+        self.site = site
+        self.questions = questions
+        self.random = random.Random(seed)
+        self.http = requests.Session()
+        self.results: List[dict] = []
+
+    def _post(self, path: str, data: dict) -> dict:
+        response = self.http.post(self.base_url + path, json=data, timeout=self.args.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _put(self, path: str, data: dict) -> dict:
+        response = self.http.put(self.base_url + path, json=data, timeout=self.args.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _ask(self, query: str, session_id: Optional[str] = None) -> dict:
+        """One chat turn, the time to the first token is added to the result of a streamed turn."""
+        data = {"query": query, "collection_name": COLLECTION, "session_id": session_id}
+        if not self.args.stream:
+            return self._post("/query", data)
+
+        started_at = time.perf_counter()
+        response = self.http.post(self.base_url + "/query/stream", json=data, timeout=self.args.timeout, stream=True)
+        response.raise_for_status()
+        result, event = {}, None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "session":
+                    result["session_id"] = data["session_id"]
+                elif event == "token" and "ttft" not in result:
+                    result["ttft"] = time.perf_counter() - started_at
+                elif event == "done":
+                    result.update(data)
+                elif event == "error":
+                    raise RuntimeError(data["error"])
+        return result
+
+    def faq(self) -> dict:
+        return self._ask(self.random.choice(self.questions))
+
+    def rag(self) -> dict:
+        return self._ask(self.random.choice(REWORDINGS).format(question=self.random.choice(self.questions)))
+
+    def guide(self) -> dict:
+        page = self.random.randrange(self.site.pages)
+        result = self._post("/guide", {"url": f"{self.site.base_url}/page/{page}", "collection_name": COLLECTION})
+        turns = 1
+        while result.get("guide") == "question":
+            result = {**self._ask("jane@example.com", result["session_id"]), "session_id": result["session_id"]}
+            turns += 1
+            if turns > 10:
+                raise RuntimeError("The guide download did not end")
+        if result.get("guide") != "submitted":
+            raise RuntimeError(f"The guide download ended with {result.get('guide')}")
+        return {"turns": turns}
+
+    def sitemap(self) -> dict:
+        job = self._put("/sitemap", {
+            "sitemap_url": self.site.sitemap_url, "domain": self.site.domain, "collection_name": SITEMAP_COLLECTION,
+            "incremental": True,
+        })
+        while True:
+            time.sleep(0.2)
+            response = self.http.get(self.base_url + job["status_url"], timeout=self.args.timeout)
+            response.raise_for_status()
+            status = response.json()["status"]
+            if status not in ("queued", "running"):
+                break
+        if status != "succeeded":
+            raise RuntimeError(f"The sitemap job ended with {status}")
+        return {}
+
+    def run(self, mix: Dict[str, float], until: float, measured_from: float) -> None:
+        names, weights = list(mix), list(mix.values())
+        while time.time() < until:
+            name = self.random.choices(names, weights)[0]
+            started_at = time.perf_counter()
+            started_on = time.time()
+            try:
+                result = getattr(self, name)()
+                error = None
+            except Exception as e:
+                result, error = {}, str(e)
+            if started_on >= measured_from:
+                self.results.append({
+                    "scenario": name, "seconds": time.perf_counter() - started_at, "ttft": result.get("ttft"),
+                    "error": error, "finished_at": time.time(),
+                })
+
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 180) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with {process.returncode}")
+        try:
+            if requests.get(base_url + "/ready", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("The server did not become ready")
+
+
+def start_server(args, mode: str, workers: int, port: int, data_dir: str, env: dict) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers), "--worker-class", mode, "--timeout", str(int(args.timeout)),
+    ]
+    if mode == "gthread":
+        command += ["--threads", str(args.threads)]
+    log = open(os.path.join(data_dir, "server.log"), "w")
+    # own process group, the index service child is stopped with the server
+    return subprocess.Popen(command + ["server:app"], cwd=PROJECT_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def set_up(base_url: str, timeout: float) -> None:
+    for collection_name in (SITEMAP_COLLECTION, COLLECTION):
+        requests.post(base_url + "/initialize", json={"collection_name": collection_name}, timeout=timeout).raise_for_status()
+    requests.put(base_url + "/files", json={
+        "directory": "coredna", "file_names": ["Cleaned_QA_Pairs.csv"], "collection_name": COLLECTION, "wait": True,
+    }, timeout=timeout).raise_for_status()
+
+
+def percentiles(values: List[float]) -> List[float]:
+    return [float(np.percentile(values, q)) for q in (50, 95, 99)] if values else [float("nan")] * 3
+
+
+def summarize(results: List[dict], seconds: float) -> Dict[str, dict]:
+    summary = {}
+    for name in sorted({result["scenario"] for result in results}) + ["all"]:
+        selected = [result for result in results if name in ("all", result["scenario"])]
+        ok = [result for result in selected if result["error"] is None]
+        ttfts = [result["ttft"] for result in ok if result["ttft"] is not None]
+        summary[name] = {
+            "ops": len(selected),
+            "errors": len(selected) - len(ok),
+            "ops_per_second": len(ok) / seconds,
+            "latency": percentiles([result["seconds"] for result in ok]),
+            "ttft": percentiles(ttfts) if ttfts else None,
+        }
+    return summary
+
+
+def run(args, mode: str, workers: int, fake: FakeOpenAI, site: LocalSite, questions: List[str]) -> Dict[str, dict]:
+    data_dir = tempfile.mkdtemp(prefix="loadtest-")
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "sk-fake",
+        "OPENAI_API_BASE": fake.api_base,
+        "CHROMA_DB_PATH": os.path.join(data_dir, "chroma_db"),
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(data_dir, "prometheus"),
+        "SHARPSPRING_ENDPOINT": site.sharpspring_endpoint,
+        "MEMORY_DB_PATH": os.path.join(data_dir, "conversations.sqlite3"),
+    }
+    # a service address of the environment would be shared by the runs
+    env.pop("INDEX_SERVICE_ADDRESS", None)
+
+    process = start_server(args, mode, workers, port, data_dir, env)
+    try:
+        wait_ready(base_url, process)
+        set_up(base_url, args.timeout)
+
+        started_at = time.time()
+        measured_from = started_at + args.warmup
+        until = measured_from + args.duration
+        visitors = [Visitor(base_url, args, site, questions, args.seed + i) for i in range(args.users)]
+        threads = [threading.Thread(target=visitor.run, args=(parse_mix(args.mix), until, measured_from)) for visitor in visitors]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the scenarios still running at the deadline are included, the window ends with the last of them
+        results = [result for visitor in visitors for result in visitor.results]
+        seconds = max([result["finished_at"] for result in results] + [until]) - measured_from
+        return summarize(results, seconds)
+    finally:
+        stop_server(process)
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+        else:
+            print(f"Server data and log kept in {data_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="gunicorn worker counts")
+    parser.add_argument("--modes", nargs="+", default=["sync", "gthread"], choices=["sync", "gthread"], help="gunicorn worker classes")
+    parser.add_argument("--threads", type=int, default=4, help="threads per gthread worker")
+    parser.add_argument("--users", type=int, default=8, help="concurrent visitors")
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=10, help="seconds of load before the measure")
+    parser.add_argument("--mix", default="faq=5,rag=3,guide=1.5,sitemap=0.5", help="scenario weights")
+    parser.add_argument("--stream", action="store_true", help="chat turns through /query/stream")
+    parser.add_argument("--llm-latency", default="lognormal:0.8:0.4", help="time to the first token, e.g. fixed:0.5, uniform:0.3:1.2")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="seconds between streamed tokens")
+    parser.add_argument("--embedding-latency", default="lognormal:0.08:0.3")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--record", help="record the exchanges with the real API to this JSONL file (OPENAI_API_KEY is used)")
+    parser.add_argument("--upstream", default="https://api.openai.com/v1", help="base URL of the API recorded")
+    parser.add_argument("--replay", help="replay the exchanges of this JSONL file")
+    parser.add_argument("--replay-speed", type=float, default=1.0)
+    parser.add_argument("--sitemap-pages", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=120, help="client and gunicorn worker timeout")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the data directory and log of every run")
+    args = parser.parse_args()
+    parse_mix(args.mix)
+
+    questions = load_questions(os.path.join(PROJECT_ROOT, "data", "coredna", "Cleaned_QA_Pairs.csv"))
+    fake = FakeOpenAI(
+        chat_latency=parse_latency(args.llm_latency),
+        token_latency=args.token_latency,
+        embedding_latency=parse_latency(args.embedding_latency),
+        answer_tokens=args.answer_tokens,
+        record_path=args.record,
+        upstream=args.upstream,
+        upstream_key=os.getenv("OPENAI_API_KEY") if args.record else None,
+        replay_path=args.replay,
+        replay_speed=args.replay_speed,
+    )
+
+    print(f"OpenAI stand-in: {fake.mode}, LLM {args.llm_latency}, {args.token_latency}s per token, "
+          f"{args.users} visitors, {args.duration}s per run, mix {args.mix}{', streamed' if args.stream else ''}")
+    print(f"{'mode':<9}{'workers':>8} {'scenario':<9}{'ops':>6}{'errors':>7}{'ops/s':>8}"
+          f"{'p50':>8}{'p95':>8}{'p99':>8}{'ttft p50':>10}")
+    runs = []
+    with fake, LocalSite(pages=args.sitemap_pages, latency=0.01, jitter=0.01, page_bytes=4 * 1024) as site:
+        for mode in args.modes:
+            for workers in args.workers:
+                summary = run(args, mode, workers, fake, site, questions)
+                runs.append({"mode": mode, "workers": workers, "scenarios": summary})
+                for name, stats in summary.items():
+                    ttft = f"{stats['ttft'][0]:>10.2f}" if stats["ttft"] else f"{'-':>10}"
+                    print(f"{mode:<9}{workers:>8} {name:<9}{stats['ops']:>6}{stats['errors']:>7}{stats['ops_per_second']:>8.2f}"
+                          + "".join(f"{value:>8.2f}" for value in stats["latency"]) + ttft)
+        print(f"OpenAI stand-in calls: {fake.stats}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"arguments": vars(args), "openai": fake.stats, "runs": runs}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+"""
+Local test website used to benchmark the sitemap crawler offline.
+
+Serves a sitemap index pointing to nested sitemaps, and synthetic HTML pages with a configurable
+response latency and error rate. Pages support ETag revalidation so incremental syncs can be measured too.
+Every page has a download form, /ss/ stands in for the SharpSpring postback endpoint of the guide downloads.
+
+Usage:
+    with LocalSite(pages=2000, latency=0.05) as site:
+        crawl(site.sitemap_url, site.domain)
+"""
+
+PAGE_TEMPLATE = """<html><head><title>Page {page}</title></head>
+<body><h1>Page {page}</h1><p>{body}</p>
+<form><input name="field_{page}" placeholder="Your work email"><input type="hidden" name="embedCode" value="abc{page}"></form>
+</body></html>"""
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog is too small for high crawl concurrency
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # clients hanging up mid response (timeouts, cancelled crawls) are expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class LocalSite:
+    def __init__(
+            self,
+            pages: int = 500,
+            latency: float = 0.05,
+            jitter: float = 0.02,
+            error_rate: float = 0.0,
+            sitemap_size: int = 250,
+            page_bytes: int = 20 * 1024,
+    ) -> None:
+
+        """
+        Initialize the LocalSite.
+
+        Args:
+            pages (int): Number of pages listed in the sitemaps.
+            latency (float): Average time in seconds the server takes to answer a page request.
+            jitter (float): Random extra latency in seconds, up to this value.
+            error_rate (float): Share of page requests answered with a 503.
+            sitemap_size (int): Number of pages per nested sitemap.
+            page_bytes (int): Approximate size of a page.
+        """
+
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.sitemap_size = sitemap_size
+        self.body = ("Lorem ipsum dolor sit amet. " * (page_bytes // 28 + 1))[:page_bytes]
+        self.requests = 0
+        self.submissions = 0
+        self._lock = threading.Lock()
+        self._server: Optional[_Server] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def domain(self) -> str:
+        return "127.0.0.1"
+
+    @property
+    def sitemap_url(self) -> str:
+        return f"{self.base_url}/sitemap.xml"
+
+    @property
+    def sharpspring_endpoint(self) -> str:
+        return f"{self.base_url}/ss/"
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes = b"", content_type: str = "text/html; charset=utf-8", etag: str = None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with site._lock:
+                    site.requests += 1
+
+                if self.path == "/sitemap.xml":
+                    count = (site.pages + site.sitemap_size - 1) // site.sitemap_size
+                    items = "".join(
+                        f"<sitemap><loc>{site.base_url}/sitemap-{i}.xml</loc></sitemap>" for i in range(count)
+                    )
+                    body = f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{items}</sitemapindex>'
+                    return self._send(200, body.encode(), "application/xml")
+
+                if self.path.startswith("/sitemap-"):
+                    part = int(self.path[len("/sitemap-"):-len(".xml")])
+                    start = part * site.sitemap_size
+                    items = "".join(
+                        f"<url><loc>{site.base_url}/page/{i}</loc><lastmod>2024-01-01</lastmod></url>"
+                        for i in range(start, min(start + site.sitemap_size, site.pages))
+                    )
+                    body = f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{items}</urlset>'
+                    return self._send(200, body.encode(), "application/xml")
+
+                if self.path.startswith("/page/"):
+                    time.sleep(site.latency + random.uniform(0, site.jitter))
+                    if random.random() < site.error_rate:
+                        return self._send(503)
+
+                    page = self.path[len("/page/"):]
+                    etag = f'"page-{page}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        return self._send(304, etag=etag)
+                    body = PAGE_TEMPLATE.format(page=page, body=site.body).encode()
+                    return self._send(200, body, etag=etag)
+
+                if self.path.startswith("/ss/"):
+                    with site._lock:
+                        site.submissions += 1
+                    return self._send(200, b'callback({"success": true})', "application/javascript")
+
+                self._send(404)
+
+        return Handler
+
+    def start(self) -> "LocalSite":
+        self._server = _Server(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "LocalSite":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,175 @@
+"""
+Recall and latency of hybrid (BM25 + vector, reciprocal rank fusion) retrieval against vector-only retrieval.
+
+The corpus is the row-per-node load of a data directory (default: the curated QA pairs of coredna).
+Two query sets are evaluated:
+    questions: every curated question, the relevant node is its own row
+    terms:     "Tell me about <term>" for rare terms that only appear in a few answers (feature and
+               product names), the relevant nodes are the rows whose answer contains the term
+
+Uses the OpenAI embedding model when OPENAI_API_KEY is set, else a local hashing embedding (character
+trigrams) so the benchmark runs offline, vector recall is then only indicative.
+
+Usage:
+    python benchmarks/retrieval_benchmark.py --directory coredna --top-k 2 5
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb
+from llama_index.core import StorageContext, VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import MetadataMode
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from constants import HYBRID_CANDIDATES, HYBRID_RRF_K
+from storage.BM25Index import BM25Index, tokenize
+from storage.HybridRetriever import HybridRetriever
+from utils import load_data_from_files
+
+
+class HashingEmbedding(BaseEmbedding):
+    """Offline stand-in for the embedding model, hashed character trigrams of the text."""
+
+    _dimensions: int = PrivateAttr()
+
+    def __init__(self, dimensions: int = 512, **kwargs) -> None:
+        super().__init__(model_name="hashing", **kwargs)
+        self._dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self._dimensions, dtype=np.float32)
+        text = f"  {text.lower()}  "
+        for i in range(len(text) - 2):
+            vector[int(hashlib.md5(text[i:i + 3].encode()).hexdigest()[:8], 16) % self._dimensions] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class MemoizedEmbedding(BaseEmbedding):
+    """Computes every query embedding once, so the timings measure retrieval and not the embedding API."""
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _queries: Dict[str, List[float]] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, embed_model: BaseEmbedding, **kwargs) -> None:
+        super().__init__(model_name=embed_model.model_name, **kwargs)
+        self._embed_model = embed_model
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        if query not in self._queries:
+            self._queries[query] = self._embed_model.get_query_embedding(query)
+        return self._queries[query]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed_model.get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_model.get_text_embedding_batch(texts)
+
+
+def build_queries(nodes) -> Dict[str, List[tuple]]:
+    questions = [(node.get_content(metadata_mode=MetadataMode.NONE), {node.node_id}) for node in nodes]
+
+    # rare capitalized terms of the answers, e.g. feature and product names
+    answers = {node.node_id: node.get_content(metadata_mode=MetadataMode.LLM) for node in nodes}
+    candidates = Counter()
+    for text in answers.values():
+        candidates.update(set(re.findall(r"\b[A-Z][A-Za-z]{3,}(?: [A-Z][A-Za-z]{3,})?\b", text)))
+
+    terms = []
+    for term, count in sorted(candidates.items()):
+        if count > 2 or not tokenize(term):
+            continue
+        relevant = {node_id for node_id, text in answers.items() if term in text}
+        terms.append((f"Tell me about {term}", relevant))
+
+    return {"questions": questions, "terms": terms}
+
+
+def evaluate(retriever, queries: List[tuple]) -> tuple:
+    recalls, timings = [], []
+    for query, relevant in queries:
+        start = time.perf_counter()
+        results = retriever.retrieve(query)
+        timings.append(time.perf_counter() - start)
+        retrieved = {result.node.node_id for result in results}
+        recalls.append(len(retrieved & relevant) / len(relevant))
+    return float(np.mean(recalls)), float(np.median(timings) * 1000), float(np.percentile(timings, 95) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", default="coredna", help="data directory of the corpus")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[2, 5])
+    parser.add_argument("--embed", choices=["openai", "hashing"], default="openai" if os.getenv("OPENAI_API_KEY") else "hashing")
+    args = parser.parse_args()
+
+    if args.embed == "openai":
+        from constants import OPENAI_EMBEDDING_MODEL
+        embed_model = MemoizedEmbedding(OPENAI_EMBEDDING_MODEL)
+    else:
+        embed_model = MemoizedEmbedding(HashingEmbedding())
+
+    nodes = load_data_from_files(directory=args.directory)
+    queries = build_queries(nodes)
+
+    collection = chromadb.EphemeralClient().get_or_create_collection(f"benchmark-{uuid.uuid4().hex[:8]}")
+    vector_store = ChromaVectorStore(chroma_collection=collection)
+    index = VectorStoreIndex(
+        nodes, storage_context=StorageContext.from_defaults(vector_store=vector_store), embed_model=embed_model
+    )
+    bm25 = BM25Index()
+    bm25.add(nodes)
+
+    print(f"{len(nodes)} nodes, embedding: {args.embed}, "
+          f"{len(queries['questions'])} question queries, {len(queries['terms'])} term queries")
+    print(f"{'queries':<12}{'top_k':>6}{'mode':>8}{'recall':>10}{'p50 ms':>10}{'p95 ms':>10}")
+
+    for top_k in args.top_k:
+        candidates = max(top_k, HYBRID_CANDIDATES)
+        retrievers = {
+            "vector": index.as_retriever(similarity_top_k=top_k),
+            "hybrid": HybridRetriever(
+                vector_retriever=index.as_retriever(similarity_top_k=candidates),
+                bm25_index=bm25,
+                similarity_top_k=top_k,
+                candidates=candidates,
+                rrf_k=HYBRID_RRF_K
+            ),
+        }
+        for name, query_set in queries.items():
+            # embed every query once before timing
+            evaluate(retrievers["vector"], query_set)
+            for mode, retriever in retrievers.items():
+                recall, p50, p95 = evaluate(retriever, query_set)
+                print(f"{name:<12}{top_k:>6}{mode:>8}{recall:>10.3f}{p50:>10.2f}{p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
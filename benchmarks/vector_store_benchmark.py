@@ -0,0 +1,107 @@
+"""
+Chroma against the memory-mapped NumPy vector store across collection sizes.
+
+Both stores are persisted to a temporary directory and filled with the same random nodes, then timed on:
+    add:   inserting the nodes in batches of 100
+    load:  opening the persisted store again, as a worker does at startup
+    query: top-k queries with random embeddings, p50 and p95
+
+Recall of the NumPy store is exact (brute force), Chroma uses an approximate HNSW index.
+
+Usage:
+    python benchmarks/vector_store_benchmark.py --sizes 500 2000 5000 --dimensions 1536
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from storage.NumpyVectorStore import NumpyVectorStore
+
+BATCH_SIZE = 100
+
+
+def make_nodes(count: int, dimensions: int, rng: np.random.Generator) -> list:
+    embeddings = rng.standard_normal((count, dimensions), dtype=np.float32)
+    return [
+        TextNode(text=f"Node {i}", metadata={"Source": f"https://example.com/page/{i % 50}"}, embedding=embedding.tolist())
+        for i, embedding in enumerate(embeddings)
+    ]
+
+
+def open_chroma(path: str) -> ChromaVectorStore:
+    collection = chromadb.PersistentClient(path=path).get_or_create_collection("benchmark")
+    return ChromaVectorStore(chroma_collection=collection)
+
+
+def open_numpy(path: str) -> NumpyVectorStore:
+    return NumpyVectorStore(persist_dir=path)
+
+
+def run(name: str, open_store, nodes: list, queries: np.ndarray, top_k: int) -> dict:
+    path = tempfile.mkdtemp(prefix=f"vector-store-{name}-")
+    try:
+        store = open_store(path)
+        start = time.perf_counter()
+        for i in range(0, len(nodes), BATCH_SIZE):
+            store.add(nodes[i:i + BATCH_SIZE])
+        add_seconds = time.perf_counter() - start
+        del store
+
+        start = time.perf_counter()
+        store = open_store(path)
+        # the first query pays for what the open deferred, e.g. loading the HNSW index
+        store.query(VectorStoreQuery(query_embedding=queries[0].tolist(), similarity_top_k=top_k))
+        load_seconds = time.perf_counter() - start
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k))
+            timings.append(time.perf_counter() - start)
+
+        return {
+            "add_ms": add_seconds * 1000,
+            "load_ms": load_seconds * 1000,
+            "p50_ms": float(np.median(timings) * 1000),
+            "p95_ms": float(np.percentile(timings, 95) * 1000),
+        }
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--dimensions", type=int, default=1536, help="embedding size, 1536 for text-embedding-3-small")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    stores = {"chroma": open_chroma, "numpy": open_numpy}
+
+    print(f"{'nodes':>7}{'store':>8}{'add ms':>10}{'load ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for size in args.sizes:
+        nodes = make_nodes(size, args.dimensions, rng)
+        queries = rng.standard_normal((args.queries, args.dimensions), dtype=np.float32)
+        for name, open_store in stores.items():
+            result = run(name, open_store, nodes, queries, args.top_k)
+            print(f"{size:>7}{name:>8}{result['add_ms']:>10.1f}{result['load_ms']:>10.1f}"
+                  f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
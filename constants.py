@@ -69,25 +69,21 @@ ACTION_AGENT_PROMPT = """
 You are an AI agent responsible for handling user requests with the following tools at your disposal, when calling the tools, DO NOT wrap the parameters with an input property:
 
 HTTP Tool: Use this to make HTTP requests to URLs. This tool requires 2 parameters, parameter 1: url is a string, parameter2: method is a string, parameter3: data is a JSON object
-Tag_Exists Tool: Use this to check if a specific tag, such as a form element, exists on a given URL. This tool requires 2 parameters, parameter1: tag_name is a string and parameter2: url is a string.
-Fetch_Field Tool: Use this to fetch specific input fields from a URL. This tool requires 2 parameters, parameter1: input_name is a string, parameter2: url is a string.
+Analyze_Form Tool: Use this to read the forms of a URL in a single call. This tool requires 1 parameter, parameter1: url is a string. It returns, for each form, its embedCode, the fields to ask the user about (name, label, placeholder, required, options) and the hidden fields.
 If the user requests to download or fetch something from a URL:
 
-Use the Tag_Exists tool to check if the URL contains a form element
+Call the Analyze_Form tool once with the URL, do not call it again for the same URL.
 
-If the form exists:
+If the returned forms list is empty, there is no form on the page.
 
-Use the Fetch_Field tool to retrieve the following fields:
-All input fields with name starting with 'field_', except the one that has the value 57a3995e-d350-41cf-a5b7-c949acd1d9d9
-An input field with the name embedCode.
-For each input field starting with field_:
+If a form exists:
 
-Extract the keyword from the field name and formulate a relevant question to ask the user.
-Example: If the field is field_1376: Your work email, ask the user, "Could you please provide your work email address?"
-Collect the user's answer for each question.
-For the embedCode input field:
+Keep the embedCode of the form.
+For each entry of its fields list (the hidden fields are never asked about):
 
-Extract and store the value of this field.
+Use the label or placeholder of the field to formulate a relevant question to ask the user, mention the options when the field has some.
+Example: If the field is field_1376 with the label Your work email, ask the user, "Could you please provide your work email address?"
+Collect the user's answer for each question.
 Once all relevant questions have been asked:
 
 Compile the collected responses from the user.
@@ -99,11 +95,150 @@ then pass this JSON object to the sharpspring tool, the sharpspring tool should
 pass this URL to the http tool, the url parameter is the URL generated by sharpspring tool, method is get, do not pass in data
 """
 
+FAQ_REPHRASE_PROMPT_TMPL = (
+    "A user asked the following question.\n"
+    "Question: {query}\n"
+    "Answer it using only the curated answer below, rephrase it so it reads as a direct answer to the question. "
+    "Keep all the facts and links, do not add any information.\n"
+    "---------------------\n"
+    "{answer}\n"
+    "---------------------\n"
+    "Answer: "
+)
+
+# Guide downloads, "workflow" runs the DownloadGuideWorkflow for download requests with a URL, "agent" leaves them to the agents
+GUIDE_MODE = os.getenv('GUIDE_MODE', 'workflow')
+GUIDE_QUESTIONS_PROMPT_TMPL = (
+    "A visitor wants to download a guide and has to fill in the form fields below.\n"
+    "Write one short, friendly question per field to ask the visitor, mention the choices when a field has some.\n"
+    "Fields:\n"
+    "{fields}\n"
+    "Answer with a JSON array of strings only, one question per field, in the same order."
+)
+
+# Descriptions of the sub agents, used by the LLM router and embedded by the fast router
+RAG_AGENT_TOOL_DESCRIPTION = (
+    "This tool uses the rag_agent to answer queries about CoreDNA, its platform features, pricing, "
+    "integrations, documentation and support, from the indexed website and documents"
+)
+ACTION_AGENT_TOOL_DESCRIPTION = (
+    "This tool uses the action_agent to check if a web page has a form, read the form "
+    "and input fields of a web page, send HTTP requests and submit forms to download content"
+)
+
 # Model config
 TOP_K = 2
-CHROMA_DB_PATH = os.path.join(PROJECT_ROOT, 'chroma_db')
+# "hybrid" fuses BM25 keyword search with the vector search, "vector" uses the vector search only
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')
+# candidates retrieved by each search before fusion, and the reciprocal rank fusion constant
+HYBRID_CANDIDATES = 10
+HYBRID_RRF_K = 60
+# Context compression of the retrieved nodes before the QA prompt: sentences below the similarity floor with
+# the query and sentences repeated across chunks (navigation, calls to action) are dropped, within a token budget
+CONTEXT_COMPRESSION = os.getenv('CONTEXT_COMPRESSION', 'true').lower() in ('1', 'true', 'yes')
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1200))
+# cosine similarity of text-embedding-ada-002, unrelated text rarely scores below 0.7
+CONTEXT_MIN_SIMILARITY = float(os.getenv('CONTEXT_MIN_SIMILARITY', 0.75))
+# sentences waiting to be embedded off the query path, more are scored by their node until a later query
+CONTEXT_EMBED_QUEUE_SIZE = int(os.getenv('CONTEXT_EMBED_QUEUE_SIZE', 2048))
+CHROMA_DB_PATH = os.getenv('CHROMA_DB_PATH', os.path.join(PROJECT_ROOT, 'chroma_db'))
 DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
+EMBEDDING_CACHE_PATH = os.path.join(CHROMA_DB_PATH, 'embedding_cache.sqlite3')
+# query embeddings kept in memory by every process, keyed by the query string
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', 2048))
 CHUNK_SIZE = 1024
+# "chroma" or "numpy", numpy keeps the embeddings in a memory-mapped matrix, faster for small collections
+VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'chroma')
+
+# Sitemap crawler
+CRAWLER_CONCURRENCY = int(os.getenv('CRAWLER_CONCURRENCY', 32))
+CRAWLER_PER_HOST_CONCURRENCY = int(os.getenv('CRAWLER_PER_HOST_CONCURRENCY', 8))
+# minimum seconds between two requests to the same host
+CRAWLER_PER_HOST_DELAY = float(os.getenv('CRAWLER_PER_HOST_DELAY', 0))
+CRAWLER_TIMEOUT = 30
+CRAWLER_CONNECT_TIMEOUT = 10
+CRAWLER_MAX_RETRIES = 3
+CRAWLER_BACKOFF = 0.5
+CRAWLER_MAX_SITEMAP_DEPTH = 3
+# larger pages and sitemaps are skipped
+CRAWLER_MAX_RESPONSE_BYTES = int(os.getenv('CRAWLER_MAX_RESPONSE_BYTES', 20 * 1024 * 1024))
+
+# Streaming ingestion pipeline
+INGEST_EMBED_BATCH_SIZE = int(os.getenv('INGEST_EMBED_BATCH_SIZE', 64))
+# capacity of the queues between the pipeline stages, bounds the number of pages held in memory
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 16))
+# ingestion jobs running at the same time, and finished jobs kept for GET /jobs/<id>
+INGEST_JOB_WORKERS = int(os.getenv('INGEST_JOB_WORKERS', 2))
+INGEST_JOB_HISTORY = 100
+
+# Index service, the single process owning the collections, shared by all gunicorn workers.
+# A unix socket path or host:port, a socket in the temp directory is used when missing.
+INDEX_SERVICE_ADDRESS = os.getenv('INDEX_SERVICE_ADDRESS')
+
+# Collections warmed at boot (index, agents, router tool index), comma separated.
+# The first one is the default collection.
+PRELOAD_COLLECTIONS = [name.strip() for name in os.getenv('PRELOAD_COLLECTIONS', '').split(',') if name.strip()]
+
+# Router, "fast" routes confident turns straight to an agent without the LLM router call, "llm" always uses the LLM
+ROUTER_MODE = os.getenv('ROUTER_MODE', 'fast')
+ROUTER_FAST_CONFIDENCE = float(os.getenv('ROUTER_FAST_CONFIDENCE', 0.8))
+
+# Curated QA pairs answered directly, without retrieval or agents
+FAQ_FILE_NAMES = ['Cleaned_QA_Pairs.csv']
+FAQ_QUESTION_COLUMN = 'Question'
+FAQ_ANSWER_COLUMN = 'Answer'
+FAQ_FUZZY_THRESHOLD = float(os.getenv('FAQ_FUZZY_THRESHOLD', 0.85))
+FAQ_EMBEDDING_THRESHOLD = float(os.getenv('FAQ_EMBEDDING_THRESHOLD', 0.95))
+# pass the curated answer through the LLM to fit the wording of the question
+FAQ_REPHRASE = os.getenv('FAQ_REPHRASE', 'false').lower() in ('1', 'true', 'yes')
+
+# Agent sessions, every visitor session gets its own agent stack
+SESSION_MAX_LIVE = int(os.getenv('SESSION_MAX_LIVE', 1000))
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 30 * 60))
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', 256 * 1024 * 1024))
+# Approximate footprint of an agent stack (agents, tools, prompts) before any chat history
+SESSION_BASE_BYTES = 64 * 1024
+
+# Chat memory of the agents, persisted per session and agent. "sqlite" survives worker restarts, "memory" is process local
+MEMORY_BACKEND = os.getenv('MEMORY_BACKEND', 'sqlite')
+MEMORY_DB_PATH = os.getenv('MEMORY_DB_PATH', os.path.join(CHROMA_DB_PATH, 'conversations.sqlite3'))
+# tokens of history handed to an agent, older turns are folded into a rolling summary down to MEMORY_KEEP_RATIO of it
+MEMORY_TOKEN_LIMIT = int(os.getenv('MEMORY_TOKEN_LIMIT', 3000))
+MEMORY_KEEP_RATIO = 0.5
+# conversations not updated for this long are deleted
+MEMORY_TTL_SECONDS = int(os.getenv('MEMORY_TTL_SECONDS', 7 * 24 * 60 * 60))
+MEMORY_SUMMARY_PROMPT_TMPL = (
+    "Summary of the conversation so far:\n"
+    "{summary}\n"
+    "---------------------\n"
+    "New messages:\n"
+    "{transcript}\n"
+    "---------------------\n"
+    "Update the summary with the new messages in a few sentences. Keep the visitor's needs, the facts, "
+    "links and form details given, and any open question. Answer with the summary only."
+)
+
+# Semantic answer cache, consulted before the router agent on the first turn of a session
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('ANSWER_CACHE_SIMILARITY_THRESHOLD', 0.95))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv('ANSWER_CACHE_TTL_SECONDS', 60 * 60))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 500))
+# Concurrent first turns asking the same question share one agent run, waiting at most this long for it
+QUERY_COALESCE_WAIT_SECONDS = float(os.getenv('QUERY_COALESCE_WAIT_SECONDS', 120))
+
+# Outbound HTTP requests of the agent tools, pooled keep-alive sessions per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 20))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))
+HTTP_BACKOFF = 0.5
+HTTP_MAX_RESPONSE_BYTES = int(os.getenv('HTTP_MAX_RESPONSE_BYTES', 10 * 1024 * 1024))
+HTTP_PER_HOST_CONCURRENCY = int(os.getenv('HTTP_PER_HOST_CONCURRENCY', 8))
+
+# Pages fetched by the webpage scanner tools, kept per worker with their parsed DOM.
+# Served from memory within the TTL, revalidated with ETag/Last-Modified after it.
+PAGE_CACHE_TTL_SECONDS = int(os.getenv('PAGE_CACHE_TTL_SECONDS', 5 * 60))
+PAGE_CACHE_MAX_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# larger pages are fetched every time
+PAGE_CACHE_MAX_PAGE_BYTES = int(os.getenv('PAGE_CACHE_MAX_PAGE_BYTES', 4 * 1024 * 1024))
 
 
 # Open AI
@@ -121,4 +256,13 @@ COREDNA_API_KEY = os.getenv('COREDNA_API_KEY')
 SIMPLE_DIRECTORY_READER_SUPPORTED_TYPES = ['.csv','.docx','.epub','.hwp','.ipynb','.jpeg', 
                                            '.jpg ','mbox','.md','.mp3','.mp4','.pdf','.png','.ppt','.pptm','.pptx']
 
-SHARPSPRING_ENDPOINT = "https://app-3QN63QD29U.marketingautomation.services/webforms/receivePostback/MzawMDE1sjQxBwA/"
\ No newline at end of file
+# Tabular files loaded one node per row, keyed by data directory (usually the collection name).
+# embed: the column embedded and used as node text, content: the columns sent to the LLM with it,
+# source: the optional column holding the source URL. CSVs without these columns are read as plain text.
+CSV_COLUMN_MAPPINGS = {
+    "default": {"embed": "Question", "content": ["Answer"], "source": "Source"},
+}
+
+SHARPSPRING_ENDPOINT = os.getenv(
+    'SHARPSPRING_ENDPOINT', "https://app-3QN63QD29U.marketingautomation.services/webforms/receivePostback/MzawMDE1sjQxBwA/"
+)
\ No newline at end of file
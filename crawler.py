@@ -0,0 +1,338 @@
+import asyncio
+import random
+import time
+import xml.etree.ElementTree as ET
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from llama_index.core import Document
+
+from constants import (
+    CRAWLER_CONCURRENCY, CRAWLER_PER_HOST_CONCURRENCY, CRAWLER_PER_HOST_DELAY,
+    CRAWLER_TIMEOUT, CRAWLER_CONNECT_TIMEOUT, CRAWLER_MAX_RETRIES, CRAWLER_BACKOFF, CRAWLER_MAX_SITEMAP_DEPTH,
+    CRAWLER_MAX_RESPONSE_BYTES
+)
+
+"""
+Asynchronous sitemap crawler.
+
+Pages are fetched concurrently with a global concurrency limit, a per-host politeness limit
+(concurrent requests and minimum delay between two requests to the same host), timeouts and
+retries with exponential backoff. Sitemap indexes are followed recursively.
+"""
+
+SITEMAP_XML_SCHEMA = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+
+def parse_sitemap(raw_sitemap: bytes, domain: Optional[str] = None) -> List[Dict[str, Optional[str]]]:
+
+    """
+    Parse a sitemap and return its URL entries.
+
+    Args:
+        raw_sitemap (bytes): The sitemap XML.
+        domain (Optional[str]): Only keep the URLs containing this domain, same filter as SitemapReader.
+
+    Returns:
+        List[Dict[str, Optional[str]]]: One {"loc": ..., "lastmod": ...} dictionary per URL, lastmod is None when missing.
+    """
+
+    sitemap = ET.fromstring(raw_sitemap)
+    entries = []
+
+    for url in sitemap.findall(f"{{{SITEMAP_XML_SCHEMA}}}url"):
+        loc = url.find(f"{{{SITEMAP_XML_SCHEMA}}}loc")
+        if loc is None or not loc.text:
+            continue
+
+        location = loc.text.strip()
+        if domain is not None and domain not in location:
+            continue
+
+        lastmod = url.find(f"{{{SITEMAP_XML_SCHEMA}}}lastmod")
+        entries.append({
+            "loc": location,
+            "lastmod": lastmod.text.strip() if lastmod is not None and lastmod.text else None
+        })
+
+    return entries
+
+
+# Status codes worth retrying, anything else is returned to the caller as is
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CrawlResponse:
+    def __init__(self, url: str, status: int, headers: Dict[str, str], body: bytes, encoding: Optional[str]) -> None:
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.encoding = encoding or "utf-8"
+
+    @property
+    def text(self) -> str:
+        return self.body.decode(self.encoding, errors="replace")
+
+
+class HostLimiter:
+    def __init__(self, concurrency: int, delay: float) -> None:
+
+        """
+        Initialize the HostLimiter.
+
+        Args:
+            concurrency (int): Maximum number of concurrent requests to the host.
+            delay (float): Minimum number of seconds between the start of two requests to the host.
+        """
+
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.delay = delay
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait_turn(self) -> None:
+        if self.delay <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.delay
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class SitemapCrawler:
+    def __init__(
+            self,
+            concurrency: int = CRAWLER_CONCURRENCY,
+            per_host_concurrency: int = CRAWLER_PER_HOST_CONCURRENCY,
+            per_host_delay: float = CRAWLER_PER_HOST_DELAY,
+            timeout: float = CRAWLER_TIMEOUT,
+            connect_timeout: float = CRAWLER_CONNECT_TIMEOUT,
+            max_retries: int = CRAWLER_MAX_RETRIES,
+            backoff: float = CRAWLER_BACKOFF,
+            max_sitemap_depth: int = CRAWLER_MAX_SITEMAP_DEPTH,
+            max_response_bytes: int = CRAWLER_MAX_RESPONSE_BYTES,
+    ) -> None:
+
+        """
+        Initialize the SitemapCrawler.
+
+        Args:
+            concurrency (int): Maximum number of requests in flight.
+            per_host_concurrency (int): Maximum number of requests in flight to a single host.
+            per_host_delay (float): Minimum number of seconds between two requests to a single host.
+            timeout (float): Total timeout of a request in seconds.
+            connect_timeout (float): Connection timeout in seconds.
+            max_retries (int): Number of retries on connection errors, timeouts and retryable status codes.
+            backoff (float): Base delay of the exponential backoff between retries, in seconds.
+            max_sitemap_depth (int): Maximum nesting of sitemap indexes.
+            max_response_bytes (int): Larger responses raise ConnectionError without being retried.
+        """
+
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_delay = per_host_delay
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_sitemap_depth = max_sitemap_depth
+        self.max_response_bytes = max_response_bytes
+
+        # created per event loop in `session`
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._hosts: Dict[str, HostLimiter] = {}
+
+    def session(self) -> aiohttp.ClientSession:
+        """Create the HTTP session (and the limits bound to the running event loop) used for a crawl."""
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._hosts = {}
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host_concurrency)
+        return aiohttp.ClientSession(timeout=self.timeout, connector=connector)
+
+    def _host_limiter(self, url: str) -> HostLimiter:
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = HostLimiter(self.per_host_concurrency, self.per_host_delay)
+        return self._hosts[host]
+
+    async def _read_body(self, url: str, response: aiohttp.ClientResponse) -> bytes:
+        chunks, size = [], 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > self.max_response_bytes:
+                raise ConnectionError(f"Response of {url} is larger than {self.max_response_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, headers: Optional[Dict[str, str]] = None) -> CrawlResponse:
+
+        """
+        GET a URL within the concurrency limits, retrying with exponential backoff.
+
+        Args:
+            session (aiohttp.ClientSession): The session returned by `session()`.
+            url (str): The URL to fetch.
+            headers (Optional[Dict[str, str]]): Extra request headers, e.g. for conditional requests.
+
+        Returns:
+            CrawlResponse: The last response received, its status may be an error status.
+
+        Raises:
+            ConnectionError: If the URL could not be fetched after all the retries.
+        """
+
+        host_limiter = self._host_limiter(url)
+        attempt = 0
+
+        while True:
+            try:
+                async with host_limiter.semaphore, self._semaphore:
+                    await host_limiter.wait_turn()
+                    async with session.get(url, headers=headers) as response:
+                        body = await self._read_body(url, response)
+                        result = CrawlResponse(
+                            url=str(response.url),
+                            status=response.status,
+                            headers=dict(response.headers),
+                            body=body,
+                            encoding=response.charset
+                        )
+                if result.status not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return result
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                if attempt >= self.max_retries:
+                    raise ConnectionError(f"Failed to fetch {url}: {error!r}")
+
+            attempt += 1
+            # exponential backoff with full jitter
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    async def fetch_sitemap_entries(
+            self,
+            session: aiohttp.ClientSession,
+            sitemap_url: str,
+            domain: Optional[str] = None,
+            depth: int = 0,
+            visited: Optional[set] = None,
+    ) -> List[Dict[str, Optional[str]]]:
+
+        """
+        Download a sitemap and return its URL entries, following nested sitemap indexes.
+
+        Args:
+            session (aiohttp.ClientSession): The session returned by `session()`.
+            sitemap_url (str): The URL of the sitemap or sitemap index.
+            domain (Optional[str]): Only keep the page URLs containing this domain.
+
+        Returns:
+            List[Dict[str, Optional[str]]]: One {"loc": ..., "lastmod": ...} dictionary per page.
+
+        Raises:
+            ConnectionError: If the top level sitemap cannot be downloaded.
+        """
+
+        visited = visited if visited is not None else set()
+        if sitemap_url in visited:
+            return []
+        visited.add(sitemap_url)
+
+        response = await self.fetch(session, sitemap_url)
+        if response.status != 200:
+            raise ConnectionError(f"Failed to access the sitemap URL: {sitemap_url}. Status code: {response.status}")
+
+        root = ET.fromstring(response.body)
+        if root.tag != f"{{{SITEMAP_XML_SCHEMA}}}sitemapindex":
+            return parse_sitemap(response.body, domain)
+
+        if depth >= self.max_sitemap_depth:
+            print(f"Sitemap index {sitemap_url} exceeds the maximum depth, skipping its children")
+            return []
+
+        children = []
+        for sitemap in root.findall(f"{{{SITEMAP_XML_SCHEMA}}}sitemap"):
+            loc = sitemap.find(f"{{{SITEMAP_XML_SCHEMA}}}loc")
+            if loc is not None and loc.text:
+                children.append(loc.text.strip())
+
+        results = await asyncio.gather(
+            *[self.fetch_sitemap_entries(session, child, domain, depth + 1, visited) for child in children],
+            return_exceptions=True
+        )
+
+        entries = []
+        for child, result in zip(children, results):
+            if isinstance(result, BaseException):
+                # a broken child sitemap should not fail the whole crawl
+                print(f"Failed to load nested sitemap {child}: {result}")
+                continue
+            entries.extend(result)
+        return entries
+
+    async def crawl(
+            self,
+            sitemap_url: str,
+            domain: str,
+            on_document: Callable[[Document], Awaitable[None]],
+    ) -> Dict[str, int]:
+
+        """
+        Crawl every page of a sitemap and hand each page over as soon as it is fetched.
+
+        Args:
+            sitemap_url (str): The URL of the sitemap to crawl.
+            domain (str): The domain to filter the sitemap URLs.
+            on_document (Callable[[Document], Awaitable[None]]): Coroutine called with the Document of every page fetched.
+
+        Returns:
+            Dict[str, int]: The number of pages fetched and failed.
+        """
+
+        counts = {"fetched": 0, "failed": 0}
+
+        async with self.session() as session:
+            entries = await self.fetch_sitemap_entries(session, sitemap_url, domain)
+            # same deduplication as AsyncWebPageReader
+            urls = list(dict.fromkeys(entry["loc"] for entry in entries))
+
+            # a page holds its slot until on_document returns, so a slow consumer slows the crawl down
+            # instead of piling up fetched pages in memory
+            pages_in_flight = asyncio.Semaphore(self.concurrency)
+
+            async def crawl_page(url: str):
+                async with pages_in_flight:
+                    try:
+                        response = await self.fetch(session, url)
+                    except ConnectionError as error:
+                        print(f"Error fetching page from {url}: {error}")
+                        counts["failed"] += 1
+                        return
+
+                    if response.status != 200:
+                        print(f"Error fetching page from {url}: status code {response.status}")
+                        counts["failed"] += 1
+                        return
+
+                    counts["fetched"] += 1
+                    # same Document shape as SitemapReader
+                    await on_document(Document(text=response.text, extra_info={"Source": response.url}))
+
+            await asyncio.gather(*[crawl_page(url) for url in urls])
+
+        return counts
+
+    async def aload_data(self, sitemap_url: str, domain: str) -> List[Document]:
+        """Crawl a sitemap and return the Documents of its pages."""
+        documents: List[Document] = []
+
+        async def collect(document: Document):
+            documents.append(document)
+
+        await self.crawl(sitemap_url, domain, collect)
+        return documents
+
+    def load_data(self, sitemap_url: str, domain: str) -> List[Document]:
+        """Synchronous version of `aload_data`."""
+        return asyncio.run(self.aload_data(sitemap_url, domain))
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+
+"""
+Gunicorn configuration.
+
+The index service is started first, then the app is imported once in the master (preload_app),
+which warms the PRELOAD_COLLECTIONS before the workers are forked. The workers all talk to the
+index service instead of opening their own Chroma clients.
+
+The workers are threaded (gthread). A chat turn waits seconds on the LLM and a streamed answer holds its
+connection until the last token: 3 sync workers would block every other request behind them, and be
+killed by the default 30s timeout in the middle of a slow answer. Each worker serves `threads` requests
+at a time and keeps notifying the master while they wait, so `timeout` only catches a hung worker. It is
+set to 120s, above the slowest turn, so the worker class can be switched back to sync (e.g. with
+--worker-class) without killing long answers.
+
+The Prometheus metrics of the workers and of the index service are written to PROMETHEUS_MULTIPROC_DIR,
+/metrics of any worker aggregates them. It has to be set before prometheus_client is first imported.
+"""
+
+_metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), f"prometheus-{os.getpid()}")
+)
+# the counters of a previous run must not be added to this one
+shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir)
+
+from prometheus_client import multiprocess
+from storage.IndexService import start_index_service
+
+bind = "0.0.0.0:8000"
+workers = 3
+worker_class = "gthread"
+threads = 8
+timeout = 120
+preload_app = True
+
+# preload_app imports the app before the on_starting hook, so the service is started here
+_index_service = start_index_service()
+
+
+def on_exit(server):
+    _index_service.shutdown()
+
+
+def child_exit(server, worker):
+    # drop the live gauges of the dead worker, its counters and histograms are kept
+    multiprocess.mark_process_dead(worker.pid)
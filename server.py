@@ -1,106 +1,451 @@
-import os, traceback
-from typing import Dict
+import os, time, traceback
+import uuid
+from typing import Optional
 from dotenv import load_dotenv
-from multiprocessing import Lock
-from multiprocessing.managers import BaseManager
 
 # from agent import MultiDocumentReActAgent, ActionAnalyzerAgent
 from agent.ActionAgent import ActionAgent
 from agent.MultiDocumentReActAgent import MultiDocumentReActAgent
 from agent.RouterAgent import RouterAgent
+from agent.FastRouter import FastRouter, RouteDecision
+from agent.SessionRegistry import AgentSession, SessionRegistry
+from agent.StreamingChat import stream_agent_events, format_sse
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from llama_index.agent.openai import OpenAIAgent
-from constants import ROUTER_AGENT_PROMPT
-from storage.Index import Index
-from utils import load_data_from_sitemap
+from llama_index.core.llms import ChatMessage, MessageRole
+from constants import (
+    ROUTER_AGENT_PROMPT, PRELOAD_COLLECTIONS, ROUTER_MODE, ROUTER_FAST_CONFIDENCE,
+    RAG_AGENT_TOOL_DESCRIPTION, ACTION_AGENT_TOOL_DESCRIPTION, FAQ_REPHRASE, FAQ_REPHRASE_PROMPT_TMPL, OPENAI_MODEL,
+    SESSION_MAX_LIVE, SESSION_TTL_SECONDS, SESSION_MAX_BYTES, SESSION_BASE_BYTES,
+    ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES,
+    GUIDE_MODE, QUERY_COALESCE_WAIT_SECONDS
+)
+from storage.AnswerCache import SemanticAnswerCache
+from storage.ConversationMemory import create_memory, memory_stats, get_conversation_store
+from storage.ContextCompressor import compression_stats
+from storage.EmbeddingCache import get_cached_embed_model
+from storage.FAQIndex import normalize_question
+from storage.SingleFlight import SingleFlight
+from storage.IndexService import RemoteIndex, get_index_service
+from storage.IngestionJobs import SUCCEEDED
+from tools.http_client import http_client
+from tools.webpage_scanner_tool import page_cache
+from workflow.DownloadGuideWorkflow import DownloadGuideSession, guide_request_url
+from tracing import instrument, start_trace, finish_trace, current_trace, traced_stream, render_metrics
 import logging
 # Load environment variables
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv('OPENAI_API_KEY')
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS, cross_origin
 
-# Global dictionary to store Index and ReActAgent instances for different collections
-index_handlers: Dict[str, Index] = {}
+# Collections, ingestion jobs and the default collection live in the index service shared by all workers
+
+# Answers to opening questions, shared by all sessions of a collection
+answer_cache = SemanticAnswerCache(
+    # the query embedding LRU is shared with the fast router
+    embed_model=get_cached_embed_model(),
+    similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES
+)
+
+# Opening questions asked by several sessions at once are answered by a single agent run, per worker
+query_flights = SingleFlight(wait_seconds=QUERY_COALESCE_WAIT_SECONDS)
+
+# Sends confident turns straight to the rag or action agent, without the router LLM call
+fast_router = FastRouter(
+    descriptions={"rag_agent": RAG_AGENT_TOOL_DESCRIPTION, "action_agent": ACTION_AGENT_TOOL_DESCRIPTION},
+    confidence_threshold=ROUTER_FAST_CONFIDENCE
+)
+
+def initialize_index(collection_name: str, make_default: bool = True) -> RemoteIndex:
+
+    """Initialize the vector index for a given collection name, in the index service."""
+
+    get_index_service().initialize(collection_name, make_default)
+    return RemoteIndex(get_index_service(), collection_name)
+
+
+def create_agent_session(session_id: str, collection_name: str) -> AgentSession:
+
+    """Build the router/rag/action agent stack of a session over the shared collection."""
+
+    index_handler = RemoteIndex(get_index_service(), collection_name)
+    # the conversations are persisted, a session rebuilt by another worker or after a restart continues them
+    rag_agent = MultiDocumentReActAgent(index_handler=index_handler).create_openai_agent(
+        memory=create_memory(collection_name, session_id, "rag_agent", llm=OPENAI_MODEL)
+    )
+    action_agent = ActionAgent(index_handler=index_handler).create_openai_agent(
+        memory=create_memory(collection_name, session_id, "action_agent", llm=OPENAI_MODEL)
+    )
+
+    rag_tool = QueryEngineTool(
+        query_engine=rag_agent,
+        metadata=ToolMetadata(
+            name="rag_agent_tool",
+            description=RAG_AGENT_TOOL_DESCRIPTION
+        ),
+    )
+
+    action_tool = QueryEngineTool(
+        query_engine=action_agent,
+        metadata=ToolMetadata(
+            name="action_agent_tool",
+            description=ACTION_AGENT_TOOL_DESCRIPTION
+        ),
+    )
+
+    router_agent = RouterAgent([rag_tool, action_tool]).create_agent(
+        memory=create_memory(collection_name, session_id, "router_agent", llm=OPENAI_MODEL)
+    )
+
+    return AgentSession(
+        session_id=session_id,
+        collection_name=collection_name,
+        router_agent=router_agent,
+        agents={
+            "rag_agent": rag_agent,
+            "action_agent": action_agent
+        }
+    )
 
-def initialize_index(collection_name: str):
 
-    """Initialize the vector index for a given collection name."""
+session_registry = SessionRegistry(
+    factory=create_agent_session,
+    max_sessions=SESSION_MAX_LIVE,
+    ttl_seconds=SESSION_TTL_SECONDS,
+    max_bytes=SESSION_MAX_BYTES,
+    session_base_bytes=SESSION_BASE_BYTES
+)
 
-    if (collection_name in index_handlers):
-        return index_handlers[collection_name]
-    
-    # Create an instance of the Index class with the specified collection name
-    index_handler = Index(collection_name=collection_name)
-    # Load or create the index, this should return an instance of VectorIndex
-    index_handler.load_or_create_index()
 
-    # Store the index handler in the global dictionary
-    index_handlers[collection_name] = index_handler
+def get_agent_session(data: dict):
+
+    """
+    Return the agent session for a query request, building it on first use.
+
+    Returns:
+        tuple: (session, None) on success, (None, (response, status)) if no collection is initialized.
+    """
+
+    index_service = get_index_service()
+    collection_name = data.get('collection_name') or index_service.get_default_collection()
+    if not collection_name or not index_service.has_collection(collection_name):
+        logger.error("Agent not initialized")
+        return None, (jsonify({"error": "Agent is not initialized. Please initialize the index and agent first."}), 400)
+
+    # Clients without a session id get a new one, they should send it back on the next turn
+    session_id = data.get('session_id') or str(uuid.uuid4())
+    return session_registry.get_or_create(session_id, collection_name), None
+
+
+def lookup_cached_answer(session: AgentSession, query: str):
+
+    """
+    Consult the answer cache on the first turn of a session.
+
+    Follow-up turns depend on the conversation so they always go through the agents.
+    On a hit the turn is recorded in the router memory so the conversation can continue from it.
+
+    Returns:
+        tuple: (cached answer or None, query embedding or None, index version or None), the embedding and
+        the version the turn started at are passed to `store_answer`.
+    """
+
+    if session.router_agent.chat_history:
+        return None, None, None
+
+    # the index may have changed through another worker
+    version = get_index_service().get_version(session.collection_name)
+    answer_cache.sync_version(session.collection_name, version)
+    answer, embedding = answer_cache.lookup(session.collection_name, query)
+    if answer is not None:
+        record_turn(session, query, answer)
+    return answer, embedding, version
+
+
+def lookup_faq_answer(session: AgentSession, query: str) -> Optional[dict]:
+
+    """
+    Match the query against the curated QA pairs of the collection.
+
+    Returns:
+        Optional[dict]: The matched question, answer, score and method, None to answer with the agents.
+    """
+
+    match = get_index_service().match_faq(session.collection_name, query)
+    if match is not None:
+        logger.info(f"Query matched curated question ({match['method']}, {match['score']:.2f}): {match['question']}")
+    return match
+
+
+def faq_answer_deltas(query: str, match: dict):
+    """Yield the curated answer, or the LLM rephrasing of it token by token when FAQ_REPHRASE is on."""
+    if not FAQ_REPHRASE:
+        yield match["answer"]
+        return
+    prompt = FAQ_REPHRASE_PROMPT_TMPL.format(query=query, answer=match["answer"])
+    for chunk in OPENAI_MODEL.stream_complete(prompt):
+        yield chunk.delta or ""
+
+
+def record_turn(session: AgentSession, query: str, answer: str) -> None:
+    """Write a turn answered without the router agent to its memory, so the conversation can continue from it."""
+    session.router_agent.memory.put(ChatMessage(role=MessageRole.USER, content=query))
+    session.router_agent.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+
+
+def route_turn(session: AgentSession, query: str) -> RouteDecision:
+
+    """
+    Decide which agent answers a turn.
+
+    Returns:
+        RouteDecision: agent_name is the key of the agent in `session.agents`, None to go through the router agent.
+    """
+
+    if ROUTER_MODE != "fast":
+        return RouteDecision(None, 0.0, {}, ["llm mode"])
+
+    decision = fast_router.classify(query, has_history=bool(session.router_agent.chat_history))
+    logger.info(f"Routing decision: {decision.to_dict()}")
+    return decision
+
+
+def guide_key(session: AgentSession) -> str:
+    return f"{session.collection_name}:{session.session_id}:guide"
+
+
+def load_guide(session: AgentSession) -> Optional[DownloadGuideSession]:
+
+    """
+    Return the guide download in progress of a session.
+
+    The progress is kept in the conversation store, any worker can serve the next turn: the live run of
+    this worker is used when it is the latest, else the download is resumed from the stored state.
+    """
+
+    state, version = get_conversation_store().get(guide_key(session))
+    if state is None or session.guide is None or session.guide_version != version:
+        if session.guide is not None:
+            # finished or continued by another worker
+            session.guide.close()
+        session.guide = DownloadGuideSession(state=state) if state is not None else None
+        session.guide_version = version
+    return session.guide
+
+
+def save_guide(session: AgentSession, result: dict) -> None:
+    """Store the progress of the guide download after a turn, or remove it once the download ended."""
+    store = get_conversation_store()
+    if result["status"] != "question":
+        store.delete(guide_key(session))
+        session.guide_version = 0
+    elif store.put(guide_key(session), session.guide.state, session.guide_version):
+        session.guide_version += 1
+    else:
+        # another worker answered a turn of the same download meanwhile, its progress wins
+        logger.warning(f"Guide download of session {session.session_id} was advanced by another worker")
+        session.guide.close()
+        session.guide = None
+
+
+def start_guide(session: AgentSession, url: str) -> dict:
+    """Start the guide download of a page in a session, returns the first question or the final result."""
+    if load_guide(session) is not None:
+        session.guide.close()
+    session.guide = DownloadGuideSession()
+    result = session.guide.start(url)
+    save_guide(session, result)
+    logger.info(f"Guide download started on {url}: {result['status']}")
+    return result
+
+
+def guide_turn(session: AgentSession, query: str) -> Optional[dict]:
+
+    """
+    Answer a turn with the guide download workflow instead of the agents.
+
+    Turns go to the workflow while a guide download is in progress, and a new one is started when
+    the query asks for the guide of a URL.
+
+    Returns:
+        Optional[dict]: The workflow's {"status", "message"}, None to answer with the agents.
+    """
+
+    guide = load_guide(session)
+    if guide is not None and guide.active:
+        result = guide.answer(query)
+        save_guide(session, result)
+    elif GUIDE_MODE == "workflow" and guide_request_url(query):
+        result = start_guide(session, guide_request_url(query))
+    else:
+        return None
+
+    record_turn(session, query, result["message"])
+    return result
+
+
+def flight_key(session: AgentSession, query: str) -> tuple:
+    return session.collection_name, normalize_question(query)
+
+
+def agent_turn(session: AgentSession, query: str) -> str:
+    """Answer a turn with the agents, through the fast router or the router agent."""
+    started_at = time.perf_counter()
+    decision = route_turn(session, query)
+    if decision.agent_name is None:
+        answer = str(session.router_agent.chat(query))
+    else:
+        answer = str(session.agents[decision.agent_name].chat(query))
+        record_turn(session, query, answer)
+    fast_router.record(decision, time.perf_counter() - started_at)
+    return answer
+
+
+def coalesced_agent_turn(session: AgentSession, query: str, embedding, version: Optional[int]) -> tuple:
+
+    """
+    Answer a turn with the agents, sharing the run of a concurrent session asking the same opening question.
+
+    Only first turns are coalesced (`embedding` is None for follow-up turns), their answer does not depend on a
+    conversation. A shared answer is recorded in the router memory like a cached one.
+
+    Returns:
+        tuple: (answer, True when it was computed for another session)
+    """
+
+    if embedding is None:
+        return agent_turn(session, query), False
+
+    answer, coalesced = query_flights.do(flight_key(session, query), lambda: agent_turn(session, query))
+    if coalesced:
+        record_turn(session, query, answer)
+    else:
+        store_answer(session, query, answer, embedding, version)
+    return answer, coalesced
+
+
+def store_answer(session: AgentSession, query: str, answer: str, embedding, version: Optional[int]) -> None:
+    """Cache the answer of a first turn, `embedding` is None for follow-up turns."""
+    if embedding is not None and answer:
+        # an ingestion during the turn invalidates the collection now, the answer is then dropped by the cache
+        answer_cache.sync_version(session.collection_name, get_index_service().get_version(session.collection_name))
+        answer_cache.store(session.collection_name, query, answer, version, embedding)
+
+# Spans of the LLM calls, retrievals and tools, and the request id of every log record
+instrument()
 
-    print(f"Index for collection '{collection_name}' has been initialized.")
-    return index_handler
-    
 # Set up logging
 logging.basicConfig(filename='app.log', level=logging.DEBUG,
-                    format='%(asctime)s %(levelname)s %(name)s %(threadName)s : %(message)s')
+                    format='%(asctime)s %(levelname)s %(name)s %(threadName)s [%(request_id)s] : %(message)s')
 logger = logging.getLogger(__name__)
 
 
+# Boot warm-up of the PRELOAD_COLLECTIONS, reported by /ready
+warmup_state = {"ready": False, "collections": {}, "errors": {}}
+
+
+def warm_up(collection_names: list) -> None:
+
+    """
+    Load the collections and build an agent stack for each of them, so the first user does not pay for it.
+
+    With gunicorn preload_app this runs once in the master, the workers inherit the warm state
+    (imported modules, router tool index, HTTP clients) copy-on-write.
+    """
+
+    started_at = time.perf_counter()
+    for position, collection_name in enumerate(collection_names):
+        timings = warmup_state["collections"].setdefault(collection_name, {})
+        try:
+            stage_started_at = time.perf_counter()
+            initialize_index(collection_name, make_default=position == 0)
+            timings["index_seconds"] = time.perf_counter() - stage_started_at
+
+            # builds the rag/action agents and the router tool index, the session itself is thrown away
+            stage_started_at = time.perf_counter()
+            create_agent_session("warm-up", collection_name)
+            timings["agents_seconds"] = time.perf_counter() - stage_started_at
+
+            stage_started_at = time.perf_counter()
+            fast_router.prepare()
+            timings["fast_router_seconds"] = time.perf_counter() - stage_started_at
+
+            logger.info(f"Warmed up collection '{collection_name}': {timings}")
+        except Exception as e:
+            logger.exception(f"Failed to warm up collection '{collection_name}'")
+            warmup_state["errors"][collection_name] = str(e)
+
+    warmup_state["ready"] = True
+    logger.info(f"Warm-up finished in {time.perf_counter() - started_at:.2f}s")
+
+
+warm_up(PRELOAD_COLLECTIONS)
+
+
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
 
+
+@app.before_request
+def begin_trace():
+    # the route, not the path, keeps the metric labels bounded
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    start_trace(endpoint, request.method, request.headers.get("X-Request-ID"))
+
+
+@app.after_request
+def end_trace(response):
+    trace = current_trace()
+    if trace is not None:
+        response.headers["X-Request-ID"] = trace.request_id
+        # streamed responses are finished by traced_stream once sent
+        if not response.is_streamed:
+            finish_trace(trace, response.status_code)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
 @app.route('/', methods=['GET'])
 @cross_origin()
 def health_check():
     return jsonify({"status": "OK"})
 
 
+# readiness probe, green once the preloaded collections are warm and served by the index service
+@app.route('/ready', methods=['GET'])
+@cross_origin()
+def ready():
+    try:
+        index_service = get_index_service()
+        missing = [name for name in PRELOAD_COLLECTIONS if not index_service.has_collection(name)]
+    except Exception as e:
+        return jsonify({**warmup_state, "ready": False, "error": f"Index service unavailable: {str(e)}"}), 503
+
+    is_ready = warmup_state["ready"] and not warmup_state["errors"] and not missing
+    return jsonify({**warmup_state, "ready": is_ready, "missing": missing}), 200 if is_ready else 503
+
+
 # Endpoint to initialize index with a collection name
 @app.route('/initialize', methods=['POST'])
 @cross_origin()
 def initialize():
     data = request.get_json()
     collection_name = data.get('collection_name')
-    global agent
     if not collection_name:
         return jsonify({"error": "Collection name is required"}), 400
     
     try:
-        index_handler = initialize_index(collection_name)
-        rag_agent = MultiDocumentReActAgent(index_handler=index_handler).create_openai_agent()
-        action_agent = ActionAgent(index_handler=index_handler).create_openai_agent()
-
-        agents = {
-            "rag_agent": rag_agent,
-            "action_agent": action_agent
-        }
-
-        rag_tool = QueryEngineTool(
-            query_engine=rag_agent,
-            metadata=ToolMetadata(
-                name="rag_agent_tool",
-                description="This tool uses the rag_agent to answer queries"
-            ),
-        )
-
-        action_tool = QueryEngineTool(
-            query_engine=action_agent,
-            metadata=ToolMetadata(
-                name="action_agent_tool",
-                description="This tool uses the action_agent to check if a specific HTML exists in a given URL"
-            ),
-        )
-
-        # agent = OpenAIAgent.from_tools(
-        #     tool_retriever=obj_index.as_retriever(similarity_top_k=1),
-        #     system_prompt=ROUTER_AGENT_PROMPT,
-        #     verbose=True
-        # )
-
-        agent = RouterAgent([rag_tool, action_tool]).create_agent()
+        initialize_index(collection_name)
 
         return jsonify({"status": f"Index for collection '{collection_name}' has been initialized."}), 200
     
@@ -108,7 +453,65 @@ def initialize():
         return jsonify({"error": f"Failed to initialize index: {str(e)}"}), 500
 
 
-# endpoint to accpet a file 
+def job_accepted(job: dict):
+    return jsonify({
+        "status": job["status"],
+        "job_id": job["job_id"],
+        "status_url": f"/jobs/{job['job_id']}"
+    }), 202
+
+
+def job_finished(job: dict):
+    return jsonify({
+        "status": "OK" if job["status"] == SUCCEEDED else job["status"],
+        "job_id": job["job_id"],
+        **(job["result"] or {})
+    }), 200
+
+
+# endpoint to accept files from the data directory
+@app.route('/files', methods=['PUT'])
+@cross_origin()
+def handle_files():
+
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
+
+        directory = data.get('directory')
+        file_names = data.get('file_names')
+        collection_name = data.get('collection_name')
+        # optional, e.g. {"embed": "Question", "content": ["Answer"], "source": "Url"}
+        column_mapping = data.get('column_mapping')
+
+        if not directory or not isinstance(directory, str) or not directory.strip():
+            return jsonify({"error": "Invalid or missing 'directory'"}), 400
+
+        if file_names is not None and (not isinstance(file_names, list) or not file_names):
+            return jsonify({"error": "Invalid 'file_names'"}), 400
+
+        if column_mapping is not None and (
+                not isinstance(column_mapping, dict)
+                or not isinstance(column_mapping.get('embed'), str)
+                or not isinstance(column_mapping.get('content', []), list)):
+            return jsonify({"error": "Invalid 'column_mapping'"}), 400
+
+        index_service = get_index_service()
+        if not collection_name or not index_service.has_collection(collection_name):
+            return jsonify({"error": f"Collection '{collection_name}' is not initialized"}), 400
+
+        if data.get('wait'):
+            return job_finished(index_service.submit_files(collection_name, directory, file_names, column_mapping, wait=True))
+
+        return job_accepted(index_service.submit_files(collection_name, directory, file_names, column_mapping))
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 
 # endpoint to handle sitemap URL
@@ -124,6 +527,7 @@ def handle_sitemap():
         sitemap_url = data.get('sitemap_url')
         domain = data.get('domain')
         collection_name = data.get('collection_name')
+        incremental = bool(data.get('incremental'))
 
          # Validate input data
         if not sitemap_url or not isinstance(sitemap_url, str) or not sitemap_url.strip():
@@ -135,20 +539,17 @@ def handle_sitemap():
         if not collection_name or not isinstance(collection_name, str) or not collection_name.strip():
             return jsonify({"error": "Invalid or missing 'collection_name'"}), 400
 
-        documents = load_data_from_sitemap(sitemap_url, domain)
-
-        # Add documents to the index
-        index_handler = index_handlers[collection_name]
+        index_service = get_index_service()
+        if not index_service.has_collection(collection_name):
+            return jsonify({"error": f"Collection '{collection_name}' is not initialized"}), 400
 
-        for doc in documents:
-            index_handler.index.insert(doc)
-        index_handler.index.storage_context.persist(persist_dir=index_handler.get_collection_path())
-        index_handlers[collection_name] = index_handler
+        # Agents retrieve through the index service, they see the new pages without being recreated
 
-        # TODO: Recreate agent
+        # Run synchronously only when the client asks for it, crawls can take minutes
+        if data.get('wait'):
+            return job_finished(index_service.submit_sitemap(collection_name, sitemap_url, domain, incremental, wait=True))
 
-        # Return a success message along with the number of documents processed
-        return jsonify({"status": "OK", "documents_processed": len(documents)}), 200
+        return job_accepted(index_service.submit_sitemap(collection_name, sitemap_url, domain, incremental))
 
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
@@ -161,31 +562,253 @@ def handle_sitemap():
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 
+@app.route('/jobs', methods=['GET'])
+@cross_origin()
+def list_jobs():
+    return jsonify({"jobs": get_index_service().list_jobs()})
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@cross_origin()
+def get_job(job_id):
+    job = get_index_service().get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job)
+
+
+# cancel a queued or running job, pages ingested so far are kept
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+@cross_origin()
+def cancel_job(job_id):
+    job = get_index_service().cancel_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job)
+
 
 @app.route('/query', methods=['POST'])
 @cross_origin()
 def query():
 
-    query = request.json.get('query')
+    data = request.get_json()
+    query = data.get('query')
     if not query:
         logger.error("No query provided")
         return jsonify({"error": "Query not provided"}), 400
     
-    global agent
-    if agent is None:
-        logger.error("Agent not initialized")
-        return jsonify({"error": "Agent is not initialized. Please initialize the index and agent first."}), 400
-    
     try:
-        answer = agent.chat(query)
-        logger.info(f"Query processed successfully: {query}")
-        return jsonify({"response": str(answer)})
+        session, error = get_agent_session(data)
+        if error:
+            return error
+
+        with session.lock:
+            cached = False
+            coalesced = False
+            faq = None
+            guide = guide_turn(session, query)
+            if guide is not None:
+                answer = guide["message"]
+            else:
+                faq = lookup_faq_answer(session, query)
+            if faq is not None:
+                answer = "".join(faq_answer_deltas(query, faq))
+                record_turn(session, query, answer)
+            elif guide is None:
+                answer, embedding, version = lookup_cached_answer(session, query)
+                cached = answer is not None
+            if guide is None and faq is None and not cached:
+                answer, coalesced = coalesced_agent_turn(session, query, embedding, version)
+        session_registry.touch(session)
+
+        logger.info(f"Query processed successfully (cached: {cached}, faq: {faq is not None}, coalesced: {coalesced}): {query}")
+        response = {
+            "response": answer, "session_id": session.session_id, "cached": cached, "faq": faq is not None,
+            "coalesced": coalesced
+        }
+        if guide is not None:
+            response["guide"] = guide["status"]
+        return jsonify(response)
     
     except Exception as e:
         logger.exception("Failed to process query")
         return jsonify({"error": f"Failed to process query: {str(e)}"}), 500
 
 
+@app.route('/query/stream', methods=['POST'])
+@cross_origin()
+def query_stream():
+
+    """
+    Streaming variant of /query, answers are sent as Server-Sent Events.
+
+    Events: session with the session id, tool_start and tool_end when an agent tool is called,
+    token for every answer token, done with the full answer once finished, error if the query failed.
+    done carries cached or faq when the answer came from the answer cache or the curated questions,
+    coalesced when it was shared with a concurrent session asking the same opening question, and guide with the workflow status when the turn belongs to a guide download.
+    """
+
+    data = request.get_json()
+    query = data.get('query')
+    if not query:
+        logger.error("No query provided")
+        return jsonify({"error": "Query not provided"}), 400
+
+    session, error = get_agent_session(data)
+    if error:
+        return error
+
+    def generate():
+        yield format_sse("session", {"session_id": session.session_id})
+        with session.lock:
+            try:
+                guide = guide_turn(session, query)
+                faq = None if guide else lookup_faq_answer(session, query)
+                answer, embedding, version = (None, None, None) if guide or faq else lookup_cached_answer(session, query)
+            except Exception as e:
+                logger.exception("Failed to look up the answer cache")
+                yield format_sse("error", {"error": f"Failed to process query: {str(e)}"})
+                return
+
+            if guide is not None:
+                logger.info(f"Streamed query answered by the guide download workflow: {query}")
+                yield format_sse("token", {"delta": guide["message"]})
+                yield format_sse("done", {"response": guide["message"], "guide": guide["status"]})
+            elif faq is not None:
+                deltas = []
+                try:
+                    for delta in faq_answer_deltas(query, faq):
+                        deltas.append(delta)
+                        yield format_sse("token", {"delta": delta})
+                except Exception as e:
+                    logger.exception("Failed to rephrase the curated answer")
+                    yield format_sse("error", {"error": f"Failed to process query: {str(e)}"})
+                    return
+                answer = "".join(deltas)
+                record_turn(session, query, answer)
+                logger.info(f"Streamed query answered from the curated questions: {query}")
+                yield format_sse("done", {"response": answer, "faq": True})
+            elif answer is not None:
+                logger.info(f"Streamed query answered from cache: {query}")
+                yield format_sse("token", {"delta": answer})
+                yield format_sse("done", {"response": answer, "cached": True})
+            else:
+                # first turns join the run of a concurrent session asking the same question, see coalesced_agent_turn
+                flight, leader, answer = None, False, None
+                if embedding is not None:
+                    flight, leader = query_flights.begin(flight_key(session, query))
+                    if not leader:
+                        answer = query_flights.wait(flight)
+
+                if answer is not None:
+                    record_turn(session, query, answer)
+                    logger.info(f"Streamed query answered by a concurrent run: {query}")
+                    yield format_sse("token", {"delta": answer})
+                    yield format_sse("done", {"response": answer, "coalesced": True})
+                else:
+                    try:
+                        started_at = time.perf_counter()
+                        decision = route_turn(session, query)
+                        if decision.agent_name is None:
+                            events = stream_agent_events(session.router_agent, query, sub_agents=list(session.agents.values()))
+                        else:
+                            events = stream_agent_events(session.agents[decision.agent_name], query)
+
+                        for event, event_data in events:
+                            if event == "error":
+                                logger.error(f"Failed to process streamed query: {event_data['error']}")
+                            elif event == "done":
+                                logger.info(f"Streamed query processed successfully: {query}")
+                                answer = event_data["response"]
+                                if decision.agent_name is not None:
+                                    record_turn(session, query, answer)
+                                fast_router.record(decision, time.perf_counter() - started_at)
+                                store_answer(session, query, answer, embedding, version)
+                            yield format_sse(event, event_data)
+                    finally:
+                        # also when the client went away, the followers fall back to their own run
+                        if leader:
+                            query_flights.finish(flight_key(session, query), flight, answer)
+        session_registry.touch(session)
+
+    return Response(
+        stream_with_context(traced_stream(generate())),
+        mimetype='text/event-stream',
+        # stop nginx from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route('/guide', methods=['POST'])
+@cross_origin()
+def guide():
+
+    """
+    Start the guide download of a page in a session, the next /query turns answer its questions.
+
+    Returns the first question, or the final message when the page has no download form.
+    """
+
+    data = request.get_json()
+    url = data.get('url')
+    if not url:
+        logger.error("No url provided")
+        return jsonify({"error": "URL not provided"}), 400
+
+    try:
+        session, error = get_agent_session(data)
+        if error:
+            return error
+
+        with session.lock:
+            result = start_guide(session, url)
+            session.router_agent.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=result["message"]))
+        session_registry.touch(session)
+        return jsonify({"response": result["message"], "session_id": session.session_id, "guide": result["status"]})
+
+    except Exception as e:
+        logger.exception("Failed to start the guide download")
+        return jsonify({"error": f"Failed to start the guide download: {str(e)}"}), 500
+
+
+@app.route('/sessions/stats', methods=['GET'])
+@cross_origin()
+def session_stats():
+    return jsonify({**session_registry.stats(), "memory": memory_stats()})
+
+
+@app.route('/cache/stats', methods=['GET'])
+@cross_origin()
+def cache_stats():
+    return jsonify({
+        "answer_cache": answer_cache.stats(),
+        "embedding_cache": get_index_service().stats()["embedding_cache"],
+        # per worker, the query embeddings of the answer cache and the fast router
+        "worker_embedding_cache": {"pid": os.getpid(), **get_cached_embed_model().stats()},
+        "query_coalescing": {"pid": os.getpid(), **query_flights.stats()}
+    })
+
+
+@app.route('/router/stats', methods=['GET'])
+@cross_origin()
+def router_stats():
+    return jsonify({"mode": ROUTER_MODE, **fast_router.stats()})
+
+
+@app.route('/index/stats', methods=['GET'])
+@cross_origin()
+def index_stats():
+    # the context compression runs in the workers, its counters are the ones of this worker
+    return jsonify({**get_index_service().stats(), "context_compression": {"pid": os.getpid(), **compression_stats()}})
+
+
+@app.route('/tools/stats', methods=['GET'])
+@cross_origin()
+def tools_stats():
+    # per worker, like the sessions
+    return jsonify({"pid": os.getpid(), "http": http_client.stats(), "page_cache": page_cache.stats()})
+
+
 # enable this for development mode
 # if __name__ == '__main__':
 #     app.run(host='0.0.0.0', port=80)
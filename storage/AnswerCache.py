@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+"""
+Semantic answer cache consulted before the router agent.
+
+Answers are keyed on the embedding of the query, a new query is a hit when the cosine similarity with
+a cached query of the same collection is above the threshold. Entries expire after a TTL, each
+collection keeps at most max_entries (least recently used are dropped first), and all the entries
+of a collection are dropped when its index changes (its version differs from the one the answers were
+cached at). An answer is stored with the version its turn started at, and dropped if the index changed
+while it was computed.
+"""
+
+
+class CacheEntry:
+    def __init__(self, query: str, answer: str, embedding: np.ndarray) -> None:
+        self.query = query
+        self.answer = answer
+        self.embedding = embedding
+        self.created_at = time.monotonic()
+
+
+class SemanticAnswerCache:
+    def __init__(self, embed_model, similarity_threshold: float, ttl_seconds: float, max_entries: int) -> None:
+
+        """
+        Initialize the SemanticAnswerCache.
+
+        Args:
+            embed_model (BaseEmbedding): The model used to embed the queries.
+            similarity_threshold (float): Minimum cosine similarity between two queries to reuse an answer.
+            ttl_seconds (float): Time after which a cached answer expires.
+            max_entries (int): Maximum number of cached answers per collection.
+        """
+
+        self.embed_model = embed_model
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._entries: Dict[str, "OrderedDict[int, CacheEntry]"] = {}
+        self._next_id = 0
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_writes = 0
+
+    def embed(self, query: str) -> np.ndarray:
+        """Embed and L2 normalize a query, so a dot product is the cosine similarity."""
+        embedding = np.asarray(self.embed_model.get_query_embedding(query), dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def lookup(self, collection_name: str, query: str) -> Tuple[Optional[str], np.ndarray]:
+
+        """
+        Look up a cached answer for a query.
+
+        Args:
+            collection_name (str): The collection the query is asked against.
+            query (str): The user query.
+
+        Returns:
+            Tuple[Optional[str], np.ndarray]: The cached answer or None on a miss, and the query embedding
+            so it can be passed back to `store`.
+        """
+
+        embedding = self.embed(query)
+        now = time.monotonic()
+
+        with self._lock:
+            entries = self._entries.get(collection_name)
+            if entries:
+                self._expire(entries, now)
+
+            if not entries:
+                self.misses += 1
+                return None, embedding
+
+            ids: List[int] = list(entries.keys())
+            matrix = np.stack([entries[entry_id].embedding for entry_id in ids])
+            similarities = matrix @ embedding
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None, embedding
+
+            entries.move_to_end(ids[best])
+            self.hits += 1
+            return entries[ids[best]].answer, embedding
+
+    def store(self, collection_name: str, query: str, answer: str, version: int, embedding: Optional[np.ndarray] = None) -> None:
+
+        """
+        Cache the answer to a query.
+
+        Args:
+            collection_name (str): The collection the query was asked against.
+            query (str): The user query.
+            answer (str): The answer returned by the agent.
+            version (int): The version of the collection when the turn started, see `sync_version`.
+            embedding (Optional[np.ndarray]): The normalized query embedding returned by `lookup`, computed if missing.
+        """
+
+        if embedding is None:
+            embedding = self.embed(query)
+
+        with self._lock:
+            # computed against an index that changed since, it would be served until the next change
+            if self._versions.get(collection_name) != version:
+                self.stale_writes += 1
+                return
+            entries = self._entries.setdefault(collection_name, OrderedDict())
+            entries[self._next_id] = CacheEntry(query, answer, embedding)
+            self._next_id += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, collection_name: str) -> None:
+        """Drop all the cached answers of a collection, called when its index changes."""
+        with self._lock:
+            if self._entries.pop(collection_name, None):
+                self.invalidations += 1
+
+    def sync_version(self, collection_name: str, version: int) -> None:
+        """Invalidate the collection if its index changed since the last call, e.g. in another process."""
+        with self._lock:
+            previous = self._versions.get(collection_name)
+            self._versions[collection_name] = version
+        if previous is not None and previous != version:
+            self.invalidate(collection_name)
+
+    def _expire(self, entries: "OrderedDict[int, CacheEntry]", now: float) -> None:
+        expired = [entry_id for entry_id, entry in entries.items() if now - entry.created_at >= self.ttl_seconds]
+        for entry_id in expired:
+            del entries[entry_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(len(entries) for entries in self._entries.values()),
+                "max_entries_per_collection": self.max_entries,
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "stale_writes": self.stale_writes,
+            }
@@ -0,0 +1,186 @@
+import re
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core.schema import BaseNode, MetadataMode
+
+"""
+In-process BM25 index over the nodes of a collection.
+
+Exact terms (product names, feature names like "Hooks engine", "SharpSpring") that vector similarity
+ranks poorly are matched here. Postings are plain lists so nodes can be added and removed as the
+collection changes, and are turned into NumPy arrays on first use so a query is scored with a few
+vectorised operations per query term.
+"""
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "in", "is",
+    "it", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which", "who", "why",
+    "will", "with", "you", "your", "me", "my", "we", "our", "tell", "about", "please", "there", "any",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+
+        """
+        Initialize the BM25Index.
+
+        Args:
+            k1 (float): Term frequency saturation.
+            b (float): Document length normalization.
+        """
+
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.nodes: List[Optional[BaseNode]] = []
+        self._positions: Dict[str, int] = {}
+        self._ref_docs: Dict[str, List[int]] = {}
+        self._lengths: List[int] = []
+        self._alive: List[bool] = []
+        self._total_length = 0
+        self._count = 0
+
+        # token -> (node positions, term frequencies), as lists while updated and arrays once queried
+        self._postings: Dict[str, Tuple[list, list]] = {}
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._lengths_array: Optional[np.ndarray] = None
+        self._alive_array: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, nodes: List[BaseNode]) -> None:
+        """Index nodes, a node already indexed under the same id is replaced."""
+        with self._lock:
+            self._add(nodes)
+
+    def _add(self, nodes: List[BaseNode]) -> None:
+        for node in nodes:
+            if node.node_id in self._positions:
+                self._remove(self._positions[node.node_id])
+
+            position = len(self.nodes)
+            # everything the LLM sees is searchable, e.g. the answer column of CSV rows
+            terms = Counter(tokenize(node.get_content(metadata_mode=MetadataMode.LLM)))
+            for token, frequency in terms.items():
+                postings = self._postings.setdefault(token, ([], []))
+                postings[0].append(position)
+                postings[1].append(frequency)
+                self._arrays.pop(token, None)
+
+            length = sum(terms.values())
+            self.nodes.append(node)
+            self._positions[node.node_id] = position
+            if node.ref_doc_id:
+                self._ref_docs.setdefault(node.ref_doc_id, []).append(position)
+            self._lengths.append(length)
+            self._alive.append(True)
+            self._total_length += length
+            self._count += 1
+
+        self._lengths_array = None
+        self._alive_array = None
+
+    def _remove(self, position: int) -> None:
+        node = self.nodes[position]
+        if node is None:
+            return
+        # postings of removed nodes are masked at query time and dropped by `_compact`
+        self._positions.pop(node.node_id, None)
+        self.nodes[position] = None
+        self._alive[position] = False
+        self._total_length -= self._lengths[position]
+        self._count -= 1
+        self._alive_array = None
+
+    def delete_ref_doc(self, ref_doc_id: str) -> None:
+        """Remove the nodes of a document."""
+        with self._lock:
+            for position in self._ref_docs.pop(ref_doc_id, []):
+                self._remove(position)
+            self._compact()
+
+    def delete_where(self, predicate: Callable[[BaseNode], bool]) -> None:
+        """Remove the nodes matching a predicate, e.g. on their metadata."""
+        with self._lock:
+            for position, node in enumerate(self.nodes):
+                if node is not None and predicate(node):
+                    self._remove(position)
+            self._compact()
+
+    def _compact(self) -> None:
+        # rebuild once more than half of the positions are dead
+        if len(self.nodes) <= 2 * max(self._count, 1):
+            return
+        nodes = [node for node in self.nodes if node is not None]
+        self._reset()
+        self._add(nodes)
+
+    def _term_arrays(self, token: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        arrays = self._arrays.get(token)
+        if arrays is None:
+            postings = self._postings.get(token)
+            if postings is None:
+                return None
+            arrays = (np.asarray(postings[0], dtype=np.int64), np.asarray(postings[1], dtype=np.float32))
+            self._arrays[token] = arrays
+        return arrays
+
+    def query(self, query_str: str, top_k: int) -> List[Tuple[BaseNode, float]]:
+
+        """
+        Score the indexed nodes against a query.
+
+        Args:
+            query_str (str): The query.
+            top_k (int): Number of nodes to return.
+
+        Returns:
+            List[Tuple[BaseNode, float]]: The best nodes with a positive score and their BM25 score, best first.
+        """
+
+        tokens = set(tokenize(query_str))
+        with self._lock:
+            if not tokens or not self._count:
+                return []
+
+            if self._lengths_array is None:
+                self._lengths_array = np.asarray(self._lengths, dtype=np.float32)
+            if self._alive_array is None:
+                self._alive_array = np.asarray(self._alive, dtype=bool)
+
+            average_length = self._total_length / self._count or 1.0
+            normalization = self.k1 * (1 - self.b + self.b * self._lengths_array / average_length)
+            scores = np.zeros(len(self.nodes), dtype=np.float32)
+
+            for token in tokens:
+                arrays = self._term_arrays(token)
+                if arrays is None:
+                    continue
+                positions, frequencies = arrays
+                alive = self._alive_array[positions]
+                document_frequency = int(alive.sum())
+                if not document_frequency:
+                    continue
+                idf = np.log(1 + (self._count - document_frequency + 0.5) / (document_frequency + 0.5))
+                # positions are unique within a posting list, plain fancy indexing accumulates correctly
+                scores[positions] += idf * frequencies * (self.k1 + 1) / (frequencies + normalization[positions])
+
+            scores[~self._alive_array] = 0.0
+            top_k = min(top_k, len(scores))
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best])]
+            return [(self.nodes[position], float(scores[position])) for position in best if scores[position] > 0]
@@ -0,0 +1,232 @@
+import logging
+import os
+import queue
+import re
+import threading
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.utils import get_tokenizer
+
+from constants import CONTEXT_EMBED_QUEUE_SIZE
+
+"""
+Compression of the retrieved nodes before they are stuffed into the QA prompt.
+
+Crawled chunks carry a lot of page furniture (navigation, "GET IN TOUCH TODAY", "Request a Demo") that
+costs prompt tokens without helping the answer. The nodes, as the LLM sees them (CSV rows keep the answer in
+their metadata), are split into sentences and
+
+    deduplicated   a sentence already seen in a better ranked node is dropped
+    pruned         sentences are ranked by the cosine similarity of their embedding with the query
+                   embedding, those below the floor are dropped
+    budgeted       the best sentences are kept until the token budget is spent, the source of a node
+                   is always kept with its sentences and counted in the budget
+
+The kept sentences are put back in their original order. The query embedding is the one computed by the
+retrieval. No embedding is requested on the query path: sentences are scored with their embedding when it
+is in the embedding cache, otherwise with the stored embedding of their node, and the missing sentences are
+embedded by a background thread with a bounded queue so later queries find them in the cache.
+
+Sentences scored by their node all share its score, so on a cold cache the pruning is by node: the nodes
+below the floor are dropped, the others are kept from their first sentence until the budget is spent, as
+an unpruned context would be truncated. Sentence relevance applies once the sentences are cached.
+"""
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\s*\n+\s*")
+SOURCE_KEY = "Source"
+EMBED_BATCH_SIZE = 64
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences and lines of a text, navigation items and headings usually come one per line."""
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence and sentence.strip()]
+
+
+def normalize_sentence(sentence: str) -> str:
+    return " ".join(re.sub(r"[^\w ]+", " ", sentence.lower()).split())
+
+
+def _cosine(matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    return matrix @ vector / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector) + 1e-12)
+
+
+class ContextCompressor(BaseNodePostprocessor):
+    embed_model: Any = Field(description="The embedding model of the collection, e.g. the cached embedding model.")
+    token_budget: int = Field(description="Maximum number of tokens of node text passed on.")
+    min_similarity: float = Field(description="Sentences less similar to the query are dropped.")
+    tokenizer_fn: Callable[[str], List] = Field(default_factory=get_tokenizer, exclude=True)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextCompressor"
+
+    def _postprocess_nodes(
+            self,
+            nodes: List[NodeWithScore],
+            query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        if not nodes or query_bundle is None:
+            return nodes
+
+        # (node position, sentence position, sentence) of the sentences not seen in a better ranked node,
+        # the source of a node is not compressed, it is kept with the first sentence of the node
+        sentences, seen, sources, tokens_in = [], set(), [], 0
+        for node_position, node in enumerate(nodes):
+            tokens_in += len(self.tokenizer_fn(node.node.get_content(metadata_mode=MetadataMode.LLM)))
+            source = node.node.metadata.get(SOURCE_KEY)
+            sources.append(len(self.tokenizer_fn(f"{SOURCE_KEY}: {source}")) if source else 0)
+            unpinned = node.node.model_copy()
+            unpinned.excluded_llm_metadata_keys = [*node.node.excluded_llm_metadata_keys, SOURCE_KEY]
+            text = unpinned.get_content(metadata_mode=MetadataMode.LLM)
+            for sentence_position, sentence in enumerate(split_sentences(text)):
+                key = normalize_sentence(sentence)
+                if key and key not in seen:
+                    seen.add(key)
+                    sentences.append((node_position, sentence_position, sentence))
+        if not sentences:
+            return nodes
+
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = self.embed_model.get_query_embedding(query_bundle.query_str)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarities, deferred = self._similarities(nodes, sentences, query)
+
+        # best sentences first within the budget, all below the floor dropped unless nothing passes it
+        # ties keep the original order, the sentences scored by their node are taken from the start of the node
+        order = np.argsort(-similarities, kind="stable")
+        ranked = [position for position in order if similarities[position] >= self.min_similarity]
+        ranked = ranked or list(order)
+        kept, kept_nodes, tokens_out = set(), set(), 0
+        for position in ranked:
+            node_position = sentences[position][0]
+            tokens = len(self.tokenizer_fn(sentences[position][2]))
+            if node_position not in kept_nodes:
+                tokens += sources[node_position]
+            if tokens_out + tokens > self.token_budget:
+                continue
+            kept.add(position)
+            kept_nodes.add(node_position)
+            tokens_out += tokens
+
+        compressed = []
+        for node_position, node in enumerate(nodes):
+            text = " ".join(
+                sentence for position, (sentence_node, _, sentence) in enumerate(sentences)
+                if sentence_node == node_position and position in kept
+            )
+            if not text:
+                continue
+            # the kept sentences already hold the metadata the LLM saw, only the source is appended
+            node_copy = node.node.model_copy()
+            node_copy.set_content(text)
+            node_copy.embedding = None
+            node_copy.text_template = "{content}\n{metadata_str}"
+            node_copy.excluded_llm_metadata_keys = [key for key in node.node.metadata if key != SOURCE_KEY]
+            compressed.append(NodeWithScore(node=node_copy, score=node.score))
+
+        _record(tokens_in, tokens_out, len(sentences) - deferred, deferred)
+        logger.info(
+            f"Context compression: {tokens_in} -> {tokens_out} tokens ({tokens_in - tokens_out} saved), "
+            f"{len(kept)}/{len(sentences)} sentences of {len(compressed)}/{len(nodes)} nodes, "
+            f"{deferred} sentences scored by their node"
+        )
+        return compressed
+
+    def _similarities(self, nodes: List[NodeWithScore], sentences: List[tuple], query: np.ndarray):
+        """Similarity of each sentence with the query and the number of sentences scored by their node."""
+        texts = [sentence for _, _, sentence in sentences]
+        get_cached = getattr(self.embed_model, "get_cached_text_embeddings", None)
+        embeddings = get_cached(texts) if get_cached else [None] * len(texts)
+
+        similarities = np.full(len(sentences), self.min_similarity, dtype=np.float32)
+        cached = [position for position, embedding in enumerate(embeddings) if embedding is not None]
+        if cached:
+            matrix = np.asarray([embeddings[position] for position in cached], dtype=np.float32)
+            similarities[cached] = _cosine(matrix, query)
+
+        missing = [position for position, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            node_similarities = {}
+            for node_position, node in enumerate(nodes):
+                if node.node.embedding is not None:
+                    matrix = np.asarray([node.node.embedding], dtype=np.float32)
+                    node_similarities[node_position] = float(_cosine(matrix, query)[0])
+            for position in missing:
+                similarities[position] = node_similarities.get(sentences[position][0], self.min_similarity)
+            _defer_embedding(self.embed_model, [texts[position] for position in missing])
+        return similarities, len(missing)
+
+
+_embed_queue: Optional[queue.Queue] = None
+_embed_pid: Optional[int] = None
+_embed_pending = set()
+_embed_lock = threading.Lock()
+
+
+def _defer_embedding(embed_model: Any, texts: List[str]) -> None:
+    """Queue the texts to be embedded, and so cached, by the background thread of this process."""
+    global _embed_queue, _embed_pid
+    with _embed_lock:
+        # a forked worker does not inherit the thread
+        if _embed_pid != os.getpid():
+            _embed_queue, _embed_pid = queue.Queue(maxsize=CONTEXT_EMBED_QUEUE_SIZE), os.getpid()
+            _embed_pending.clear()
+            threading.Thread(target=_embed_worker, args=(_embed_queue,), name="context-embedder", daemon=True).start()
+        for text in texts:
+            if text in _embed_pending:
+                continue
+            try:
+                _embed_queue.put_nowait((embed_model, text))
+            except queue.Full:
+                break
+            _embed_pending.add(text)
+
+
+def _embed_worker(jobs: queue.Queue) -> None:
+    while True:
+        batch = [jobs.get()]
+        while len(batch) < EMBED_BATCH_SIZE:
+            try:
+                batch.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+        models = {id(embed_model): embed_model for embed_model, _ in batch}
+        for model_id, embed_model in models.items():
+            texts = [text for model, text in batch if id(model) == model_id]
+            try:
+                embed_model.get_text_embedding_batch(texts)
+            except Exception:
+                logger.exception(f"Embedding of {len(texts)} context sentences failed")
+        with _embed_lock:
+            _embed_pending.difference_update(text for _, text in batch)
+
+
+_stats = {"queries": 0, "tokens_in": 0, "tokens_out": 0, "sentences_cached": 0, "sentences_deferred": 0}
+_stats_lock = threading.Lock()
+
+
+def _record(tokens_in: int, tokens_out: int, sentences_cached: int, sentences_deferred: int) -> None:
+    with _stats_lock:
+        _stats["queries"] += 1
+        _stats["tokens_in"] += tokens_in
+        _stats["tokens_out"] += tokens_out
+        _stats["sentences_cached"] += sentences_cached
+        _stats["sentences_deferred"] += sentences_deferred
+
+
+def compression_stats() -> dict:
+    with _stats_lock:
+        saved = _stats["tokens_in"] - _stats["tokens_out"]
+        return {
+            **_stats,
+            "tokens_saved": saved,
+            "tokens_saved_per_query": saved / _stats["queries"] if _stats["queries"] else 0.0,
+            "ratio": _stats["tokens_out"] / _stats["tokens_in"] if _stats["tokens_in"] else 1.0,
+        }
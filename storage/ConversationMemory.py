@@ -0,0 +1,362 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms.llm import LLM
+from llama_index.core.memory import BaseMemory
+from llama_index.core.utils import get_tokenizer
+from openai.types.chat import ChatCompletionMessageToolCall
+
+from constants import (
+    MEMORY_BACKEND, MEMORY_DB_PATH, MEMORY_TOKEN_LIMIT, MEMORY_KEEP_RATIO, MEMORY_TTL_SECONDS,
+    MEMORY_SUMMARY_PROMPT_TMPL
+)
+
+"""
+Persistent, token-budgeted chat memory of the agents.
+
+The conversation of every agent of a session is kept under a key ("<collection>:<session>:<agent>")
+in a key/value store, SQLite by default so sessions survive worker restarts and are shared by the
+gunicorn workers. The memory hands the agents at most MEMORY_TOKEN_LIMIT tokens of history: once the
+window is exceeded, the oldest turns are folded into a rolling summary with one LLM call, until the
+recent turns fit in MEMORY_KEEP_RATIO of the budget, so the summary is not rewritten on every turn.
+
+Every value has a version. The memory reads the stored conversation before using it and writes with
+the version it read, a write based on a stale read (another worker served a turn in between) is
+rejected and applied again on the newer conversation, so no worker erases the turns of another.
+"""
+
+# attempts of a write losing the race against other workers before giving up
+MAX_WRITE_ATTEMPTS = 10
+
+
+class ConversationStore(ABC):
+    """Versioned key/value interface of the conversation backends, values are JSON serializable dicts."""
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, key: str) -> Tuple[Optional[dict], int]:
+        """The value of a key and its version, (None, 0) for a missing key."""
+
+    @abstractmethod
+    def put(self, key: str, value: dict, version: int) -> bool:
+        """Store a value if the stored version is still `version`, returns False when another writer got there first."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+
+class InMemoryConversationStore(ConversationStore):
+    """Process local store, for development and tests, values are copied through JSON like a remote store."""
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self._values: Dict[str, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[Optional[dict], int]:
+        with self._lock:
+            value, version = self._values.get(key, (None, 0))
+        return (json.loads(value) if value is not None else None), version
+
+    def put(self, key: str, value: dict, version: int) -> bool:
+        with self._lock:
+            if self._values.get(key, (None, 0))[1] != version:
+                return False
+            self._values[key] = (json.dumps(value), version + 1)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._values)
+
+
+class SQLiteConversationStore(ConversationStore):
+    name = "sqlite"
+
+    def __init__(self, db_path: str, ttl_seconds: float) -> None:
+
+        """
+        Initialize the SQLiteConversationStore.
+
+        Args:
+            db_path (str): Path of the SQLite database.
+            ttl_seconds (float): Conversations not updated for this long are deleted when a process opens the database.
+        """
+
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # Opened lazily, and again after a fork, a connection cannot be shared with the parent process
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            # WAL lets the gunicorn workers read while another one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL, version INTEGER NOT NULL DEFAULT 1)"
+            )
+            # databases written before the values were versioned
+            if "version" not in [column[1] for column in connection.execute("PRAGMA table_info(conversations)")]:
+                connection.execute("ALTER TABLE conversations ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            connection.execute("DELETE FROM conversations WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key: str) -> Tuple[Optional[dict], int]:
+        with self._lock:
+            row = self._get_connection().execute("SELECT value, version FROM conversations WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row is not None else (None, 0)
+
+    def put(self, key: str, value: dict, version: int) -> bool:
+        with self._lock:
+            connection = self._get_connection()
+            # the version check and the write are one statement, atomic across the workers
+            if version == 0:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO conversations (key, value, updated_at, version) VALUES (?, ?, ?, 1)",
+                    (key, json.dumps(value), time.time())
+                )
+            else:
+                cursor = connection.execute(
+                    "UPDATE conversations SET value = ?, updated_at = ?, version = version + 1 WHERE key = ? AND version = ?",
+                    (json.dumps(value), time.time(), key, version)
+                )
+            connection.commit()
+            return cursor.rowcount == 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute("DELETE FROM conversations WHERE key = ?", (key,))
+            connection.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._get_connection().execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+
+def message_to_dict(message: ChatMessage) -> dict:
+    return message.model_dump(mode="json")
+
+
+def message_from_dict(data: dict) -> ChatMessage:
+    message = ChatMessage.model_validate(data)
+    # the OpenAI agents read the tool calls as objects, e.g. `tool_call.function.name`
+    tool_calls = message.additional_kwargs.get("tool_calls")
+    if tool_calls:
+        message.additional_kwargs["tool_calls"] = [
+            ChatCompletionMessageToolCall.model_validate(tool_call) if isinstance(tool_call, dict) else tool_call
+            for tool_call in tool_calls
+        ]
+    return message
+
+
+class ConversationMemory(BaseMemory):
+    """Chat memory persisted in a ConversationStore, `get` returns a rolling summary and the recent messages within the token limit."""
+
+    key: str
+    token_limit: int = MEMORY_TOKEN_LIMIT
+    keep_ratio: float = MEMORY_KEEP_RATIO
+    llm: Optional[LLM] = Field(default=None, exclude=True)
+    store: Any = Field(default=None, exclude=True)
+    tokenizer_fn: Callable[[str], List] = Field(default_factory=get_tokenizer, exclude=True)
+
+    _messages: List[ChatMessage] = PrivateAttr(default_factory=list)
+    _summary: str = PrivateAttr(default="")
+    _version: int = PrivateAttr(default=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ConversationMemory"
+
+    @classmethod
+    def from_defaults(
+            cls,
+            key: str,
+            store: Optional[ConversationStore] = None,
+            llm: Optional[LLM] = None,
+            token_limit: int = MEMORY_TOKEN_LIMIT,
+            **kwargs: Any
+    ) -> "ConversationMemory":
+
+        """
+        Create the memory of a conversation.
+
+        Args:
+            key (str): The key of the conversation in the store.
+            store (Optional[ConversationStore]): The backend, the process wide store of MEMORY_BACKEND when None.
+            llm (Optional[LLM]): The LLM writing the summary, older messages are dropped without a summary when None.
+            token_limit (int): Maximum number of tokens of history handed to the agent.
+        """
+
+        return cls(key=key, store=store or get_conversation_store(), llm=llm, token_limit=token_limit, **kwargs)
+
+    def _load(self) -> List[ChatMessage]:
+        # read on every use, another worker may have served the previous turn of the session
+        value, version = self.store.get(self.key)
+        if version != self._version or value is None:
+            value = value or {}
+            self._messages = [message_from_dict(message) for message in value.get("messages", [])]
+            self._summary = value.get("summary", "")
+            self._version = version
+        return self._messages
+
+    def _update(self, change: Callable[[List[ChatMessage], str], Optional[Tuple[List[ChatMessage], str]]]) -> bool:
+
+        """
+        Apply a change to the stored conversation, again on the newer one when another writer got there first.
+
+        Args:
+            change: Function of the current messages and summary returning the new ones, None to leave them as is.
+
+        Returns:
+            bool: True when the change was written.
+        """
+
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            messages = list(self._load())
+            changed = change(messages, self._summary)
+            if changed is None:
+                return False
+            value = {"summary": changed[1], "messages": [message_to_dict(message) for message in changed[0]]}
+            if self.store.put(self.key, value, self._version):
+                self._messages, self._summary = changed
+                self._version += 1
+                return True
+            with _stats_lock:
+                _stats["write_conflicts"] += 1
+        raise RuntimeError(f"Could not write the conversation {self.key}, too many concurrent writers")
+
+    def _count_tokens(self, messages: List[ChatMessage]) -> int:
+        return sum(len(self.tokenizer_fn(str(message.content or ""))) for message in messages)
+
+    def get(self, input: Optional[str] = None, **kwargs: Any) -> List[ChatMessage]:
+        messages = self._load()
+        if self._count_tokens(messages) + len(self.tokenizer_fn(self._summary)) > self.token_limit:
+            self._compact()
+            messages = self._messages
+        if not self._summary:
+            return list(messages)
+        summary = ChatMessage(role=MessageRole.SYSTEM, content=f"Summary of the earlier conversation: {self._summary}")
+        return [summary, *messages]
+
+    def _compact(self) -> None:
+        messages = self._messages
+        budget = int(self.token_limit * self.keep_ratio)
+
+        # keep the most recent turns within the budget, cut at a user message so no tool call loses its result
+        start, tokens = len(messages), 0
+        for position in range(len(messages) - 1, -1, -1):
+            tokens += self._count_tokens([messages[position]])
+            if tokens > budget:
+                break
+            if messages[position].role == MessageRole.USER:
+                start = position
+        if start == len(messages):
+            # a single turn over the budget, keep it whole
+            start = max(
+                (position for position, message in enumerate(messages) if message.role == MessageRole.USER),
+                default=0
+            )
+        if start == 0:
+            return
+
+        older, summary = messages[:start], self._summary
+        if self.llm is not None:
+            transcript = "\n".join(
+                f"{message.role.value}: {message.content}" for message in older
+                if message.content and message.role in (MessageRole.USER, MessageRole.ASSISTANT)
+            )
+            try:
+                prompt = MEMORY_SUMMARY_PROMPT_TMPL.format(summary=summary or "(none)", transcript=transcript)
+                summary = str(self.llm.complete(prompt)).strip()
+            except Exception:
+                # keep the previous summary, the messages are dropped either way to stay within the budget
+                pass
+
+        older_dicts = [message_to_dict(message) for message in older]
+
+        def fold(current: List[ChatMessage], current_summary: str):
+            # turns appended meanwhile are kept, a compaction done meanwhile by another worker wins
+            if [message_to_dict(message) for message in current[:len(older)]] != older_dicts:
+                return None
+            return current[len(older):], summary
+
+        if self._update(fold):
+            with _stats_lock:
+                _stats["compactions"] += 1
+                _stats["summarized_messages"] += len(older)
+
+    def get_all(self) -> List[ChatMessage]:
+        return list(self._load())
+
+    def put(self, message: ChatMessage) -> None:
+        self._update(lambda messages, summary: (messages + [message], summary))
+
+    def put_messages(self, messages: List[ChatMessage]) -> None:
+        self._update(lambda current, summary: (current + list(messages), summary))
+
+    def set(self, messages: List[ChatMessage]) -> None:
+        self._update(lambda current, summary: (list(messages), summary))
+
+    def reset(self) -> None:
+        self.store.delete(self.key)
+        self._messages = []
+        self._summary = ""
+        self._version = 0
+
+
+# shared by the threads of a worker
+_stats = {"compactions": 0, "summarized_messages": 0, "write_conflicts": 0}
+_stats_lock = threading.Lock()
+_conversation_store: Optional[ConversationStore] = None
+_conversation_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    """Return the process wide store of MEMORY_BACKEND, "sqlite" or "memory"."""
+    global _conversation_store
+    with _conversation_store_lock:
+        if _conversation_store is None:
+            if MEMORY_BACKEND == "memory":
+                _conversation_store = InMemoryConversationStore()
+            else:
+                _conversation_store = SQLiteConversationStore(MEMORY_DB_PATH, MEMORY_TTL_SECONDS)
+        return _conversation_store
+
+
+def create_memory(collection_name: str, session_id: str, agent_name: str, llm: Optional[LLM] = None) -> ConversationMemory:
+    """Memory of one agent of a session, the same key is used by every worker and after restarts."""
+    return ConversationMemory.from_defaults(key=f"{collection_name}:{session_id}:{agent_name}", llm=llm)
+
+
+def memory_stats() -> dict:
+    store = get_conversation_store()
+    with _stats_lock:
+        stats = dict(_stats)
+    return {"backend": store.name, "conversations": store.count(), "token_limit": MEMORY_TOKEN_LIMIT, **stats}
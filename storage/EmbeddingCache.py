@@ -0,0 +1,202 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from constants import EMBEDDING_CACHE_PATH, OPENAI_EMBEDDING_MODEL, QUERY_EMBEDDING_CACHE_SIZE
+
+"""
+Content-addressed, on-disk cache of text embeddings.
+
+Embeddings are stored in SQLite next to the Chroma collections, keyed by the hash of the model name and
+the chunk text, so re-ingesting unchanged content does not call the embedding API again.
+Query embeddings are kept in memory in an LRU keyed by the query string, so the same query asked again
+(or embedded again by the FAQ match, the retrieval and the routing of one turn) skips the embedding API.
+"""
+
+
+class CachedEmbedding(BaseEmbedding):
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _db_path: str = PrivateAttr()
+    _connection: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+    _pid: Optional[int] = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+    _query_cache: "OrderedDict[str, Embedding]" = PrivateAttr(default_factory=OrderedDict)
+    # separate from the lock of the database, lookups do not wait for a batch being written
+    _query_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _query_cache_size: int = PrivateAttr(default=QUERY_EMBEDDING_CACHE_SIZE)
+    _query_hits: int = PrivateAttr(default=0)
+    _query_misses: int = PrivateAttr(default=0)
+
+    def __init__(self, embed_model: BaseEmbedding, db_path: str, query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE, **kwargs) -> None:
+
+        """
+        Initialize the CachedEmbedding.
+
+        Args:
+            embed_model (BaseEmbedding): The embedding model to wrap.
+            db_path (str): Path of the SQLite database holding the cached embeddings.
+            query_cache_size (int): Number of query embeddings kept in memory, 0 to pass the queries through.
+        """
+
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs
+        )
+        self._embed_model = embed_model
+        self._db_path = db_path
+        self._query_cache_size = query_cache_size
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # Opened lazily, and again after a fork: the gunicorn master embeds while warming up (preload_app),
+        # a connection cannot be shared with the workers
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self._db_path), exist_ok=True)
+            connection = sqlite3.connect(self._db_path, timeout=30, check_same_thread=False)
+            # WAL lets the gunicorn workers read while another one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT NOT NULL, embedding BLOB NOT NULL)"
+            )
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _load(self, keys: List[str]) -> Dict[str, Embedding]:
+        found: Dict[str, Embedding] = {}
+        with self._lock:
+            connection = self._get_connection()
+            # stay under the SQLite host parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("d", blob).tolist()
+        return found
+
+    def _save(self, items: Dict[str, Embedding]) -> None:
+        with self._lock:
+            connection = self._get_connection()
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, embedding) VALUES (?, ?, ?)",
+                [(key, self.model_name, array("d", embedding).tobytes()) for key, embedding in items.items()]
+            )
+            connection.commit()
+
+    def _split(self, texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        cached = self._load(list(set(keys)))
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing[key] = text
+        with self._lock:
+            self._hits += len(texts) - len(missing)
+            self._misses += len(missing)
+        return keys, cached, missing
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, cached, missing = self._split(texts)
+        if missing:
+            embeddings = self._embed_model._get_text_embeddings(list(missing.values()))
+            new_items = dict(zip(missing.keys(), embeddings))
+            self._save(new_items)
+            cached.update(new_items)
+        return [cached[key] for key in keys]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, cached, missing = self._split(texts)
+        if missing:
+            embeddings = await self._embed_model._aget_text_embeddings(list(missing.values()))
+            new_items = dict(zip(missing.keys(), embeddings))
+            self._save(new_items)
+            cached.update(new_items)
+        return [cached[key] for key in keys]
+
+    def get_cached_text_embeddings(self, texts: List[str]) -> List[Optional[Embedding]]:
+        """Embeddings of the texts found in the cache, None for the others, the embedding API is not called."""
+        keys = [self._key(text) for text in texts]
+        cached = self._load(list(set(keys)))
+        return [cached.get(key) for key in keys]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _cached_query(self, query: str) -> Optional[Embedding]:
+        with self._query_lock:
+            embedding = self._query_cache.get(query)
+            if embedding is None:
+                self._query_misses += 1
+                return None
+            self._query_cache.move_to_end(query)
+            self._query_hits += 1
+            return embedding
+
+    def _cache_query(self, query: str, embedding: Embedding) -> None:
+        if self._query_cache_size <= 0:
+            return
+        with self._query_lock:
+            self._query_cache[query] = embedding
+            self._query_cache.move_to_end(query)
+            while len(self._query_cache) > self._query_cache_size:
+                self._query_cache.popitem(last=False)
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        embedding = self._cached_query(query)
+        if embedding is None:
+            embedding = self._embed_model._get_query_embedding(query)
+            self._cache_query(query, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        embedding = self._cached_query(query)
+        if embedding is None:
+            embedding = await self._embed_model._aget_query_embedding(query)
+            self._cache_query(query, embedding)
+        return embedding
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        query_lookups = self._query_hits + self._query_misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": self._hits / lookups if lookups else 0.0,
+            "query_hits": self._query_hits,
+            "query_misses": self._query_misses,
+            "query_hit_ratio": self._query_hits / query_lookups if query_lookups else 0.0,
+            "query_cache_entries": len(self._query_cache),
+        }
+
+
+_cached_embed_model: Optional[CachedEmbedding] = None
+
+
+def get_cached_embed_model() -> CachedEmbedding:
+    """Return the process wide cached wrapper of OPENAI_EMBEDDING_MODEL used by all ingestion paths."""
+    global _cached_embed_model
+    if _cached_embed_model is None:
+        _cached_embed_model = CachedEmbedding(embed_model=OPENAI_EMBEDDING_MODEL, db_path=EMBEDDING_CACHE_PATH)
+    return _cached_embed_model
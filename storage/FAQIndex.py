@@ -0,0 +1,224 @@
+import csv
+import difflib
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+"""
+In-memory index of curated question/answer pairs.
+
+The question side of the QA CSVs of a collection (e.g. Cleaned_QA_Pairs.csv) is indexed three ways:
+normalized exact match, fuzzy match (the content words of the query all in the question, worded
+differently) and embedding similarity. A query matching a curated question above the thresholds is
+answered with the curated answer, without retrieval or agents.
+"""
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "do", "does", "can", "i", "you", "we", "my", "your", "to", "of", "in",
+    "on", "for", "with", "and", "or", "it", "be", "me", "please", "there", "any",
+}
+
+
+def normalize_question(question: str) -> str:
+    """Lower case, punctuation removed, whitespace collapsed, "core dna" spelled as one word."""
+    question = re.sub(r"[^a-z0-9 ]+", " ", question.lower())
+    question = re.sub(r"\bcore dna\b", "coredna", question)
+    return " ".join(question.split())
+
+
+def question_tokens(question: str) -> set:
+    return {token for token in normalize_question(question).split() if token not in STOPWORDS}
+
+
+class FAQMatch:
+    def __init__(self, question: str, answer: str, score: float, method: str) -> None:
+
+        """
+        Initialize the FAQMatch.
+
+        Args:
+            question (str): The curated question that matched.
+            answer (str): Its curated answer.
+            score (float): The match score, 1.0 for an exact match.
+            method (str): How the query matched, exact, fuzzy or embedding.
+        """
+
+        self.question = question
+        self.answer = answer
+        self.score = score
+        self.method = method
+
+    def to_dict(self) -> dict:
+        return {"question": self.question, "answer": self.answer, "score": self.score, "method": self.method}
+
+
+class FAQIndex:
+    def __init__(self, embed_model, fuzzy_threshold: float, embedding_threshold: float) -> None:
+
+        """
+        Initialize the FAQIndex.
+
+        Args:
+            embed_model (BaseEmbedding): The model used to embed the questions and queries.
+            fuzzy_threshold (float): Minimum fuzzy token score of a match.
+            embedding_threshold (float): Minimum cosine similarity of a match by embedding.
+        """
+
+        self.embed_model = embed_model
+        self.fuzzy_threshold = fuzzy_threshold
+        self.embedding_threshold = embedding_threshold
+
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self._exact: Dict[str, int] = {}
+        self._tokens: List[set] = []
+        self._embeddings: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+        self.matches = {"exact": 0, "fuzzy": 0, "embedding": 0}
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def add_pairs(self, pairs: List[tuple]) -> int:
+
+        """
+        Add question/answer pairs, questions already indexed are replaced.
+
+        Args:
+            pairs (List[tuple]): The (question, answer) pairs.
+
+        Returns:
+            int: Number of new questions.
+        """
+
+        added = 0
+        with self._lock:
+            for question, answer in pairs:
+                question, answer = (question or "").strip(), (answer or "").strip()
+                key = normalize_question(question)
+                if not key or not answer:
+                    continue
+                if key in self._exact:
+                    self.answers[self._exact[key]] = answer
+                    continue
+                self._exact[key] = len(self.questions)
+                self.questions.append(question)
+                self.answers.append(answer)
+                self._tokens.append(question_tokens(question))
+                added += 1
+            if added:
+                # embedded again on the next lookup, the embedding cache makes it cheap
+                self._embeddings = None
+        return added
+
+    def load_csv(self, path: str, question_column: str, answer_column: str) -> int:
+
+        """
+        Add the pairs of a CSV file.
+
+        Returns:
+            int: Number of new questions, 0 if the file does not have the question and answer columns.
+        """
+
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.DictReader(f)
+            if not reader.fieldnames or question_column not in reader.fieldnames or answer_column not in reader.fieldnames:
+                return 0
+            return self.add_pairs([(row[question_column], row[answer_column]) for row in reader])
+
+    def _question_embeddings(self) -> np.ndarray:
+        with self._lock:
+            if self._embeddings is None:
+                embeddings = np.asarray(self.embed_model.get_text_embedding_batch(self.questions), dtype=np.float32)
+                norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                self._embeddings = embeddings / norms
+            return self._embeddings
+
+    def _fuzzy_score(self, tokens: set, normalized: str, position: int) -> float:
+        candidate = self._tokens[position]
+        # every content word of the query must be in the question, a close spelling of another word
+        # ("partners" for "users") is a different question, not a typo
+        if not tokens or not candidate or not tokens <= candidate:
+            return 0.0
+        jaccard = len(tokens & candidate) / len(tokens | candidate)
+        ratio = difflib.SequenceMatcher(None, normalized, normalize_question(self.questions[position])).ratio()
+        return max(jaccard, ratio)
+
+    def match(self, query: str) -> Optional[FAQMatch]:
+
+        """
+        Find the curated question matching a query, the cheap methods are tried first.
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            Optional[FAQMatch]: The match, None if no curated question is close enough.
+        """
+
+        if not self.questions:
+            return None
+
+        normalized = normalize_question(query)
+        position = self._exact.get(normalized)
+        if position is not None:
+            return self._matched(position, 1.0, "exact")
+
+        tokens = question_tokens(query)
+        scores = [self._fuzzy_score(tokens, normalized, position) for position in range(len(self.questions))]
+        best = int(np.argmax(scores))
+        if scores[best] >= self.fuzzy_threshold:
+            return self._matched(best, scores[best], "fuzzy")
+
+        query_embedding = np.asarray(self.embed_model.get_query_embedding(query), dtype=np.float32)
+        norm = np.linalg.norm(query_embedding)
+        similarities = self._question_embeddings() @ (query_embedding / norm if norm else query_embedding)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.embedding_threshold:
+            return self._matched(best, float(similarities[best]), "embedding")
+
+        self.misses += 1
+        return None
+
+    def _matched(self, position: int, score: float, method: str) -> FAQMatch:
+        self.matches[method] += 1
+        return FAQMatch(self.questions[position], self.answers[position], float(score), method)
+
+    def stats(self) -> dict:
+        return {
+            "questions": len(self.questions),
+            "fuzzy_threshold": self.fuzzy_threshold,
+            "embedding_threshold": self.embedding_threshold,
+            "matches": dict(self.matches),
+            "misses": self.misses,
+        }
+
+
+def load_faq_directory(faq_index: FAQIndex, directory_path: str, file_names: List[str], question_column: str, answer_column: str) -> int:
+
+    """
+    Load the QA files of a data directory into a FAQ index.
+
+    Args:
+        faq_index (FAQIndex): The index to add the pairs to.
+        directory_path (str): The data directory of the collection.
+        file_names (List[str]): Names of the QA CSV files.
+        question_column (str): Name of the question column.
+        answer_column (str): Name of the answer column.
+
+    Returns:
+        int: Number of new questions.
+    """
+
+    added = 0
+    for file_name in file_names:
+        path = os.path.join(directory_path, file_name)
+        if os.path.isfile(path):
+            added += faq_index.load_csv(path, question_column, answer_column)
+    return added
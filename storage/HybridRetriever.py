@@ -0,0 +1,68 @@
+from typing import Dict, List, Optional
+
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from storage.BM25Index import BM25Index
+
+"""
+Hybrid retrieval, BM25 and vector results fused with reciprocal rank fusion.
+
+Each retriever returns a deeper candidate list, a node scores sum(1 / (k + rank)) over the lists it
+appears in, so a node ranked well by either keyword or vector search makes it to the top_k.
+"""
+
+
+def reciprocal_rank_fusion(result_lists: List[List[NodeWithScore]], k: int, top_k: int) -> List[NodeWithScore]:
+
+    """
+    Fuse ranked result lists.
+
+    Args:
+        result_lists (List[List[NodeWithScore]]): The ranked results of each retriever, best first.
+        k (int): Dampens the weight of the first ranks, 60 in the original paper.
+        top_k (int): Number of nodes to return.
+
+    Returns:
+        List[NodeWithScore]: The fused results, scored with their RRF score.
+    """
+
+    scores: Dict[str, float] = {}
+    nodes: Dict[str, NodeWithScore] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            node_id = result.node.node_id
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+            nodes.setdefault(node_id, result)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [NodeWithScore(node=nodes[node_id].node, score=scores[node_id]) for node_id in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever fusing a vector retriever with a BM25 index, drops in wherever a retriever is expected."""
+
+    def __init__(
+            self,
+            vector_retriever: BaseRetriever,
+            bm25_index: BM25Index,
+            similarity_top_k: int,
+            candidates: int,
+            rrf_k: int,
+            callback_manager: Optional[CallbackManager] = None
+    ) -> None:
+        self._vector_retriever = vector_retriever
+        self._bm25_index = bm25_index
+        self._similarity_top_k = similarity_top_k
+        self._candidates = candidates
+        self._rrf_k = rrf_k
+        super().__init__(callback_manager=callback_manager)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        vector_results = self._vector_retriever.retrieve(query_bundle)
+        keyword_results = [
+            NodeWithScore(node=node, score=score)
+            for node, score in self._bm25_index.query(query_bundle.query_str, self._candidates)
+        ]
+        return reciprocal_rank_fusion([vector_results, keyword_results], self._rrf_k, self._similarity_top_k)
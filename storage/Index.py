@@ -3,18 +3,63 @@ from llama_index.core import (
     StorageContext,
     load_index_from_storage
 )
-import chromadb, os
-from utils import ensure_directory_exists, load_data_from_files
+import chromadb, os, traceback
+from llama_index.core.vector_stores import MetadataFilter, MetadataFilters
+from llama_index.core.retrievers import BaseRetriever
+from typing import Callable, Dict, List, Optional
+from llama_index.core.schema import BaseNode
+from utils import ensure_directory_exists, load_data_from_files, insert_into_index, ReadWriteLock
 from llama_index.vector_stores.chroma import ChromaVectorStore
-from constants import CHROMA_DB_PATH, OPENAI_EMBEDDING_MODEL
+from llama_index.core.instrumentation import get_dispatcher
+from constants import (
+    CHROMA_DB_PATH, OPENAI_EMBEDDING_MODEL, RETRIEVAL_MODE, HYBRID_CANDIDATES, HYBRID_RRF_K, VECTOR_STORE_BACKEND
+)
+from storage.EmbeddingCache import get_cached_embed_model
+from storage.BM25Index import BM25Index
+from storage.HybridRetriever import HybridRetriever
+from storage.NumpyVectorStore import NumpyVectorStore
+
+dispatcher = get_dispatcher(__name__)
+
+
+class TracedChromaVectorStore(ChromaVectorStore):
+    """ChromaVectorStore with a span per operation, their latency shows in the request traces and /metrics."""
+
+    @dispatcher.span
+    def add(self, *args, **kwargs):
+        return super().add(*args, **kwargs)
+
+    @dispatcher.span
+    def query(self, *args, **kwargs):
+        return super().query(*args, **kwargs)
+
+    @dispatcher.span
+    def get_nodes(self, *args, **kwargs):
+        return super().get_nodes(*args, **kwargs)
+
+    @dispatcher.span
+    def delete(self, *args, **kwargs):
+        return super().delete(*args, **kwargs)
+
+    @dispatcher.span
+    def delete_nodes(self, *args, **kwargs):
+        return super().delete_nodes(*args, **kwargs)
+
+    @dispatcher.span
+    def get_embeddings(self, node_ids: List[str]) -> Dict[str, List[float]]:
+        """The stored embeddings of the nodes, by node id."""
+        result = self._collection.get(ids=node_ids, include=["embeddings"])
+        return {node_id: list(embedding) for node_id, embedding in zip(result["ids"], result["embeddings"])}
+
 
 class Index:
-    def __init__(self, collection_name: str) -> None:
+    def __init__(self, collection_name: str, backend: str = VECTOR_STORE_BACKEND) -> None:
         """
         Initialize the Index class.
 
         Args:
             collection_name (str): The name of the collection to use for the ChromaDB.
+            backend (str): The vector store, "chroma" or "numpy".
         """
         
         collection_path = os.path.join(CHROMA_DB_PATH, collection_name)
@@ -22,16 +67,30 @@ class Index:
         # Ensure the directory exists
         ensure_directory_exists(collection_path)
 
-        db = chromadb.PersistentClient(path=collection_path)
+        if backend == "numpy":
+            vector_store = NumpyVectorStore(persist_dir=os.path.join(collection_path, "numpy"))
+        elif backend == "chroma":
+            db = chromadb.PersistentClient(path=collection_path)
 
-        collection = db.get_or_create_collection(collection_name)
-        vector_store = ChromaVectorStore(chroma_collection=collection)
+            collection = db.get_or_create_collection(collection_name)
+            vector_store = TracedChromaVectorStore(chroma_collection=collection)
+        else:
+            raise ValueError(f"Unknown vector store backend: {backend}")
 
         self.collection_name = collection_name
         self.collection_path = collection_path
         self.vector_store = vector_store
         self.storage_context = StorageContext.from_defaults(vector_store=vector_store)
         self.index = None
+        # Embeddings of unchanged chunks are served from the on-disk cache
+        self.embed_model = get_cached_embed_model()
+        self.change_listeners: List[Callable[[str], None]] = []
+        # incremented on every change, lets other processes notice the index changed
+        self.version = 0
+        # retrievals run concurrently, writes to the vector store one at a time
+        self.lock = ReadWriteLock()
+        # keyword index of the same nodes, kept in sync by add_nodes and the delete methods
+        self.bm25 = BM25Index()
 
     def load_or_create_index(self) -> VectorStoreIndex:
         """
@@ -43,7 +102,7 @@ class Index:
         try:
             # Attempt to load the index from storage
             # self.index = load_index_from_storage(storage_context=self.storage_context)
-            self.index = VectorStoreIndex.from_vector_store(self.vector_store)
+            self.index = VectorStoreIndex.from_vector_store(self.vector_store, embed_model=self.embed_model)
             print("Index found")
         except Exception:
             # Index does not exist, create a new one
@@ -51,6 +110,13 @@ class Index:
             self.index = self._create_index()
             self.index.storage_context.persist(persist_dir=self.collection_path)
 
+        # outside the try above, a failure here must not re-ingest the data directory into the existing collection
+        try:
+            self.load_bm25()
+        except Exception:
+            traceback.print_exc()
+            print("BM25 index could not be built, retrieval falls back to the vectors")
+
         return self.index
 
     def _create_index(self) -> VectorStoreIndex:
@@ -64,7 +130,11 @@ class Index:
         file_docs = load_data_from_files(directory=self.collection_name)
 
         # Create a new index from the documents
-        index = VectorStoreIndex.from_documents(documents=file_docs, storage_context=self.storage_context)
+        index = VectorStoreIndex.from_documents(
+            documents=file_docs,
+            storage_context=self.storage_context,
+            embed_model=self.embed_model
+        )
         
         return index
 
@@ -79,6 +149,87 @@ class Index:
             raise ValueError("Index is not loaded. Call 'load_or_create_index' first.")
         return self.index
     
+    def is_loaded(self) -> bool:
+        return self.index is not None
+
+    def get_version(self) -> int:
+        return self.version
+
+    def as_retriever(self, similarity_top_k: int) -> BaseRetriever:
+        """
+        Get a retriever over the loaded index, hybrid BM25 and vector search unless RETRIEVAL_MODE is "vector".
+
+        Args:
+            similarity_top_k (int): Number of nodes to retrieve.
+
+        Returns:
+            BaseRetriever: The retriever.
+        """
+        if RETRIEVAL_MODE != "hybrid":
+            return self.get_index().as_retriever(similarity_top_k=similarity_top_k)
+
+        candidates = max(similarity_top_k, HYBRID_CANDIDATES)
+        return HybridRetriever(
+            vector_retriever=self.get_index().as_retriever(similarity_top_k=candidates),
+            bm25_index=self.bm25,
+            similarity_top_k=similarity_top_k,
+            candidates=candidates,
+            rrf_k=HYBRID_RRF_K
+        )
+
+    def get_node_embeddings(self, node_ids: List[str]) -> Dict[str, List[float]]:
+        """
+        Read the embeddings of nodes from the vector store, no embedding API call.
+
+        Args:
+            node_ids (List[str]): The ids of the nodes.
+
+        Returns:
+            Dict[str, List[float]]: The embeddings of the nodes found, by node id.
+        """
+        if not node_ids:
+            return {}
+        return self.vector_store.get_embeddings(node_ids)
+
+    def load_bm25(self) -> None:
+        """
+        Rebuild the BM25 index from the nodes stored in the vector store.
+        """
+        bm25 = BM25Index()
+        bm25.add(self.vector_store.get_nodes(None))
+        self.bm25 = bm25
+        print(f"BM25 index built with {len(self.bm25)} nodes")
+
+    def add_nodes(self, nodes: List[BaseNode]) -> None:
+        """
+        Insert nodes into the vector index and the BM25 index.
+
+        Args:
+            nodes (List[BaseNode]): The nodes, nodes carrying an embedding are not embedded again.
+        """
+        self.get_index().insert_nodes(nodes)
+        self.bm25.add(nodes)
+
+    def delete_ref_doc(self, ref_doc_id: str) -> None:
+        """
+        Delete the nodes of a document from the vector index and the BM25 index.
+
+        Args:
+            ref_doc_id (str): The id of the document.
+        """
+        self.get_index().delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+        self.bm25.delete_ref_doc(ref_doc_id)
+
+    def delete_source(self, source: str) -> None:
+        """
+        Delete the nodes of a web page from the vector index and the BM25 index.
+
+        Args:
+            source (str): The URL of the page, stored in the Source metadata of its nodes.
+        """
+        self.vector_store.delete_nodes(filters=MetadataFilters(filters=[MetadataFilter(key="Source", value=source)]))
+        self.bm25.delete_where(lambda node: node.metadata.get("Source") == source)
+
     def get_storage_context(self) -> StorageContext:
         """
         Get the currently loaded storage_context.
@@ -96,3 +247,37 @@ class Index:
             StorageContext: The loaded StorageContext.
         """
         return self.collection_path
+
+    def add_change_listener(self, listener: Callable[[str], None]) -> None:
+        """
+        Register a callback called with the collection name whenever the index content changes.
+
+        Args:
+            listener (Callable[[str], None]): The callback, e.g. to invalidate cached answers.
+        """
+        self.change_listeners.append(listener)
+
+    def notify_changed(self) -> None:
+        """
+        Notify the change listeners that documents were added to or removed from the index.
+        """
+        self.version += 1
+        for listener in self.change_listeners:
+            listener(self.collection_name)
+
+    def insert_file(self, doc: str, doc_id: Optional[str] = None) -> VectorStoreIndex:
+        """
+        Process a file and insert it into the loaded index, see `utils.insert_into_index`.
+
+        Args:
+            doc (str): The path of the file, relative to the data directory.
+            doc_id (Optional[str]): The id of the document, usually is the file name.
+
+        Returns:
+            VectorStoreIndex: The updated index.
+        """
+        with self.lock.write():
+            index = insert_into_index(self.get_index(), doc, doc_id)
+            self.load_bm25()
+        self.notify_changed()
+        return index
@@ -0,0 +1,433 @@
+import os
+import tempfile
+import threading
+from multiprocessing.managers import BaseManager
+from typing import Dict, List, Optional, Tuple, Union
+
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.constants import DATA_KEY
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+from constants import (
+    INDEX_SERVICE_ADDRESS, INGEST_JOB_WORKERS, INGEST_JOB_HISTORY, DATA_DIR, FAQ_FILE_NAMES, FAQ_QUESTION_COLUMN,
+    FAQ_ANSWER_COLUMN, FAQ_FUZZY_THRESHOLD, FAQ_EMBEDDING_THRESHOLD
+)
+from storage.FAQIndex import FAQIndex, load_faq_directory
+from storage.Index import Index
+from storage.IngestionJobs import IngestionJob, IngestionJobManager
+from storage.SitemapSync import SitemapSync
+from storage.StreamingIngestor import StreamingIngestor
+from utils import load_data_from_files
+from tracing import instrument
+
+"""
+Index service shared by all the gunicorn workers.
+
+A single process owns the Index handlers (Chroma clients, docstores, embedding cache) and the
+ingestion jobs of every collection. Workers talk to it through a multiprocessing manager over a
+unix socket, so every worker sees the same collections and memory does not grow with the number
+of workers. Retrievals run concurrently, writes to a collection are serialized by its lock.
+
+The service is started by the gunicorn master (see gunicorn.conf.py), the address and authkey are
+passed to the workers through the environment. Without a configured service, e.g. `flask run`,
+the service lives in the current process.
+"""
+
+ADDRESS_ENV = "INDEX_SERVICE_ADDRESS"
+AUTHKEY_ENV = "INDEX_SERVICE_AUTHKEY"
+
+
+class IndexService:
+    def __init__(self, max_workers: int = INGEST_JOB_WORKERS, history_size: int = INGEST_JOB_HISTORY) -> None:
+
+        """
+        Initialize the IndexService.
+
+        Args:
+            max_workers (int): Number of ingestion jobs running at the same time.
+            history_size (int): Number of finished jobs kept for status queries.
+        """
+
+        self.index_handlers: Dict[str, Index] = {}
+        self.faq_indexes: Dict[str, FAQIndex] = {}
+        self.jobs = IngestionJobManager(max_workers=max_workers, history_size=history_size)
+        # Collection queried when a request does not name one, set by /initialize
+        self.default_collection: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def initialize(self, collection_name: str, make_default: bool = True) -> int:
+
+        """
+        Load the index of a collection, once for all the workers.
+
+        Args:
+            collection_name (str): The name of the collection.
+            make_default (bool): Query this collection when a request does not name one.
+
+        Returns:
+            int: The version of the collection.
+        """
+
+        with self._lock:
+            index_handler = self.index_handlers.get(collection_name)
+            if index_handler is None:
+                index_handler = Index(collection_name=collection_name)
+                index_handler.load_or_create_index()
+                self.index_handlers[collection_name] = index_handler
+
+                self.faq_indexes[collection_name] = FAQIndex(
+                    embed_model=index_handler.embed_model,
+                    fuzzy_threshold=FAQ_FUZZY_THRESHOLD,
+                    embedding_threshold=FAQ_EMBEDDING_THRESHOLD
+                )
+                self._load_faq(collection_name, collection_name)
+                print(f"Index for collection '{collection_name}' has been initialized.")
+
+            if make_default:
+                self.default_collection = collection_name
+
+        return index_handler.get_version()
+
+    def _get_handler(self, collection_name: str) -> Index:
+        index_handler = self.index_handlers.get(collection_name)
+        if index_handler is None:
+            raise ValueError(f"Collection '{collection_name}' is not initialized")
+        return index_handler
+
+    def _load_faq(self, collection_name: str, directory: str) -> None:
+        directory_path = os.path.join(DATA_DIR, directory)
+        added = load_faq_directory(
+            self.faq_indexes[collection_name], directory_path, FAQ_FILE_NAMES, FAQ_QUESTION_COLUMN, FAQ_ANSWER_COLUMN
+        )
+        if added:
+            print(f"Loaded {added} curated questions from '{directory_path}' for collection '{collection_name}'.")
+
+    def match_faq(self, collection_name: str, query_str: str) -> Optional[dict]:
+
+        """
+        Match a query against the curated questions of a collection.
+
+        Returns:
+            Optional[dict]: The matched question, its answer, the score and the match method, None if no match.
+        """
+
+        self._get_handler(collection_name)
+        match = self.faq_indexes[collection_name].match(query_str)
+        return match.to_dict() if match else None
+
+    def has_collection(self, collection_name: str) -> bool:
+        return collection_name in self.index_handlers
+
+    def get_default_collection(self) -> Optional[str]:
+        return self.default_collection
+
+    def get_version(self, collection_name: str) -> int:
+        return self._get_handler(collection_name).get_version()
+
+    def retrieve(self, collection_name: str, query_str: str, similarity_top_k: int) -> List[Tuple[dict, Optional[float]]]:
+
+        """
+        Retrieve the nodes most similar to a query.
+
+        Args:
+            collection_name (str): The name of the collection.
+            query_str (str): The query.
+            similarity_top_k (int): Number of nodes to retrieve.
+
+        Returns:
+            List[Tuple[dict, Optional[float]]]: The serialized nodes (see `doc_to_json`) and their scores.
+        """
+
+        return self.retrieve_with_embedding(collection_name, query_str, similarity_top_k)[0]
+
+    def retrieve_with_embedding(
+            self,
+            collection_name: str,
+            query_str: str,
+            similarity_top_k: int
+    ) -> Tuple[List[Tuple[dict, Optional[float]]], Optional[List[float]]]:
+
+        """
+        Retrieve like `retrieve`, and return the query embedding computed by the vector search with the nodes.
+
+        Returns:
+            Tuple[List[Tuple[dict, Optional[float]]], Optional[List[float]]]: The serialized nodes and their scores,
+            and the query embedding, so the worker does not embed the query again (e.g. the context compression).
+            The nodes carry their stored embedding, the context compression scores their sentences with it.
+        """
+
+        index_handler = self._get_handler(collection_name)
+        query_bundle = QueryBundle(query_str)
+        with index_handler.lock.read():
+            nodes = index_handler.as_retriever(similarity_top_k=similarity_top_k).retrieve(query_bundle)
+            embeddings = index_handler.get_node_embeddings([node.node.node_id for node in nodes if node.node.embedding is None])
+        return [(_node_to_json(node.node, embeddings), node.score) for node in nodes], query_bundle.embedding
+
+    def ingest_sitemap(self, collection_name: str, sitemap_url: str, domain: str, incremental: bool, job: Optional[IngestionJob] = None) -> dict:
+
+        """
+        Ingest a sitemap into a collection, reporting progress to the job when given.
+
+        Returns:
+            dict: The counts returned to the client.
+        """
+
+        index_handler = self._get_handler(collection_name)
+        cancel_event = job.cancel_event if job else None
+
+        # Only fetch and re-index the pages that changed since the last sync
+        if incremental:
+            sitemap_sync = SitemapSync(index_handler, cancel_event=cancel_event)
+            if job:
+                job.progress = sitemap_sync.counts
+            return sitemap_sync.sync(sitemap_url, domain)
+
+        # Crawl, chunk, embed in batches and write to the index as the pages arrive
+        ingestor = StreamingIngestor(index_handler, cancel_event=cancel_event)
+        if job:
+            job.progress = ingestor.stats
+        stats = ingestor.ingest_sitemap(sitemap_url, domain)
+
+        return {
+            "documents_processed": stats["documents_processed"],
+            "pages_failed": stats["pages_failed"],
+            "nodes_written": stats["nodes_written"]
+        }
+
+    def ingest_files(
+            self,
+            collection_name: str,
+            directory: str,
+            file_names: Optional[list],
+            column_mapping: Optional[dict] = None,
+            job: Optional[IngestionJob] = None
+    ) -> dict:
+
+        """
+        Ingest files of the data directory into a collection, reporting progress to the job when given.
+        `column_mapping` overrides the CSV column mapping of the directory, see `utils.load_data_from_files`.
+
+        Returns:
+            dict: The counts returned to the client.
+        """
+
+        index_handler = self._get_handler(collection_name)
+        documents = load_data_from_files(file_names=file_names, directory=directory, column_mapping=column_mapping)
+
+        ingestor = StreamingIngestor(index_handler, cancel_event=job.cancel_event if job else None)
+        if job:
+            job.progress = ingestor.stats
+        stats = ingestor.ingest_documents(documents)
+        self._load_faq(collection_name, directory)
+
+        return {
+            "documents_processed": stats["documents_processed"],
+            "nodes_written": stats["nodes_written"]
+        }
+
+    def submit_sitemap(self, collection_name: str, sitemap_url: str, domain: str, incremental: bool, wait: bool = False) -> dict:
+        """Queue a sitemap ingestion job, see `ingest_sitemap`, with `wait` return once it finished."""
+        self._get_handler(collection_name)
+        job = self.jobs.submit(
+            kind="sitemap_incremental" if incremental else "sitemap",
+            collection_name=collection_name,
+            params={"sitemap_url": sitemap_url, "domain": domain},
+            run=lambda job: self.ingest_sitemap(collection_name, sitemap_url, domain, incremental, job)
+        )
+        return self._job_status(job, wait)
+
+    def submit_files(
+            self,
+            collection_name: str,
+            directory: str,
+            file_names: Optional[list],
+            column_mapping: Optional[dict] = None,
+            wait: bool = False
+    ) -> dict:
+        """Queue a file ingestion job, see `ingest_files`, with `wait` return once it finished."""
+        self._get_handler(collection_name)
+        job = self.jobs.submit(
+            kind="files",
+            collection_name=collection_name,
+            params={"directory": directory, "file_names": file_names, "column_mapping": column_mapping},
+            run=lambda job: self.ingest_files(collection_name, directory, file_names, column_mapping, job)
+        )
+        return self._job_status(job, wait)
+
+    @staticmethod
+    def _job_status(job: IngestionJob, wait: bool) -> dict:
+        # a waiting request still goes through the queue, so it never writes next to another job of the collection
+        if wait:
+            job.done.wait()
+            if job.exception is not None:
+                raise job.exception
+        return job.to_dict()
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def list_jobs(self) -> List[dict]:
+        return [job.to_dict() for job in self.jobs.list()]
+
+    def cancel_job(self, job_id: str) -> Optional[dict]:
+        job = self.jobs.cancel(job_id)
+        return job.to_dict() if job else None
+
+    def stats(self) -> dict:
+        embedding_cache = None
+        if self.index_handlers:
+            embedding_cache = next(iter(self.index_handlers.values())).embed_model.stats()
+        return {
+            "pid": os.getpid(),
+            "default_collection": self.default_collection,
+            "collections": {
+                name: {"version": handler.get_version(), "faq": self.faq_indexes[name].stats()}
+                for name, handler in self.index_handlers.items()
+            },
+            "embedding_cache": embedding_cache,
+        }
+
+
+def _node_to_json(node: BaseNode, embeddings: Dict[str, List[float]]) -> dict:
+    # the embedding is set on the serialized copy, the nodes of the BM25 index do not keep it
+    data = doc_to_json(node)
+    if node.node_id in embeddings:
+        data[DATA_KEY]["embedding"] = embeddings[node.node_id]
+    return data
+
+
+class ServiceRetriever(BaseRetriever):
+    """Retriever reading the nodes of a collection from the index service."""
+
+    def __init__(
+            self,
+            service: IndexService,
+            collection_name: str,
+            similarity_top_k: int,
+            callback_manager: Optional[CallbackManager] = None
+    ) -> None:
+        self._service = service
+        self._collection_name = collection_name
+        self._similarity_top_k = similarity_top_k
+        super().__init__(callback_manager=callback_manager)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        results, embedding = self._service.retrieve_with_embedding(
+            self._collection_name, query_bundle.query_str, self._similarity_top_k
+        )
+        # the node postprocessors of the query engine get the same bundle
+        if query_bundle.embedding is None:
+            query_bundle.embedding = embedding
+        return [NodeWithScore(node=json_to_doc(node), score=score) for node, score in results]
+
+
+class RemoteIndex:
+    def __init__(self, service: IndexService, collection_name: str) -> None:
+
+        """
+        Initialize the RemoteIndex, the worker side view of a collection owned by the index service.
+
+        Args:
+            service (IndexService): The index service, usually a proxy returned by `get_index_service`.
+            collection_name (str): The name of the collection.
+        """
+
+        self.service = service
+        self.collection_name = collection_name
+
+    def is_loaded(self) -> bool:
+        return self.service.has_collection(self.collection_name)
+
+    def get_version(self) -> int:
+        return self.service.get_version(self.collection_name)
+
+    def as_retriever(self, similarity_top_k: int) -> BaseRetriever:
+        return ServiceRetriever(self.service, self.collection_name, similarity_top_k)
+
+
+# The service instance of the process running it
+_service: Optional[IndexService] = None
+_service_lock = threading.Lock()
+
+
+def _get_local_service() -> IndexService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            # the retrievals, embeddings and Chroma operations of the service process show in /metrics too
+            instrument()
+            _service = IndexService()
+        return _service
+
+
+class IndexServiceManager(BaseManager):
+    pass
+
+
+IndexServiceManager.register("get_index_service", callable=_get_local_service)
+
+
+def _parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    # host:port for a TCP socket, anything else is a unix socket path
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def start_index_service(address: Optional[str] = INDEX_SERVICE_ADDRESS) -> IndexServiceManager:
+
+    """
+    Start the index service in a child process, called once by the gunicorn master before forking the workers.
+
+    The address and authkey are exported to the environment so the workers inherit them.
+
+    Args:
+        address (Optional[str]): A unix socket path or host:port, a socket in the temp directory is used when missing.
+
+    Returns:
+        IndexServiceManager: The started manager, call `shutdown` on exit.
+    """
+
+    address = address or os.path.join(tempfile.gettempdir(), f"index-service-{os.getpid()}.sock")
+    authkey = os.environ.get(AUTHKEY_ENV) or os.urandom(32).hex()
+
+    manager = IndexServiceManager(address=_parse_address(address), authkey=bytes.fromhex(authkey))
+    manager.start()
+
+    os.environ[ADDRESS_ENV] = address
+    os.environ[AUTHKEY_ENV] = authkey
+    print(f"Index service started on {address}")
+    return manager
+
+
+# Proxy of the current process, proxies must not be shared with forked children
+_proxy = None
+_proxy_pid: Optional[int] = None
+
+
+def get_index_service() -> IndexService:
+
+    """
+    Get the index service, a proxy to the shared service when one was started, else the local instance.
+
+    Returns:
+        IndexService: The service, or a proxy exposing the same methods.
+    """
+
+    global _proxy, _proxy_pid
+
+    address = os.environ.get(ADDRESS_ENV)
+    if not address:
+        return _get_local_service()
+
+    with _service_lock:
+        if _proxy is None or _proxy_pid != os.getpid():
+            manager = IndexServiceManager(address=_parse_address(address), authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+            manager.connect()
+            _proxy = manager.get_index_service()
+            _proxy_pid = os.getpid()
+        return _proxy
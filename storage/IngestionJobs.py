@@ -0,0 +1,176 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+"""
+Background ingestion jobs.
+
+Ingestion requests are queued on a thread pool and return a job id straight away, the job reports
+its progress (pages fetched, nodes embedded, errors, throughput) while it runs and can be cancelled.
+Jobs writing to the same collection run one after the other, requests waiting for the result wait
+for their job so they are serialized too.
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class IngestionJob:
+    def __init__(self, kind: str, collection_name: str, params: dict) -> None:
+
+        """
+        Initialize the IngestionJob.
+
+        Args:
+            kind (str): The kind of ingestion, e.g. sitemap or files.
+            collection_name (str): The collection the job writes to.
+            params (dict): The parameters of the request, reported back as is.
+        """
+
+        self.job_id = str(uuid.uuid4())
+        self.kind = kind
+        self.collection_name = collection_name
+        self.params = params
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        # the exception of a failed job, raised again to the requests waiting for it
+        self.exception: Optional[Exception] = None
+        self.cancel_event = threading.Event()
+        # set when the job finished, whatever its status
+        self.done = threading.Event()
+        # live stats of the running ingestion, e.g. StreamingIngestor.stats
+        self.progress: dict = {}
+
+    def cancel(self) -> bool:
+        """Ask the job to stop, returns False if it already finished."""
+        if self.status in (SUCCEEDED, FAILED, CANCELLED):
+            return False
+        self.cancel_event.set()
+        return True
+
+    def to_dict(self) -> dict:
+        progress = dict(self.progress)
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+
+        throughput = {}
+        if elapsed > 0:
+            if "pages_fetched" in progress:
+                throughput["pages_per_second"] = progress["pages_fetched"] / elapsed
+            if "nodes_embedded" in progress:
+                throughput["nodes_per_second"] = progress["nodes_embedded"] / elapsed
+
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "collection_name": self.collection_name,
+            "params": self.params,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": elapsed,
+            "progress": progress,
+            "throughput": throughput,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class IngestionJobManager:
+    def __init__(self, max_workers: int, history_size: int) -> None:
+
+        """
+        Initialize the IngestionJobManager.
+
+        Args:
+            max_workers (int): Number of jobs running at the same time.
+            history_size (int): Number of finished jobs kept for status queries.
+        """
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest-job")
+        self.history_size = history_size
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._collection_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, collection_name: str, params: dict, run: Callable[[IngestionJob], dict]) -> IngestionJob:
+
+        """
+        Queue an ingestion job.
+
+        Args:
+            kind (str): The kind of ingestion, e.g. sitemap or files.
+            collection_name (str): The collection the job writes to.
+            params (dict): The parameters of the request.
+            run (Callable[[IngestionJob], dict]): Does the work and returns the result, it should update
+                `job.progress` and stop when `job.cancel_event` is set.
+
+        Returns:
+            IngestionJob: The queued job.
+        """
+
+        job = IngestionJob(kind, collection_name, params)
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._trim_history()
+            collection_lock = self._collection_locks.setdefault(collection_name, threading.Lock())
+
+        self.executor.submit(self._run, job, run, collection_lock)
+        return job
+
+    def _run(self, job: IngestionJob, run: Callable[[IngestionJob], dict], collection_lock: threading.Lock) -> None:
+        with collection_lock:
+            if job.cancel_event.is_set():
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                job.done.set()
+                return
+
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                job.result = run(job)
+                job.status = CANCELLED if job.cancel_event.is_set() else SUCCEEDED
+            except Exception as e:
+                if job.cancel_event.is_set():
+                    job.status = CANCELLED
+                else:
+                    traceback.print_exc()
+                    job.status = FAILED
+                    job.error = str(e)
+                    job.exception = e
+            finally:
+                job.finished_at = time.time()
+                job.done.set()
+
+    def _trim_history(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestionJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[IngestionJob]:
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
@@ -0,0 +1,339 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+"""
+In-process vector store keeping the embeddings in a memory-mapped float32 .npy matrix.
+
+Meant for small collections (hundreds to a few thousand nodes) where a brute-force matrix product
+beats the startup and per-query overhead of Chroma (SQLite + HNSW). Files in the persist directory:
+
+    vectors.npy   normalized embeddings, one row per node, grown by doubling its capacity
+    nodes.jsonl   append-only log of the added nodes (id, text, metadata) and of the deleted rows
+
+Deleted rows are masked until more than half of the rows are deleted, then both files are compacted.
+Similarity is the cosine similarity.
+"""
+
+VECTORS_FILE_NAME = "vectors.npy"
+NODES_FILE_NAME = "nodes.jsonl"
+INITIAL_CAPACITY = 256
+
+
+def _matches(metadata: Dict[str, Any], filters: Optional[MetadataFilters]) -> bool:
+    if filters is None or not filters.filters:
+        return True
+
+    results = []
+    for metadata_filter in filters.filters:
+        if isinstance(metadata_filter, MetadataFilters):
+            results.append(_matches(metadata, metadata_filter))
+            continue
+
+        value = metadata.get(metadata_filter.key)
+        operator = metadata_filter.operator
+        if operator == FilterOperator.EQ:
+            results.append(value == metadata_filter.value)
+        elif operator == FilterOperator.NE:
+            results.append(value != metadata_filter.value)
+        elif operator == FilterOperator.IN:
+            results.append(value in metadata_filter.value)
+        elif operator == FilterOperator.NIN:
+            results.append(value not in metadata_filter.value)
+        else:
+            raise NotImplementedError(f"Filter operator {operator} is not supported by the numpy vector store")
+
+    return any(results) if filters.condition == FilterCondition.OR else all(results)
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    stores_text: bool = True
+    persist_dir: str
+
+    _vectors: Optional[np.memmap] = PrivateAttr(default=None)
+    _count: int = PrivateAttr(default=0)
+    _alive: Optional[np.ndarray] = PrivateAttr(default=None)
+    # row -> {"id", "ref_doc_id", "text", "metadata"}, None once deleted
+    _records: List[Optional[dict]] = PrivateAttr(default_factory=list)
+    _rows: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    def __init__(self, persist_dir: str, **kwargs: Any) -> None:
+
+        """
+        Initialize the NumpyVectorStore, loading the persisted vectors if any.
+
+        Args:
+            persist_dir (str): The directory of the vectors and nodes files.
+        """
+
+        super().__init__(persist_dir=persist_dir, **kwargs)
+        os.makedirs(persist_dir, exist_ok=True)
+        self._load()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.persist_dir, VECTORS_FILE_NAME)
+
+    @property
+    def nodes_path(self) -> str:
+        return os.path.join(self.persist_dir, NODES_FILE_NAME)
+
+    # no __len__, llama_index tests vector stores for truthiness
+    def node_count(self) -> int:
+        return len(self._rows)
+
+    def _load(self) -> None:
+        if os.path.isfile(self.nodes_path):
+            with open(self.nodes_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if "delete" in entry:
+                        for row in entry["delete"]:
+                            self._forget(row)
+                        continue
+                    row = entry.pop("row")
+                    self._records.extend([None] * (row + 1 - len(self._records)))
+                    self._records[row] = entry
+                    self._rows[entry["id"]] = row
+
+        self._count = len(self._records)
+        if os.path.isfile(self.vectors_path):
+            self._vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self._alive = np.array([record is not None for record in self._records], dtype=bool)
+
+        if self._count > 2 * max(len(self._rows), 1):
+            self._compact()
+
+    def _forget(self, row: int) -> None:
+        record = self._records[row] if row < len(self._records) else None
+        if record is not None:
+            self._rows.pop(record["id"], None)
+            self._records[row] = None
+
+    def _ensure_capacity(self, rows: int, dimensions: int) -> None:
+        if self._vectors is not None and self._vectors.shape[1] != dimensions:
+            raise ValueError(f"Embedding size {dimensions} does not match the store ({self._vectors.shape[1]})")
+
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if rows <= capacity:
+            return
+
+        new_capacity = max(INITIAL_CAPACITY, capacity)
+        while new_capacity < rows:
+            new_capacity *= 2
+
+        tmp_path = f"{self.vectors_path}.tmp"
+        vectors = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, dimensions))
+        if self._vectors is not None:
+            vectors[:self._count] = self._vectors[:self._count]
+        vectors.flush()
+        del vectors
+        os.replace(tmp_path, self.vectors_path)
+        self._vectors = np.load(self.vectors_path, mmap_mode="r+")
+
+    def _append_log(self, entries: List[dict]) -> None:
+        with open(self.nodes_path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+
+        embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        embeddings /= norms
+
+        with self._lock:
+            # a node added again replaces the previous version
+            replaced = [self._rows[node.node_id] for node in nodes if node.node_id in self._rows]
+            if replaced:
+                self._delete_rows(replaced)
+
+            start = self._count
+            self._ensure_capacity(start + len(nodes), embeddings.shape[1])
+            self._vectors[start:start + len(nodes)] = embeddings
+            self._vectors.flush()
+
+            entries = []
+            for offset, node in enumerate(nodes):
+                record = {
+                    "id": node.node_id,
+                    "ref_doc_id": node.ref_doc_id,
+                    "text": node.get_content(),
+                    "metadata": node_to_metadata_dict(node, remove_text=True, flat_metadata=False),
+                }
+                self._records.append(record)
+                self._rows[node.node_id] = start + offset
+                entries.append({"row": start + offset, **record})
+
+            self._count = start + len(nodes)
+            self._alive = np.concatenate([self._alive, np.ones(len(nodes), dtype=bool)])
+            self._append_log(entries)
+
+        return [node.node_id for node in nodes]
+
+    def _delete_rows(self, rows: List[int]) -> None:
+        rows = [row for row in rows if self._records[row] is not None]
+        if not rows:
+            return
+        for row in rows:
+            self._forget(row)
+        alive = self._alive.copy()
+        alive[rows] = False
+        self._alive = alive
+        self._append_log([{"delete": rows}])
+
+    def _compact(self) -> None:
+        rows = [row for row, record in enumerate(self._records) if record is not None]
+        records = [self._records[row] for row in rows]
+
+        tmp_nodes_path = f"{self.nodes_path}.tmp"
+        with open(tmp_nodes_path, "w", encoding="utf-8") as f:
+            for row, record in enumerate(records):
+                f.write(json.dumps({"row": row, **record}) + "\n")
+
+        if self._vectors is not None:
+            kept = np.array(self._vectors[rows]) if rows else np.zeros((0, self._vectors.shape[1]), dtype=np.float32)
+            self._vectors = None
+            tmp_path = f"{self.vectors_path}.tmp"
+            vectors = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.float32, shape=(max(INITIAL_CAPACITY, len(rows)), kept.shape[1])
+            )
+            vectors[:len(rows)] = kept
+            vectors.flush()
+            del vectors
+            os.replace(tmp_path, self.vectors_path)
+            self._vectors = np.load(self.vectors_path, mmap_mode="r+")
+
+        os.replace(tmp_nodes_path, self.nodes_path)
+        self._records = records
+        self._rows = {record["id"]: row for row, record in enumerate(records)}
+        self._count = len(records)
+        self._alive = np.ones(len(records), dtype=bool)
+
+    def _maybe_compact(self) -> None:
+        if self._count > 2 * max(len(self._rows), INITIAL_CAPACITY // 2):
+            self._compact()
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            self._delete_rows([
+                row for row, record in enumerate(self._records)
+                if record is not None and record["ref_doc_id"] == ref_doc_id
+            ])
+            self._maybe_compact()
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **delete_kwargs: Any) -> None:
+        with self._lock:
+            rows = self._select_rows(node_ids, filters)
+            self._delete_rows(rows)
+            self._maybe_compact()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._delete_rows([row for row, record in enumerate(self._records) if record is not None])
+            self._compact()
+
+    def _select_rows(self, node_ids: Optional[List[str]], filters: Optional[MetadataFilters]) -> List[int]:
+        if node_ids:
+            candidates = [self._rows[node_id] for node_id in node_ids if node_id in self._rows]
+        else:
+            candidates = [row for row, record in enumerate(self._records) if record is not None]
+        return [row for row in candidates if _matches(self._records[row]["metadata"], filters)]
+
+    def _to_node(self, row: int) -> BaseNode:
+        record = self._records[row]
+        return metadata_dict_to_node(record["metadata"], text=record["text"])
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None) -> List[BaseNode]:
+        with self._lock:
+            return [self._to_node(row) for row in self._select_rows(node_ids, filters)]
+
+    def get_embeddings(self, node_ids: List[str]) -> Dict[str, List[float]]:
+        """The stored (normalized) embeddings of the nodes, by node id."""
+        with self._lock:
+            return {node_id: self._vectors[self._rows[node_id]].tolist() for node_id in node_ids if node_id in self._rows}
+
+    def query_batch(self, query_embeddings: np.ndarray, similarity_top_k: int, mask: Optional[np.ndarray] = None) -> List[tuple]:
+
+        """
+        Top-k rows of several queries at once, with one matrix product.
+
+        Args:
+            query_embeddings (np.ndarray): The query embeddings, one per row.
+            similarity_top_k (int): Number of rows per query.
+            mask (Optional[np.ndarray]): Rows allowed in the results, all live rows when missing.
+
+        Returns:
+            List[tuple]: For every query, the (rows, similarities) arrays, best first.
+        """
+
+        with self._lock:
+            count = self._count
+            vectors = self._vectors
+            alive = self._alive if mask is None else self._alive & mask
+
+        if vectors is None or not count or not alive.any():
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in query_embeddings]
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        similarities = (queries / norms) @ vectors[:count].T
+        similarities[:, ~alive] = -np.inf
+
+        top_k = min(similarity_top_k, int(alive.sum()))
+        best = np.argpartition(-similarities, top_k - 1, axis=1)[:, :top_k]
+        results = []
+        for query_position, rows in enumerate(best):
+            scores = similarities[query_position, rows]
+            order = np.argsort(-scores)
+            results.append((rows[order], scores[order]))
+        return results
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        mask = None
+        if query.filters is not None or query.doc_ids or query.node_ids:
+            with self._lock:
+                mask = np.zeros(self._count, dtype=bool)
+                for row in self._select_rows(query.node_ids, query.filters):
+                    if not query.doc_ids or self._records[row]["ref_doc_id"] in query.doc_ids:
+                        mask[row] = True
+
+        (rows, scores), = self.query_batch(np.asarray([query.query_embedding]), query.similarity_top_k, mask)
+
+        with self._lock:
+            nodes, ids, similarities = [], [], []
+            for row, score in zip(rows.tolist(), scores.tolist()):
+                if self._records[row] is None:
+                    continue
+                nodes.append(self._to_node(row))
+                ids.append(self._records[row]["id"])
+                similarities.append(score)
+
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
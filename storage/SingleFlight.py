@@ -0,0 +1,105 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+"""
+Single-flight coalescing of identical concurrent computations.
+
+The first caller of a key (the leader) runs the computation, callers arriving while it is in flight
+(the followers) wait for it and share its result instead of running it again. Nothing is kept once
+the flight lands, later callers go through the answer cache. When the leader fails, or does not land
+within the wait limit, the followers run the computation themselves.
+"""
+
+
+class Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[Any] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self, wait_seconds: float) -> None:
+
+        """
+        Initialize the SingleFlight.
+
+        Args:
+            wait_seconds (float): Maximum time a follower waits for the leader.
+        """
+
+        self.wait_seconds = wait_seconds
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+
+    def begin(self, key: Hashable) -> Tuple[Flight, bool]:
+
+        """
+        Join the flight of a key, starting it when there is none.
+
+        Returns:
+            Tuple[Flight, bool]: The flight and True for the leader, which must call `finish`.
+        """
+
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight()
+                self.leaders += 1
+                return flight, True
+            flight.followers += 1
+            return flight, False
+
+    def finish(self, key: Hashable, flight: Flight, result: Optional[Any]) -> None:
+        """Land the flight of the leader, a None result means it failed and the followers fall back."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.done.set()
+
+    def wait(self, flight: Flight) -> Optional[Any]:
+        """Result of the leader, None when it failed or did not land in time."""
+        landed = flight.done.wait(self.wait_seconds)
+        with self._lock:
+            if landed and flight.result is not None:
+                self.coalesced += 1
+                return flight.result
+            self.fallbacks += 1
+            return None
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Tuple[Any, bool]:
+
+        """
+        Run the computation of a key, or share the result of the one in flight.
+
+        Returns:
+            Tuple[Any, bool]: The result, and True when it was computed by another caller.
+        """
+
+        flight, leader = self.begin(key)
+        if not leader:
+            result = self.wait(flight)
+            if result is not None:
+                return result, True
+            return function(), False
+
+        result = None
+        try:
+            result = function()
+            return result, False
+        finally:
+            self.finish(key, flight, result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "fallbacks": self.fallbacks,
+            }
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Dict, Optional
+
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+
+from constants import CHUNK_SIZE
+from crawler import SitemapCrawler
+from storage.Index import Index
+
+"""
+Incremental sitemap sync.
+
+A manifest stored with the collection remembers, for every page of a sitemap, its lastmod, ETag,
+Last-Modified header and content hash. A sync only fetches pages whose lastmod changed (with a
+conditional GET), re-indexes the pages whose content changed under a stable doc_id derived from the
+URL, and deletes the vectors of pages that are no longer listed in the sitemap.
+"""
+
+MANIFEST_FILE_NAME = "sitemap_manifest.json"
+
+
+def url_to_doc_id(url: str) -> str:
+    """Stable document id of a web page, derived from its URL."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, url))
+
+
+class SitemapManifest:
+    def __init__(self, path: str) -> None:
+
+        """
+        Initialize the SitemapManifest.
+
+        Args:
+            path (str): The path of the JSON manifest file.
+        """
+
+        self.path = path
+        # sitemap url -> page url -> page entry
+        self.sitemaps: Dict[str, Dict[str, dict]] = {}
+
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.sitemaps = json.load(f)
+
+    def get_pages(self, sitemap_url: str) -> Dict[str, dict]:
+        return self.sitemaps.setdefault(sitemap_url, {})
+
+    def save(self) -> None:
+        # write to a temporary file first so a crash never leaves a truncated manifest
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.sitemaps, f)
+        os.replace(tmp_path, self.path)
+
+
+class SitemapSync:
+    def __init__(self, index_handler: Index, cancel_event: Optional[threading.Event] = None) -> None:
+
+        """
+        Initialize the SitemapSync.
+
+        Args:
+            index_handler (Index): The index handler of the collection to sync, its index must be loaded.
+            cancel_event (Optional[threading.Event]): Set it to stop the sync early, pages synced so far are kept.
+        """
+
+        self.index_handler = index_handler
+        self.index = index_handler.get_index()
+        self.manifest = SitemapManifest(os.path.join(index_handler.get_collection_path(), MANIFEST_FILE_NAME))
+        self.crawler = SitemapCrawler()
+        self.splitter = SentenceSplitter(chunk_size=CHUNK_SIZE)
+        self.cancel_event = cancel_event or threading.Event()
+        # updated while the sync runs
+        self.counts = {"added": 0, "updated": 0, "unchanged": 0, "deleted": 0, "failed": 0}
+
+    def sync(self, sitemap_url: str, domain: str) -> Dict[str, int]:
+
+        """
+        Bring the collection in line with the current content of the sitemap.
+
+        Args:
+            sitemap_url (str): The URL of the sitemap to crawl.
+            domain (str): The domain to filter the sitemap URLs.
+
+        Returns:
+            Dict[str, int]: The number of added, updated, unchanged, deleted and failed pages.
+
+        Raises:
+            ConnectionError: If the sitemap cannot be downloaded.
+        """
+
+        return asyncio.run(self.async_sync(sitemap_url, domain))
+
+    async def async_sync(self, sitemap_url: str, domain: str) -> Dict[str, int]:
+        """Asynchronous version of `sync`, changed pages are fetched concurrently."""
+
+        pages = self.manifest.get_pages(sitemap_url)
+        counts = self.counts
+
+        async with self.crawler.session() as session:
+            entries = await self.crawler.fetch_sitemap_entries(session, sitemap_url, domain)
+            entries = list({entry["loc"]: entry for entry in entries}.values())
+
+            async def fetch_page(entry: dict):
+                url, lastmod = entry["loc"], entry["lastmod"]
+                previous = pages.get(url)
+
+                # the sitemap says the page did not change since the last sync, no need to fetch it
+                if previous is not None and lastmod is not None and previous.get("lastmod") == lastmod:
+                    return entry, None
+
+                headers = {}
+                if previous is not None:
+                    if previous.get("etag"):
+                        headers["If-None-Match"] = previous["etag"]
+                    if previous.get("last_modified"):
+                        headers["If-Modified-Since"] = previous["last_modified"]
+
+                try:
+                    return entry, await self.crawler.fetch(session, url, headers=headers)
+                except ConnectionError as error:
+                    return entry, error
+
+            # index the pages as soon as they arrive instead of waiting for the whole crawl, the embedding
+            # and the index writes run on a thread so the fetches of the other pages go on meanwhile
+            loop = asyncio.get_running_loop()
+            for task in asyncio.as_completed([fetch_page(entry) for entry in entries]):
+                if self.cancel_event.is_set():
+                    break
+                entry, response = await task
+                status = await loop.run_in_executor(None, self._sync_page, entry["loc"], entry["lastmod"], response, pages)
+                counts[status] += 1
+
+        # pages that dropped out of the sitemap
+        listed = {entry["loc"] for entry in entries}
+        for url in [url for url in pages if url not in listed]:
+            if self.cancel_event.is_set():
+                break
+            await loop.run_in_executor(None, self._delete_page, pages[url]["doc_id"])
+            del pages[url]
+            counts["deleted"] += 1
+
+        self.manifest.save()
+
+        if counts["added"] or counts["updated"] or counts["deleted"]:
+            self.index.storage_context.persist(persist_dir=self.index_handler.get_collection_path())
+            self.index_handler.notify_changed()
+
+        return counts
+
+    def _delete_page(self, doc_id: str) -> None:
+        with self.index_handler.lock.write():
+            self.index_handler.delete_ref_doc(doc_id)
+
+    def _sync_page(self, url: str, lastmod: Optional[str], response, pages: Dict[str, dict]) -> str:
+        previous = pages.get(url)
+
+        if response is None:
+            return "unchanged"
+
+        if isinstance(response, Exception):
+            print(f"Error fetching {url}: {response}")
+            return "failed"
+
+        if response.status == 304 and previous is not None:
+            previous["lastmod"] = lastmod
+            return "unchanged"
+
+        if response.status != 200:
+            print(f"Error fetching {url}: status code {response.status}")
+            return "failed"
+
+        content_hash = hashlib.sha256(response.body).hexdigest()
+        entry = {
+            "doc_id": url_to_doc_id(url),
+            "lastmod": lastmod,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_hash": content_hash,
+        }
+
+        if previous is not None and previous.get("content_hash") == content_hash:
+            pages[url] = entry
+            return "unchanged"
+
+        # same Document shape as SitemapReader
+        document = Document(text=response.text, id_=entry["doc_id"], metadata={"Source": url})
+
+        nodes = self.splitter.get_nodes_from_documents([document])
+
+        with self.index_handler.lock.write():
+            if previous is not None:
+                self.index_handler.delete_ref_doc(previous["doc_id"])
+            else:
+                # drop nodes of this page inserted by a full (non incremental) sitemap load
+                self.index_handler.delete_source(url)
+            self.index_handler.add_nodes(nodes)
+        pages[url] = entry
+
+        return "updated" if previous is not None else "added"
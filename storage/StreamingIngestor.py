@@ -0,0 +1,266 @@
+import asyncio
+import queue
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode, MetadataMode
+
+from constants import CHUNK_SIZE, INGEST_EMBED_BATCH_SIZE, INGEST_QUEUE_SIZE
+from crawler import SitemapCrawler
+from storage.Index import Index
+
+"""
+Streaming, bounded-memory ingestion pipeline.
+
+fetch -> chunk -> embed (in batches) -> bulk add to the vector store
+
+Every stage runs in its own thread and stages are connected by bounded queues, so a slow stage
+applies backpressure to the previous ones and only a few pages are held in memory at any time,
+whatever the size of the site. The storage context is persisted once at the end.
+"""
+
+# Pushed through the queues once the previous stage is done
+_END = object()
+
+
+class IngestionCancelled(Exception):
+    pass
+
+
+class StreamingIngestor:
+    def __init__(
+            self,
+            index_handler: Index,
+            embed_batch_size: int = INGEST_EMBED_BATCH_SIZE,
+            queue_size: int = INGEST_QUEUE_SIZE,
+            cancel_event: Optional[threading.Event] = None,
+    ) -> None:
+
+        """
+        Initialize the StreamingIngestor.
+
+        Args:
+            index_handler (Index): The index handler of the collection to ingest into, its index must be loaded.
+            embed_batch_size (int): Number of nodes embedded and written to the vector store at once.
+            queue_size (int): Capacity of the queues between the stages.
+            cancel_event (Optional[threading.Event]): Set it to stop the ingestion early.
+        """
+
+        self.index_handler = index_handler
+        self.index = index_handler.get_index()
+        self.embed_model = index_handler.embed_model
+        self.splitter = SentenceSplitter(chunk_size=CHUNK_SIZE)
+        self.embed_batch_size = embed_batch_size
+        self.queue_size = queue_size
+        self.cancel_event = cancel_event or threading.Event()
+
+        # set when a stage fails or the ingestion is cancelled, all the stages stop
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "pages_fetched": 0,
+            "pages_failed": 0,
+            "documents_processed": 0,
+            "nodes_created": 0,
+            "nodes_embedded": 0,
+            "nodes_written": 0,
+            "errors": [],
+            "elapsed_seconds": 0.0,
+        }
+        self._started_at = 0.0
+
+    def _count(self, key: str, value: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += value
+            self.stats["elapsed_seconds"] = time.monotonic() - self._started_at
+
+    def _fail(self, error: BaseException) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = error
+            self.stats["errors"].append(str(error))
+        self._stop.set()
+
+    def _stopped(self) -> bool:
+        if self.cancel_event.is_set():
+            self._stop.set()
+        return self._stop.is_set()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        # never block forever on a full queue, the next stage may have died
+        while not self._stopped():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stopped():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _chunk_stage(self, documents: queue.Queue, nodes: queue.Queue) -> None:
+        try:
+            while True:
+                document = self._get(documents)
+                if document is _END:
+                    break
+                # CSV rows are loaded as ready made nodes, only documents are split
+                chunks = self.splitter.get_nodes_from_documents([document]) if isinstance(document, Document) else [document]
+                for node in chunks:
+                    if not self._put(nodes, node):
+                        return
+                    self._count("nodes_created")
+                self._count("documents_processed")
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(nodes, _END)
+
+    def _embed_stage(self, nodes: queue.Queue, batches: queue.Queue) -> None:
+        batch: List[BaseNode] = []
+
+        def flush() -> bool:
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+            for node, embedding in zip(batch, self.embed_model.get_text_embedding_batch(texts)):
+                node.embedding = embedding
+            self._count("nodes_embedded", len(batch))
+            return self._put(batches, list(batch))
+
+        try:
+            while True:
+                node = self._get(nodes)
+                if node is _END:
+                    break
+                batch.append(node)
+                if len(batch) >= self.embed_batch_size:
+                    if not flush():
+                        return
+                    batch = []
+            if batch and not self._stopped():
+                flush()
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(batches, _END)
+
+    def _write_stage(self, batches: queue.Queue) -> None:
+        try:
+            while True:
+                batch = self._get(batches)
+                if batch is _END:
+                    break
+                # nodes already carry their embedding, insert_nodes only writes them (and indexes them for BM25)
+                with self.index_handler.lock.write():
+                    self.index_handler.add_nodes(batch)
+                self._count("nodes_written", len(batch))
+        except Exception as e:
+            self._fail(e)
+
+    def _run(self, produce) -> dict:
+        """Run the pipeline, `produce` pushes Documents to the queue it is given and returns when done."""
+
+        self._started_at = time.monotonic()
+        documents: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        nodes: queue.Queue = queue.Queue(maxsize=self.queue_size * 4)
+        batches: queue.Queue = queue.Queue(maxsize=max(2, self.queue_size // 4))
+
+        stages = [
+            threading.Thread(target=self._chunk_stage, args=(documents, nodes), name="ingest-chunk", daemon=True),
+            threading.Thread(target=self._embed_stage, args=(nodes, batches), name="ingest-embed", daemon=True),
+            threading.Thread(target=self._write_stage, args=(batches,), name="ingest-write", daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+
+        try:
+            produce(documents)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(documents, _END)
+
+        for stage in stages:
+            stage.join()
+
+        if self.stats["nodes_written"]:
+            self.index.storage_context.persist(persist_dir=self.index_handler.get_collection_path())
+            self.index_handler.notify_changed()
+
+        self.stats["elapsed_seconds"] = time.monotonic() - self._started_at
+
+        if self._error is not None:
+            raise self._error
+        if self.cancel_event.is_set():
+            raise IngestionCancelled("Ingestion was cancelled")
+
+        return self.stats
+
+    def ingest_sitemap(self, sitemap_url: str, domain: str, crawler: Optional[SitemapCrawler] = None) -> dict:
+
+        """
+        Crawl a sitemap and ingest its pages as they are fetched.
+
+        Args:
+            sitemap_url (str): The URL of the sitemap to crawl.
+            domain (str): The domain to filter the sitemap URLs.
+            crawler (Optional[SitemapCrawler]): The crawler to use, a default one is created if missing.
+
+        Returns:
+            dict: The ingestion stats.
+
+        Raises:
+            ConnectionError: If the sitemap cannot be downloaded.
+            IngestionCancelled: If the cancel event was set.
+        """
+
+        crawler = crawler or SitemapCrawler()
+
+        def produce(documents: queue.Queue):
+
+            async def on_document(document: Document):
+                if self._stopped():
+                    raise IngestionCancelled("Ingestion was stopped")
+                self._count("pages_fetched")
+                # wait for room in the queue without blocking the other fetches
+                while True:
+                    try:
+                        documents.put_nowait(document)
+                        return
+                    except queue.Full:
+                        if self._stopped():
+                            raise IngestionCancelled("Ingestion was stopped")
+                        await asyncio.sleep(0.05)
+
+            counts = asyncio.run(crawler.crawl(sitemap_url, domain, on_document))
+            self._count("pages_failed", counts["failed"])
+
+        return self._run(produce)
+
+    def ingest_documents(self, documents: Iterable[Document]) -> dict:
+
+        """
+        Ingest already loaded documents, e.g. from `load_data_from_files`.
+
+        Args:
+            documents (Iterable[Document]): The documents to ingest, a generator keeps memory bounded.
+
+        Returns:
+            dict: The ingestion stats.
+        """
+
+        def produce(q: queue.Queue):
+            for document in documents:
+                if not self._put(q, document):
+                    return
+
+        return self._run(produce)
@@ -0,0 +1,56 @@
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from constants import DATA_DIR
+from storage.FAQIndex import FAQIndex, normalize_question
+
+QA_PAIRS_PATH = os.path.join(DATA_DIR, "coredna", "Cleaned_QA_Pairs.csv")
+
+
+class OneHotEmbedding:
+    """A vector per distinct normalized text, only identical questions are similar."""
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(4096)
+        vector[zlib.crc32(normalize_question(text).encode()) % vector.size] = 1.0
+        return vector
+
+    def get_text_embedding_batch(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def get_query_embedding(self, text):
+        return self._embed(text)
+
+
+@pytest.fixture(scope="module")
+def faq_index() -> FAQIndex:
+    index = FAQIndex(OneHotEmbedding(), fuzzy_threshold=0.85, embedding_threshold=0.95)
+    index.load_csv(QA_PAIRS_PATH, "Question", "Answer")
+    return index
+
+
+def test_reworded_question_matches(faq_index):
+    match = faq_index.match("who are core dna users")
+    assert match is not None and match.question == "Who are Core dna's users?"
+
+
+def test_different_content_word_does_not_match(faq_index):
+    # "partners" is spelled close to "users", it is another question
+    assert faq_index.match("Who are Core dna's partners?") is None
+
+
+def test_replaced_last_word_does_not_match(faq_index):
+    assert faq_index.match("Does Core dna charge transaction Shopify?") is None
+
+
+def test_no_curated_question_matches_with_its_last_word_replaced(faq_index):
+    matched = []
+    for question in faq_index.questions:
+        probe = " ".join(question.rstrip("?").split()[:-1] + ["Shopify"]) + "?"
+        match = faq_index.match(probe)
+        if match is not None and match.method == "fuzzy":
+            matched.append((probe, match.question))
+    assert matched == []
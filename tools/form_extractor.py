@@ -0,0 +1,142 @@
+import codecs
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, List, Optional
+
+"""
+Event based extractor of the forms and input fields of a web page.
+
+The webpage scanner tools only need the forms of a page, their fields and labels, the page is
+therefore fed chunk by chunk to an html.parser.HTMLParser that records these elements instead of
+building a DOM. Parsing stops as soon as the caller's condition is met (e.g. a form was found) or
+when the byte ceiling is reached, so the rest of the page is neither read nor parsed.
+"""
+
+CHUNK_SIZE = 16 * 1024
+
+
+class FormExtractor(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        # attributes of every <form>, and of every <input>, <select> and <textarea> with "tag" set to the
+        # element name, "form" to the index of its form or None and "label" to the index of an enclosing label
+        self.forms: List[Dict[str, Optional[str]]] = []
+        self.inputs: List[Dict[str, Optional[str]]] = []
+        # {"for", "text", "form"} of every <label>, and the {"value", "text"} options of every <select>
+        self.labels: List[Dict[str, Optional[str]]] = []
+        self.options: Dict[int, List[Dict[str, Optional[str]]]] = {}
+        # every tag name seen, for check_tag_exists
+        self.tags = set()
+        self.closed_forms = set()
+        self.bytes_read = 0
+        self.truncated = False
+        self._form: Optional[int] = None
+        self._label: Optional[int] = None
+        self._select: Optional[int] = None
+        self._option: Optional[Dict[str, Optional[str]]] = None
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        self.tags.add(tag)
+        if tag == "form":
+            self._form = len(self.forms)
+            self.forms.append(dict(attrs))
+        elif tag in ("input", "select", "textarea"):
+            if tag == "select":
+                self._select = len(self.inputs)
+                self.options[self._select] = []
+            self.inputs.append({**dict(attrs), "tag": tag, "form": self._form, "label": self._label})
+        elif tag == "label":
+            self._label = len(self.labels)
+            self.labels.append({"for": dict(attrs).get("for"), "text": "", "form": self._form})
+        elif tag == "option" and self._select is not None:
+            self._option = {"value": dict(attrs).get("value"), "text": ""}
+            self.options[self._select].append(self._option)
+
+    def handle_data(self, data: str) -> None:
+        if self._label is not None:
+            self.labels[self._label]["text"] += data
+        if self._option is not None:
+            self._option["text"] += data
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "form" and self._form is not None:
+            self.closed_forms.add(self._form)
+            self._form = None
+        elif tag == "label":
+            self._label = None
+        elif tag == "select":
+            self._select = None
+            self._option = None
+        elif tag == "option":
+            self._option = None
+
+    def label_of(self, element: Dict[str, Optional[str]]) -> Optional[str]:
+        """Text of the label of a field, the enclosing <label> or the one pointing to its id."""
+        label = self.labels[element["label"]] if element.get("label") is not None else None
+        if label is None and element.get("id"):
+            label = next((label for label in self.labels if label["for"] == element["id"]), None)
+        text = " ".join(label["text"].split()) if label is not None else ""
+        return text or None
+
+    def form_inputs(self, prefix: str) -> List[Dict[str, Optional[str]]]:
+        return [
+            element for element in self.inputs
+            if element["tag"] == "input" and (element.get("name") or "").startswith(prefix)
+        ]
+
+
+def extract_forms(
+        chunks: Iterable[bytes],
+        max_bytes: int,
+        until: Optional[Callable[[FormExtractor], bool]] = None,
+        encoding: Optional[str] = None,
+) -> FormExtractor:
+
+    """
+    Parse a page given as chunks of bytes.
+
+    Args:
+        chunks (Iterable[bytes]): The page, e.g. `response.iter_content()`, it is not consumed further once parsing stops.
+        max_bytes (int): Byte ceiling, parsing stops with `truncated` set once it is exceeded.
+        until (Optional[Callable[[FormExtractor], bool]]): Stop condition checked after every chunk, the whole page is parsed when None.
+        encoding (Optional[str]): Encoding of the page, utf-8 when unknown.
+
+    Returns:
+        FormExtractor: The extractor holding the forms, inputs and tags found.
+    """
+
+    extractor = FormExtractor()
+    try:
+        decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    for chunk in chunks:
+        if extractor.bytes_read + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - extractor.bytes_read]
+            extractor.truncated = True
+        extractor.bytes_read += len(chunk)
+        extractor.feed(decoder.decode(chunk))
+        if extractor.truncated or (until is not None and until(extractor)):
+            return extractor
+
+    extractor.feed(decoder.decode(b"", final=True))
+    extractor.close()
+    return extractor
+
+
+def iter_chunks(content: bytes, chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
+
+
+def has_tag(tag_name: str) -> Callable[[FormExtractor], bool]:
+    """Stop condition, the tag was seen."""
+    tag_name = tag_name.lower()
+    return lambda extractor: tag_name in extractor.tags
+
+
+def has_form_inputs(prefix: str) -> Callable[[FormExtractor], bool]:
+    """Stop condition, a form holding inputs named with the prefix was closed."""
+    return lambda extractor: any(
+        element["form"] in extractor.closed_forms for element in extractor.form_inputs(prefix)
+    )
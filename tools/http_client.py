@@ -0,0 +1,243 @@
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+from constants import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_BACKOFF,
+    HTTP_MAX_RESPONSE_BYTES, HTTP_PER_HOST_CONCURRENCY
+)
+
+"""
+Shared outbound HTTP client of the agent tools.
+
+Every host gets its own keep-alive requests.Session, with a connection pool sized to the per-host
+concurrency cap. Requests have connect and read timeouts so a hanging endpoint cannot block a worker,
+are retried with exponential backoff and full jitter (idempotent methods only, a POST is only retried
+when the connection could not be established), and bodies are read up to a size limit.
+"""
+
+# Status codes worth retrying, anything else is returned to the caller as is
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+# latencies kept for the percentiles of `stats`
+LATENCY_WINDOW = 1000
+
+
+class ResponseTooLarge(requests.exceptions.RequestException):
+    pass
+
+
+def _connection_failed(error: requests.exceptions.RequestException) -> bool:
+    """True when the connection could not be established (refused, unresolved, timed out), the request was not sent."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    # requests wraps the urllib3 MaxRetryError, its reason is the error of the connection attempt
+    reason = getattr(error.args[0], "reason", error.args[0])
+    # NewConnectionError and NameResolutionError are ConnectTimeoutError subclasses
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class HttpClient:
+    def __init__(
+            self,
+            connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+            read_timeout: float = HTTP_READ_TIMEOUT,
+            max_retries: int = HTTP_MAX_RETRIES,
+            backoff: float = HTTP_BACKOFF,
+            max_response_bytes: int = HTTP_MAX_RESPONSE_BYTES,
+            per_host_concurrency: int = HTTP_PER_HOST_CONCURRENCY,
+    ) -> None:
+
+        """
+        Initialize the HttpClient.
+
+        Args:
+            connect_timeout (float): Connection timeout in seconds.
+            read_timeout (float): Maximum number of seconds between two bytes of the response.
+            max_retries (int): Number of retries on connection errors, timeouts and retryable status codes.
+            backoff (float): Base delay of the exponential backoff between retries, in seconds.
+            max_response_bytes (int): Larger response bodies raise ResponseTooLarge.
+            per_host_concurrency (int): Maximum number of requests in flight to a single host.
+        """
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_response_bytes = max_response_bytes
+        self.per_host_concurrency = per_host_concurrency
+
+        self._sessions: Dict[str, requests.Session] = {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+
+    def _host(self, url: str) -> str:
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def _session(self, host: str) -> tuple:
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.per_host_concurrency)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host_concurrency)
+            return self._sessions[host], self._semaphores[host]
+
+    def _read_body(self, response: requests.Response) -> None:
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_response_bytes:
+            response.close()
+            raise ResponseTooLarge(f"Response of {response.url} is larger than {self.max_response_bytes} bytes")
+
+        chunks, size = [], 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            if size > self.max_response_bytes:
+                response.close()
+                raise ResponseTooLarge(f"Response of {response.url} is larger than {self.max_response_bytes} bytes")
+            chunks.append(chunk)
+        # what `response.content` returns from now on
+        response._content = b"".join(chunks)
+
+    def _send(self, method: str, url: str, read_body: bool, **kwargs) -> tuple:
+        # returns the response and the per-host slot, still held when the body is left to the caller
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        session, semaphore = self._session(self._host(url))
+        attempt = 0
+
+        while True:
+            start = time.perf_counter()
+            semaphore.acquire()
+            try:
+                response = session.request(method, url, stream=True, **kwargs)
+                if read_body:
+                    self._read_body(response)
+            except ResponseTooLarge:
+                semaphore.release()
+                self._record(time.perf_counter() - start, error=True)
+                raise
+            except requests.exceptions.RequestException as error:
+                semaphore.release()
+                self._record(time.perf_counter() - start, error=True)
+                # a POST may have reached the server unless the connection failed
+                retryable = method in IDEMPOTENT_METHODS or _connection_failed(error)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+            else:
+                self._record(time.perf_counter() - start)
+                if response.status_code not in RETRY_STATUS_CODES or method not in IDEMPOTENT_METHODS or attempt >= self.max_retries:
+                    if read_body:
+                        semaphore.release()
+                    return response, semaphore
+                response.close()
+                semaphore.release()
+
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            # exponential backoff with full jitter
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+
+        """
+        Send a request within the per-host limits, retrying with exponential backoff.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            **kwargs: Passed to requests, e.g. headers, json, data.
+
+        Returns:
+            requests.Response: The last response received with its body read, its status may be an error status.
+
+        Raises:
+            requests.exceptions.RequestException: If the request failed after all the retries or the body is too large.
+        """
+
+        response, _ = self._send(method, url, read_body=True, **kwargs)
+        return response
+
+    @contextmanager
+    def stream(self, method: str, url: str, **kwargs) -> Iterator[requests.Response]:
+
+        """
+        Send a request like `request` but leave the body to the caller, e.g. `response.iter_content()`.
+
+        Only the connection and the status are retried, the latency recorded is the time to the headers.
+        The connection is released when the block exits, the unread rest of the body is dropped.
+        """
+
+        response, semaphore = self._send(method, url, read_body=False, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+            semaphore.release()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def _record(self, elapsed: float, error: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+            self._latencies.append(elapsed)
+
+    def _connection_counts(self) -> tuple:
+        # requests sent and connections opened by the urllib3 pools of every session
+        sent, opened = 0, 0
+        for session in self._sessions.values():
+            for adapter in set(session.adapters.values()):
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is not None:
+                        sent += pool.num_requests
+                        opened += pool.num_connections
+        return sent, opened
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = np.asarray(self._latencies, dtype=np.float64) * 1000
+            sent, opened = self._connection_counts()
+            return {
+                "hosts": len(self._sessions),
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "latency_p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                "connections_opened": opened,
+                "connection_reuse": (sent - opened) / sent if sent else None,
+            }
+
+
+http_client = HttpClient()
@@ -1,5 +1,6 @@
 from llama_index.core.tools import FunctionTool, ToolMetadata
 import requests
+from tools.http_client import http_client
 
 def http_request(url: str, method: str, data: dict = None):
 
@@ -15,13 +16,13 @@ def http_request(url: str, method: str, data: dict = None):
 
     try:
         if method == 'GET':
-            response = requests.get(url)
+            response = http_client.get(url)
         elif method == 'POST':
-            response = requests.post(url, json=data)
+            response = http_client.post(url, json=data)
         elif method == 'PUT':
-            response = requests.put(url, json=data)
+            response = http_client.put(url, json=data)
         elif method == 'DELETE':
-            response = requests.delete(url)
+            response = http_client.delete(url)
     except requests.exceptions.RequestException as e:
         return f"HTTP request failed: {str(e)}"
     
@@ -1,40 +1,298 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
 import requests
 from llama_index.core.tools import FunctionTool, ToolMetadata
-from bs4 import BeautifulSoup
+
+from tools.http_client import http_client
+from tools.form_extractor import FormExtractor, extract_forms, iter_chunks, has_tag, has_form_inputs
+from constants import PAGE_CACHE_TTL_SECONDS, PAGE_CACHE_MAX_BYTES, PAGE_CACHE_MAX_PAGE_BYTES
+
+"""
+Tools scanning a web page for forms and input fields.
+
+Pages are not parsed into a DOM, the response is streamed through the event based FormExtractor
+which stops reading as soon as the requested elements are found (see tools/form_extractor.py).
+
+The action agent calls several of these tools on the same page within a conversation, pages are
+therefore cached in memory with the results extracted from them. A cached page is served as is within
+PAGE_CACHE_TTL_SECONDS, then revalidated with If-None-Match/If-Modified-Since, a 304 keeps the results and a 200 is parsed
+as it streams in, so a changed page is downloaded once.
+A page read up to the end is kept whole so other lookups are parsed from memory, a page whose reading
+stopped early only keeps its results and is read whole on the next lookup of something else. The cache is bounded by the total size of the cached pages.
+"""
+
+
+class CachedPage:
+    def __init__(self, url: str, content: Optional[bytes], encoding: Optional[str], etag: Optional[str], last_modified: Optional[str]) -> None:
+
+        """
+        Initialize the CachedPage.
+
+        Args:
+            url (str): The page URL.
+            content (Optional[bytes]): The whole response body, None when reading stopped early.
+            encoding (Optional[str]): The encoding of the response.
+            etag (Optional[str]): The ETag header of the response.
+            last_modified (Optional[str]): The Last-Modified header of the response.
+        """
+
+        self.url = url
+        self.content = content
+        self.encoding = encoding
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+        # results extracted from the page, e.g. ("inputs", "field_") -> FormExtractor
+        self.results: Dict[tuple, FormExtractor] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.content) if self.content is not None else 0
+
+
+class PageCache:
+    def __init__(self, ttl: float, max_bytes: int, max_page_bytes: int) -> None:
+
+        """
+        Initialize the PageCache.
+
+        Args:
+            ttl (float): Seconds a page is served without revalidation.
+            max_bytes (int): Maximum total size of the cached pages, least recently used pages are evicted.
+            max_page_bytes (int): Byte ceiling of a page, reading stops there.
+        """
+
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_page_bytes = max_page_bytes
+        self._pages: "OrderedDict[str, CachedPage]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def extract(self, url: str, key: tuple, until: Callable[[FormExtractor], bool]) -> FormExtractor:
+
+        """
+        Extract the forms of a page, from memory when the page is fresh or still valid on the server.
+
+        Args:
+            url (str): The page URL.
+            key (tuple): Identifies the lookup, e.g. ("tag", "form").
+            until (Callable[[FormExtractor], bool]): Stop condition of the lookup, see tools/form_extractor.py.
+
+        Returns:
+            FormExtractor: The forms, inputs and tags found before the stop condition was met.
+
+        Raises:
+            requests.exceptions.RequestException: When the page cannot be fetched.
+        """
+
+        with self._lock:
+            page = self._pages.get(url)
+            if page is not None:
+                self._pages.move_to_end(url)
+        stale = page is not None and time.monotonic() - page.fetched_at >= self.ttl
+        if stale:
+            # the page is dropped unless the server confirms it did not change
+            with self._lock:
+                self._discard(url)
+
+        if page is not None and not stale:
+            result = self._extract_cached(page, key, until)
+            if result is not None:
+                with self._lock:
+                    self.hits += 1
+                return result
+
+        # a stale page able to serve the lookup is revalidated by the fetch itself, a 200 is parsed straight away
+        revalidate = stale and (page.etag or page.last_modified) and (key in page.results or page.content is not None)
+        # a page already read partially for another lookup is read whole this time, so that later lookups are served from memory
+        return self._fetch(url, key, until, read_whole=page is not None and not revalidate, cached=page if revalidate else None)
+
+    def _extract_cached(self, page: CachedPage, key: tuple, until: Callable[[FormExtractor], bool]) -> Optional[FormExtractor]:
+        result = page.results.get(key)
+        if result is None and page.content is not None:
+            result = extract_forms(iter_chunks(page.content), self.max_page_bytes, until, page.encoding)
+            page.results[key] = result
+        return result
+
+    def _fetch(
+            self,
+            url: str,
+            key: tuple,
+            until: Callable[[FormExtractor], bool],
+            read_whole: bool,
+            cached: Optional[CachedPage] = None
+    ) -> FormExtractor:
+        chunks = []
+
+        def read(response: requests.Response):
+            for chunk in response.iter_content(chunk_size=16 * 1024):
+                chunks.append(chunk)
+                yield chunk
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        with http_client.stream('GET', url, headers=headers) as response:
+            if cached is not None and response.status_code == 304:
+                cached.fetched_at = time.monotonic()
+                with self._lock:
+                    self.revalidated += 1
+                    self._discard(url)
+                    self._store(cached)
+                return self._extract_cached(cached, key, until)
+
+            response.raise_for_status()
+            # requests assumes ISO-8859-1 for text/html without a charset, most pages are utf-8
+            encoding = response.encoding if 'charset' in response.headers.get('Content-Type', '').lower() else None
+            result = extract_forms(read(response), self.max_page_bytes, None if read_whole else until, encoding)
+            # the page was read up to the end unless the stop condition was met
+            complete = not result.truncated and (read_whole or not until(result))
+            page = CachedPage(
+                url,
+                b"".join(chunks) if complete else None,
+                encoding,
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified')
+            )
+
+        page.results[key] = result
+        with self._lock:
+            self.misses += 1
+            self._discard(url)
+            self._store(page)
+        return result
+
+    def _store(self, page: CachedPage) -> None:
+        self._pages[page.url] = page
+        self._bytes += page.size
+        while self._bytes > self.max_bytes and len(self._pages) > 1:
+            self._discard(next(iter(self._pages)))
+
+    def _discard(self, url: str) -> None:
+        page = self._pages.pop(url, None)
+        if page is not None:
+            self._bytes -= page.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pages": len(self._pages),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+            }
+
+
+page_cache = PageCache(PAGE_CACHE_TTL_SECONDS, PAGE_CACHE_MAX_BYTES, PAGE_CACHE_MAX_PAGE_BYTES)
 
 
 def fetch_from_input_name(input_name: str, url: str):
     try:
-        response = requests.get(url)
-        response.raise_for_status()
+        page = page_cache.extract(url, ('inputs', input_name), has_form_inputs(input_name))
 
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
         # Find all input elements with names starting with the specified pattern
-        inputs = soup.find_all('input', attrs={'name': lambda x: x and x.startswith(input_name)})
+        inputs = page.form_inputs(input_name)
         
         result = []
 
         for input_elem in inputs:
             field_name = input_elem.get('name', '')
-            placeholder_name = input_elem.get('placeholder', '')
+            # hidden inputs such as embedCode have no placeholder, their value is what the caller needs
+            placeholder_name = input_elem.get('placeholder') or input_elem.get('value') or ''
             result.append({field_name: placeholder_name})
 
-        return inputs
+        return result
 
     except requests.exceptions.RequestException as e:
         print(f"Error fetching URL: {e}")
         return []
 
+def _field_schema(page: FormExtractor, position: int, element: dict) -> dict:
+    field = {
+        "name": element.get("name"),
+        "type": element.get("type") or element["tag"],
+        "label": page.label_of(element),
+        "placeholder": element.get("placeholder"),
+        "required": "required" in element or element.get("aria-required") == "true",
+    }
+    if element["tag"] == "select":
+        field["options"] = [
+            " ".join(option["text"].split()) or option["value"] for option in page.options.get(position, [])
+            if option["value"]
+        ]
+    return {key: value for key, value in field.items() if value not in (None, [])}
+
+
+def analyze_form(url: str) -> dict:
+
+    """
+    Describe every form of a page in a single fetch.
+
+    Args:
+        url (str): The page URL.
+
+    Returns:
+        dict: {"url", "forms": [{"action", "method", "embedCode", "fields", "hidden"}]}, "fields" are the
+        fields to ask the user about (name, type, label, placeholder, required, options), "hidden" the
+        hidden fields left out of the questions with their value. "error" is set when the page cannot be fetched.
+    """
+
+    try:
+        page = page_cache.extract(url, ('forms',), lambda extractor: False)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching URL: {e}")
+        return {"url": url, "forms": [], "error": str(e)}
+
+    forms = []
+    for index, attributes in enumerate(page.forms):
+        fields, hidden, embed_code = [], {}, None
+        for position, element in enumerate(page.inputs):
+            name = element.get("name")
+            if element["form"] != index or not name:
+                continue
+            if name == 'embedCode':
+                embed_code = element.get("value")
+            elif element.get("type") == 'hidden':
+                hidden[name] = element.get("value")
+            elif element.get("type") not in ('submit', 'button', 'reset', 'image'):
+                fields.append(_field_schema(page, position, element))
+
+        if fields or embed_code:
+            form = {"action": attributes.get("action"), "method": (attributes.get("method") or "get").lower()}
+            if embed_code:
+                form["embedCode"] = embed_code
+            form["fields"] = fields
+            if hidden:
+                form["hidden"] = hidden
+            forms.append(form)
+
+    return {"url": url, "forms": forms}
+
 def check_class_exists(class_name: str, url: str):
     pass
 
 def check_tag_exists(tag_name:str, url:str):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    elements = soup.find_all(tag_name)
+    page = page_cache.extract(url, ('tag', tag_name), has_tag(tag_name))
 
-    return len(elements) > 0
+    return tag_name.lower() in page.tags
 
 
 def fetch_field_tool():
@@ -43,7 +301,21 @@ def fetch_field_tool():
         metadata=ToolMetadata(
             name="fetch_field_tool",
             description=(
-                "This tool fetches HTML input elements from a URL where the 'name' attribute starts with a given input name. It returns a list of dictionaries, each containing the 'name' and 'placeholder' attributes of the input elements. If an error occurs, it returns an empty list."
+                "This tool fetches HTML input elements from a URL where the 'name' attribute starts with a given input name. It returns a list of dictionaries, each mapping the 'name' attribute of an input element to its 'placeholder' attribute, or to its 'value' when it has no placeholder (e.g. embedCode). If an error occurs, it returns an empty list."
+            )
+        )
+    )
+
+def analyze_form_tool():
+    return FunctionTool(
+        fn=analyze_form,
+        metadata=ToolMetadata(
+            name="analyze_form_tool",
+            description=(
+                "This tool reads every form of a web page in one call, pass in a url. It returns the embedCode of "
+                "each form and the fields to ask the user about (name, label, placeholder, required, options), "
+                "hidden fields are listed separately and must not be asked about. An empty forms list means the "
+                "page has no form."
             )
         )
     )
@@ -0,0 +1,365 @@
+import contextvars
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.base import BaseLLM
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.embedding import EmbeddingEndEvent, EmbeddingStartEvent
+from llama_index.core.instrumentation.events.llm import (
+    LLMChatEndEvent, LLMChatStartEvent, LLMCompletionEndEvent, LLMCompletionStartEvent
+)
+from llama_index.core.instrumentation.events.retrieval import RetrievalEndEvent
+from llama_index.core.instrumentation.span.simple import SimpleSpan
+from llama_index.core.instrumentation.span_handlers import BaseSpanHandler
+from llama_index.core.tools.types import BaseTool
+from llama_index.core.utils import get_tokenizer
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+"""
+Per-request tracing and Prometheus metrics of the agent chain.
+
+Every HTTP request gets a request id (the X-Request-ID header or a new one), kept in a context
+variable so it follows the request into the agents, the log records and the streaming thread.
+A span and an event handler on the root llama_index dispatcher time:
+
+    llm           every LLM chat or completion call, with its model, prompt and completion tokens
+    retrieval     every retriever call, with the scores of the nodes retrieved
+    embedding     every embedding call
+    tool          every agent tool call
+    vector_store  every Chroma operation (see TracedChromaVectorStore)
+    span          agent chats, query engines, synthesis and node postprocessors
+
+Each timing is observed by a Prometheus histogram and added to the trace of the current request,
+whose summary is logged as one JSON line when the request ends. Under gunicorn the metrics of all
+the workers and of the index service are aggregated through PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py).
+"""
+
+logger = logging.getLogger(__name__)
+
+# methods traced as "span", the chain between the HTTP request and the LLM and retrieval calls
+SPAN_METHODS = {"chat", "stream_chat", "achat", "astream_chat", "query", "aquery", "synthesize", "asynthesize", "postprocess_nodes"}
+TOOL_METHODS = {"call", "acall"}
+RETRIEVAL_METHODS = {"retrieve", "aretrieve"}
+# spans kept per trace, a runaway agent loop cannot grow a trace without bound
+MAX_TRACE_SPANS = 500
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+SCORE_BUCKETS = (0.01, 0.02, 0.03, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0)
+
+REQUEST_SECONDS = Histogram(
+    "chatbot_request_seconds", "HTTP request latency", ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS
+)
+LLM_SECONDS = Histogram("chatbot_llm_seconds", "LLM call latency", ["model", "call"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("chatbot_llm_tokens_total", "LLM tokens", ["model", "kind"])
+RETRIEVAL_SECONDS = Histogram("chatbot_retrieval_seconds", "Retrieval latency", ["retriever"], buckets=LATENCY_BUCKETS)
+RETRIEVAL_TOP_SCORE = Histogram(
+    "chatbot_retrieval_top_score", "Score of the best node retrieved", ["retriever"], buckets=SCORE_BUCKETS
+)
+EMBEDDING_SECONDS = Histogram("chatbot_embedding_seconds", "Embedding call latency", ["model"], buckets=LATENCY_BUCKETS)
+TOOL_SECONDS = Histogram("chatbot_tool_seconds", "Agent tool call latency", ["tool", "status"], buckets=LATENCY_BUCKETS)
+VECTOR_STORE_SECONDS = Histogram(
+    "chatbot_vector_store_seconds", "Vector store operation latency", ["operation", "status"], buckets=LATENCY_BUCKETS
+)
+SPAN_SECONDS = Histogram("chatbot_span_seconds", "Agent chain span latency", ["span", "status"], buckets=LATENCY_BUCKETS)
+
+
+class RequestTrace:
+    def __init__(self, request_id: str, endpoint: str, method: str) -> None:
+
+        """
+        Initialize the RequestTrace, the timings recorded while serving one request.
+
+        Args:
+            request_id (str): The id of the request.
+            endpoint (str): The route of the request, e.g. "/query".
+            method (str): The HTTP method.
+        """
+
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.method = method
+        self.started_at = time.perf_counter()
+        self.spans: List[dict] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, name: str, seconds: float, **attributes: Any) -> None:
+        # the streaming thread and the agent share the trace
+        with self._lock:
+            if len(self.spans) >= MAX_TRACE_SPANS:
+                self.dropped += 1
+                return
+            self.spans.append({
+                "kind": kind, "name": name, "ms": round(seconds * 1000, 1),
+                "at_ms": round((time.perf_counter() - self.started_at - seconds) * 1000, 1), **attributes
+            })
+
+    def summary(self, status: Any) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        by_kind: Dict[str, dict] = {}
+        for span in spans:
+            totals = by_kind.setdefault(span["kind"], {"count": 0, "ms": 0.0})
+            totals["count"] += 1
+            totals["ms"] = round(totals["ms"] + span["ms"], 1)
+        return {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "method": self.method,
+            "status": status,
+            "ms": round((time.perf_counter() - self.started_at) * 1000, 1),
+            "prompt_tokens": sum(span.get("prompt_tokens", 0) for span in spans),
+            "completion_tokens": sum(span.get("completion_tokens", 0) for span in spans),
+            "by_kind": by_kind,
+            "spans": spans,
+            "dropped_spans": self.dropped,
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+def start_trace(endpoint: str, method: str, request_id: Optional[str] = None) -> RequestTrace:
+    """Start the trace of a request in the current context, with a new request id when none is given."""
+    trace = RequestTrace(request_id or uuid.uuid4().hex, endpoint, method)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def finish_trace(trace: RequestTrace, status: int) -> dict:
+    """Observe the request latency and log the summary of a trace, requests without any span (e.g. /health) are not logged."""
+    summary = trace.summary(status)
+    REQUEST_SECONDS.labels(trace.endpoint, trace.method, str(status)).observe(summary["ms"] / 1000)
+    if summary["spans"]:
+        logger.info(f"trace {json.dumps(summary, default=str)}")
+    return summary
+
+
+def traced_stream(chunks: Iterator[str], status: int = 200) -> Iterator[str]:
+    """Keep the trace of the request while a streamed response is generated, and finish it once it is sent."""
+    trace = _current_trace.get()
+
+    def generate():
+        if trace is None:
+            yield from chunks
+            return
+        # the generator runs after the view returned, possibly in another context
+        _current_trace.set(trace)
+        try:
+            yield from chunks
+        finally:
+            finish_trace(trace, status)
+
+    return generate()
+
+
+def _record(kind: str, name: str, seconds: float, **attributes: Any) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(kind, name, seconds, **attributes)
+
+
+def _span_name(id_: str, instance: Optional[Any]) -> Tuple[str, str]:
+    # span ids are "<qualname>-<uuid>", the method is the last part of the qualname
+    qualname = id_.rsplit("-", 5)[0]
+    method = qualname.rsplit(".", 1)[-1]
+    owner = type(instance).__name__ if instance is not None else qualname.rsplit(".", 1)[0]
+    return method, owner
+
+
+class MetricsSpanHandler(BaseSpanHandler[SimpleSpan]):
+    """Times the spans of the tools, retrievers, vector stores and agent chain, see SPAN_METHODS."""
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MetricsSpanHandler"
+
+    def new_span(
+            self,
+            id_: str,
+            bound_args: inspect.BoundArguments,
+            instance: Optional[Any] = None,
+            parent_span_id: Optional[str] = None,
+            tags: Optional[Dict[str, Any]] = None,
+            **kwargs: Any
+    ) -> Optional[SimpleSpan]:
+        method, owner = _span_name(id_, instance)
+        if isinstance(instance, BaseTool) and method in TOOL_METHODS:
+            kind, name = "tool", instance.metadata.name
+        elif isinstance(instance, BaseRetriever) and method in RETRIEVAL_METHODS:
+            kind, name = "retrieval", owner
+        elif isinstance(instance, BasePydanticVectorStore):
+            kind, name = "vector_store", f"{owner}.{method}"
+        elif method in SPAN_METHODS and not isinstance(instance, (BaseLLM, BaseEmbedding)):
+            # LLM and embedding calls are timed by their events, streamed answers outlive their span
+            kind, name = "span", f"{owner}.{method}"
+        else:
+            return None
+        return SimpleSpan(id_=id_, parent_id=parent_span_id, tags={"kind": kind, "name": name, "started_at": time.perf_counter()})
+
+    def _finish(self, id_: str, status: str) -> Optional[SimpleSpan]:
+        span = self.open_spans.get(id_)
+        if span is None:
+            return None
+        seconds = time.perf_counter() - span.tags["started_at"]
+        kind, name = span.tags["kind"], span.tags["name"]
+        attributes = {"status": status}
+
+        if kind == "tool":
+            TOOL_SECONDS.labels(name, status).observe(seconds)
+        elif kind == "retrieval":
+            RETRIEVAL_SECONDS.labels(name).observe(seconds)
+            scores = span.tags.get("scores")
+            if scores:
+                RETRIEVAL_TOP_SCORE.labels(name).observe(scores[0])
+                attributes["scores"] = scores
+        elif kind == "vector_store":
+            VECTOR_STORE_SECONDS.labels(name, status).observe(seconds)
+        else:
+            SPAN_SECONDS.labels(name, status).observe(seconds)
+        _record(kind, name, seconds, **attributes)
+        return span
+
+    def prepare_to_exit_span(
+            self,
+            id_: str,
+            bound_args: inspect.BoundArguments,
+            instance: Optional[Any] = None,
+            result: Optional[Any] = None,
+            **kwargs: Any
+    ) -> Optional[SimpleSpan]:
+        return self._finish(id_, "ok")
+
+    def prepare_to_drop_span(
+            self,
+            id_: str,
+            bound_args: inspect.BoundArguments,
+            instance: Optional[Any] = None,
+            err: Optional[BaseException] = None,
+            **kwargs: Any
+    ) -> Optional[SimpleSpan]:
+        return self._finish(id_, "error")
+
+
+class MetricsEventHandler(BaseEventHandler):
+    """Times the LLM and embedding calls and reads their token counts and the retrieval scores from the events."""
+
+    span_handler: MetricsSpanHandler
+    # start events waiting for their end event, keyed by span id and event family
+    _started: Dict[tuple, tuple] = PrivateAttr(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _tokenizer: Any = PrivateAttr(default_factory=get_tokenizer)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MetricsEventHandler"
+
+    def _start(self, key: tuple, model: str) -> None:
+        with self._lock:
+            self._started[key] = (time.perf_counter(), model)
+
+    def _end(self, key: tuple) -> Optional[tuple]:
+        with self._lock:
+            started = self._started.pop(key, None)
+        if started is None:
+            return None
+        return time.perf_counter() - started[0], started[1]
+
+    def _count(self, text: str) -> int:
+        return len(self._tokenizer(text or ""))
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> None:
+        if isinstance(event, (LLMChatStartEvent, LLMCompletionStartEvent)):
+            self._start((event.span_id, "llm"), str(event.model_dict.get("model") or event.model_dict.get("class_name")))
+        elif isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+            ended = self._end((event.span_id, "llm"))
+            if ended is None:
+                return
+            seconds, model = ended
+            call = "chat" if isinstance(event, LLMChatEndEvent) else "completion"
+            usage = event.response.additional_kwargs if event.response is not None else {}
+            # streamed responses come without usage, the tokens are counted then
+            if usage.get("prompt_tokens") is not None:
+                prompt_tokens, completion_tokens = usage["prompt_tokens"], usage.get("completion_tokens", 0)
+            elif call == "chat":
+                prompt_tokens = sum(self._count(str(message.content or "")) for message in event.messages)
+                completion_tokens = self._count(event.response.message.content if event.response is not None else "")
+            else:
+                prompt_tokens = self._count(event.prompt)
+                completion_tokens = self._count(event.response.text if event.response is not None else "")
+            LLM_SECONDS.labels(model, call).observe(seconds)
+            LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+            LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+            _record("llm", model, seconds, call=call, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        elif isinstance(event, EmbeddingStartEvent):
+            self._start((event.span_id, "embedding"), str(event.model_dict.get("model_name")))
+        elif isinstance(event, EmbeddingEndEvent):
+            ended = self._end((event.span_id, "embedding"))
+            if ended is not None:
+                seconds, model = ended
+                EMBEDDING_SECONDS.labels(model).observe(seconds)
+                _record("embedding", model, seconds, texts=len(event.chunks))
+        elif isinstance(event, RetrievalEndEvent):
+            # read by the span handler when the retrieve span exits
+            span = self.span_handler.open_spans.get(event.span_id)
+            if span is not None:
+                span.tags["scores"] = [round(node.score, 4) for node in event.nodes if node.score is not None]
+
+
+_instrumented_pid: Optional[int] = None
+_instrument_lock = threading.Lock()
+
+
+def instrument() -> None:
+    """Attach the handlers to the root llama_index dispatcher and add the request id to the log records, once per process."""
+    global _instrumented_pid
+    with _instrument_lock:
+        if _instrumented_pid is not None:
+            return
+        _instrumented_pid = os.getpid()
+
+        span_handler = MetricsSpanHandler()
+        dispatcher = get_dispatcher()
+        dispatcher.add_span_handler(span_handler)
+        dispatcher.add_event_handler(MetricsEventHandler(span_handler=span_handler))
+
+        record_factory = logging.getLogRecordFactory()
+
+        def request_record_factory(*args, **kwargs):
+            record = record_factory(*args, **kwargs)
+            record.request_id = current_request_id() or "-"
+            return record
+
+        logging.setLogRecordFactory(request_record_factory)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """The metrics in the Prometheus text format, of every process sharing PROMETHEUS_MULTIPROC_DIR when it is set."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
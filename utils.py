@@ -1,33 +1,104 @@
-import requests, os
-from typing import List, cast, Optional
+import csv, os, threading
+from contextlib import contextmanager
+from typing import Dict, List, cast, Optional
 from llama_index.core import (
     Document
 )
-from llama_index.readers.web import SitemapReader
 from llama_index.core import SimpleDirectoryReader
+from llama_index.core.schema import BaseNode, TextNode
 
-from constants import SIMPLE_DIRECTORY_READER_SUPPORTED_TYPES, DATA_DIR
+from constants import SIMPLE_DIRECTORY_READER_SUPPORTED_TYPES, DATA_DIR, CSV_COLUMN_MAPPINGS
+from crawler import SitemapCrawler
+
+
+def get_csv_column_mapping(directory: Optional[str]) -> Optional[Dict]:
+    """Column mapping of the tabular files of a data directory, see `CSV_COLUMN_MAPPINGS`."""
+    return CSV_COLUMN_MAPPINGS.get(directory or "", CSV_COLUMN_MAPPINGS.get("default"))
+
+
+def load_rows_from_csv(file_path: str, column_mapping: Dict) -> Optional[List[TextNode]]:
+    """
+    Load a CSV file as one node per row.
+
+    The node text is the embed column, the content columns and the source URL are kept in the metadata,
+    they are sent to the LLM with the node but not embedded.
+
+    Args:
+        file_path (str): The path of the CSV file.
+        column_mapping (Dict): The embed column, content columns and optional source column.
+
+    Returns:
+        Optional[List[TextNode]]: The nodes, None if the file does not have the mapped columns.
+    """
+
+    embed_column = column_mapping["embed"]
+    content_columns = list(column_mapping.get("content", []))
+    source_column = column_mapping.get("source")
+    file_name = os.path.basename(file_path)
+
+    with open(file_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        columns = reader.fieldnames or []
+        if embed_column not in columns or any(column not in columns for column in content_columns):
+            return None
+
+        nodes = []
+        for row_number, row in enumerate(reader, start=1):
+            text = (row.get(embed_column) or "").strip()
+            if not text:
+                continue
+
+            metadata = {column: (row.get(column) or "").strip() for column in content_columns}
+            if source_column and row.get(source_column):
+                metadata["Source"] = row[source_column].strip()
+            metadata["file_name"] = file_name
+            metadata["row"] = row_number
+
+            nodes.append(TextNode(
+                text=text,
+                metadata=metadata,
+                # only the embed column is embedded, the LLM gets the whole row
+                excluded_embed_metadata_keys=list(metadata.keys()),
+                excluded_llm_metadata_keys=["file_name", "row"],
+                text_template=f"{embed_column}: {{content}}\n{{metadata_str}}"
+            ))
+        return nodes
 
 
 def load_data_from_files(
         file_names: Optional[List[str]] = None,
         directory: Optional[str] = None,
-) -> List[Document]:
+        column_mapping: Optional[Dict] = None,
+) -> List[BaseNode]:
     """
     Load data from specified files in a directory or from all files in a directory and return a list of LlamaIndex Document objects.
 
+    CSV files with the mapped columns are loaded as one TextNode per row instead of a Document,
+    these nodes are inserted as is, without splitting.
+
     Args:
         file_names (Optional[List[str]]): List of file names to process in the directory.
         directory (Optional[str]): The directory containing the files to process.
+        column_mapping (Optional[Dict]): Column mapping of the CSV files, the mapping of the directory when missing.
 
     Returns:
-        List[Document]: A list of LlamaIndex Document objects.
+        List[BaseNode]: A list of LlamaIndex Document objects, and TextNode objects for the CSV rows.
 
     Raises:
         ValueError: If only file_names are provided or if the file type is unsupported.
     """
     
     documents = []
+    column_mapping = column_mapping or get_csv_column_mapping(directory)
+
+    def load_csv_rows(file_path: str) -> bool:
+        if column_mapping is None or os.path.splitext(file_path)[1].lower() != ".csv":
+            return False
+        rows = load_rows_from_csv(file_path, column_mapping)
+        if rows is None:
+            return False
+        documents.extend(rows)
+        return True
 
     # Both directory and file_names are provided
     if directory and file_names:
@@ -45,6 +116,9 @@ def load_data_from_files(
             
             file_extension = os.path.splitext(file_path)[1].lower()
 
+            if load_csv_rows(file_path):
+                continue
+
             if file_extension in SIMPLE_DIRECTORY_READER_SUPPORTED_TYPES:
                 docs = SimpleDirectoryReader(input_files=[file_path]).load_data()
                 documents.extend(docs)
@@ -58,9 +132,18 @@ def load_data_from_files(
         if not os.path.isdir(directory_path):
             raise ValueError(f"The directory '{directory_path}' does not exist.")
         
-        # Load all files in the specified directory
-        docs = SimpleDirectoryReader(input_dir=directory_path).load_data()
-        documents.extend(docs)
+        # Load all files in the specified directory, tabular files row by row
+        other_files = []
+        for file_name in sorted(os.listdir(directory_path)):
+            file_path = os.path.join(directory_path, file_name)
+            if file_name.startswith(".") or not os.path.isfile(file_path):
+                continue
+            if not load_csv_rows(file_path):
+                other_files.append(file_path)
+
+        if other_files:
+            docs = SimpleDirectoryReader(input_files=other_files).load_data()
+            documents.extend(docs)
 
     # Only file_names are provided without directory
     elif file_names:
@@ -99,25 +182,14 @@ def load_data_from_sitemap(sitemap_url: str, domain: str) -> List[Document]:
     
     # continue processing sitemap urls
     try:
-        response = requests.head(sitemap_url)
-        if response.status_code != 200:
-            raise ConnectionError(f"Failed to access the sitemap URL: {sitemap_url}. Status code: {response.status_code}")
-        
-        loader = SitemapReader()
+        return SitemapCrawler().load_data(sitemap_url=sitemap_url, domain=domain)
 
-        documents = loader.load_data(
-            sitemap_url=sitemap_url,
-            filter=domain
-        )
+    except ConnectionError:
+        raise
+
+    except Exception as error:
+        raise RuntimeError(f"An error occurred while processing the sitemap: {str(error)}")
 
-        return documents
-    
-    except requests.RequestException as error:
-        raise ConnectionError(f"Error occurred while trying to access the URL provided: {error}")
-    
-    except BaseException as error:
-        print(f"An error occurred while processing the sitemap: {str(error)}")
-    
 
 # TODO: enforce params type
 def insert_into_index(index, doc, doc_id = None):
@@ -148,6 +220,11 @@ def insert_into_index(index, doc, doc_id = None):
             raise ValueError(f"No documents were created from the file: {doc}")
         
         for document in documents:
+            # CSV rows are already nodes, they are not split
+            if not isinstance(document, Document):
+                index.insert_nodes([document])
+                continue
+
             if doc_id is not None:
                 document.doc_id = doc_id
 
@@ -175,4 +252,45 @@ def ensure_directory_exists(path):
         os.makedirs(path)
         print(f"Created directory: {path}")
     else:
-        print(f"Directory already exists: {path}")
\ No newline at end of file
+        print(f"Directory already exists: {path}")
+
+
+class ReadWriteLock:
+    """
+    Lock allowing concurrent readers and a single writer, waiting writers block new readers.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
@@ -1,18 +1,44 @@
+import asyncio
+import json
 import logging
-from typing import Optional
+import os
+import re
+import threading
+from typing import List, Optional
 import uuid
 from llama_index.core import Settings
+from llama_index.core.llms import LLM
 
-from constants import CHUNK_SIZE, OPENAI_EMBEDDING_MODEL, OPENAI_MODEL
-from workflow import HumanInTheLoopWorkflow
+from agent.FastRouter import URL_PATTERN
+from constants import CHUNK_SIZE, OPENAI_EMBEDDING_MODEL, OPENAI_MODEL, GUIDE_QUESTIONS_PROMPT_TMPL, SESSION_TTL_SECONDS
+from tools.coredna.sharpspring_tool import create_sharpspring_url
+from tools.http_client import http_client
+from tools.webpage_scanner_tool import analyze_form
+from workflow.HumanInTheLoopWorkflow import HumanInTheLoopWorkflow
+from workflow.events import FormDetectedEvent, AskQuestionEvent, SubmitFormEvent
 from llama_index.core.workflow import (
     Context,
     StartEvent,
     StopEvent,
+    InputRequiredEvent,
+    HumanResponseEvent,
     step,
-    draw_all_possible_flows,
 )
 
+"""
+Guide download as a fixed pipeline instead of free-form agent tool calls.
+
+    detect_form        analyze_form of the page, no LLM
+    generate_questions one LLM call wording a question per form field, label based questions if it fails
+    ask_question       InputRequiredEvent with the question, the run waits for the visitor's answer
+    collect_answer     HumanResponseEvent with the answer, validated, next question or submit
+    submit             create_sharpspring_url and a GET of the URL
+
+The run outlives a single HTTP request, DownloadGuideSession drives it from the request threads on a
+background event loop. Its progress (page, form, questions, answers, current question) is a JSON
+serializable state, a run started by another gunicorn worker is resumed from it at the current question.
+"""
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -29,13 +55,236 @@ Settings.chunk_size = CHUNK_SIZE
 Settings.embed_model = OPENAI_EMBEDDING_MODEL
 Settings.llm = OPENAI_MODEL
 
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+GUIDE_REQUEST_PATTERN = re.compile(
+    r"\b(download|get|send|receive)\b.*\b(guides?|e-?books?|white ?papers?|reports?|checklists?|templates?)\b", re.IGNORECASE
+)
+# the context data a run is resumed from
+STATE_KEYS = ("url", "form", "questions", "answers", "position")
+CANCEL_PATTERN = re.compile(r"^\s*(cancel|stop|quit|exit|never ?mind|no thanks)\b", re.IGNORECASE)
+
+
+def guide_request_url(query: str) -> Optional[str]:
+    """URL of the page when the query asks to download its guide, e.g. "download the guide on https://...", else None."""
+    if not GUIDE_REQUEST_PATTERN.search(query):
+        return None
+    match = URL_PATTERN.search(query)
+    if match is None:
+        return None
+    url = match.group(0).rstrip(".,;:!?)\"'")
+    return url if re.match(r"https?://", url, re.IGNORECASE) else f"https://{url}"
+
+
+def fallback_question(field: dict) -> str:
+    """Question built from the label or placeholder of a field, used when the LLM questions are unusable."""
+    name = field.get("label") or field.get("placeholder") or field["name"].replace("_", " ")
+    name = name[0].lower() + name[1:]
+    question = f"Could you please provide {name if name.startswith('your ') else 'your ' + name}?"
+    if field.get("options"):
+        question += f" ({', '.join(field['options'])})"
+    return question
+
 
 class DownloadGuideWorkflow(HumanInTheLoopWorkflow):
     wid: Optional[uuid.UUID] = uuid.uuid4()
 
-    def __init__(self, wid: Optional[uuid.UUID], *args, **kwargs):
-        self.wid = wid
+    def __init__(self, wid: Optional[uuid.UUID] = None, llm: Optional[LLM] = None, *args, **kwargs):
+        self.wid = wid or uuid.uuid4()
+        self.llm = llm or Settings.llm
+        # waits for the visitor between the questions, an abandoned run ends with its session
+        kwargs.setdefault("timeout", SESSION_TTL_SECONDS)
         super().__init__(*args, **kwargs)
-        class_name = self.__class__.__name__
 
+    @step(pass_context=True)
+    async def detect_form(self, ctx: Context, ev: StartEvent) -> FormDetectedEvent | AskQuestionEvent | StopEvent:
+        state = ev.get("state")
+        if state:
+            # resumed, the form was read and the questions worded by the run that started the download
+            for name in STATE_KEYS:
+                ctx.data[name] = state[name]
+            return AskQuestionEvent(position=state["position"])
+
+        url = ev.get("url")
+        schema = await asyncio.to_thread(analyze_form, url)
+        if schema.get("error"):
+            return StopEvent(result={"status": "failed", "message": f"I could not open {url}: {schema['error']}"})
+
+        # the download form is the one posting an embed code to SharpSpring
+        forms = [form for form in schema["forms"] if form.get("embedCode")]
+        if not forms:
+            return StopEvent(result={"status": "no_form", "message": f"There is no download form on {url}."})
+
+        logger.debug(f"{self.__class__.__name__} {self.wid}: form with {len(forms[0]['fields'])} fields on {url}")
+        return FormDetectedEvent(url=url, form=forms[0])
+
+    @step(pass_context=True)
+    async def generate_questions(self, ctx: Context, ev: FormDetectedEvent) -> AskQuestionEvent | SubmitFormEvent:
+        fields = ev.form["fields"]
+        ctx.data["url"] = ev.url
+        ctx.data["form"] = ev.form
+        ctx.data["answers"] = {}
+        ctx.data["questions"] = await self._word_questions(fields) if fields else []
+
+        if not fields:
+            return SubmitFormEvent()
+        return AskQuestionEvent(position=0)
+
+    async def _word_questions(self, fields: List[dict]) -> List[str]:
+        lines = []
+        for field in fields:
+            details = [field.get("type", "text"), "required" if field.get("required") else "optional"]
+            if field.get("options"):
+                details.append("choices: " + ", ".join(field["options"]))
+            lines.append(f"- {field.get('label') or field.get('placeholder') or field['name']} ({'; '.join(details)})")
+
+        try:
+            response = await self.llm.acomplete(GUIDE_QUESTIONS_PROMPT_TMPL.format(fields="\n".join(lines)))
+            text = str(response).strip()
+            questions = json.loads(text[text.index("["):text.rindex("]") + 1])
+            if len(questions) == len(fields) and all(isinstance(question, str) and question.strip() for question in questions):
+                return [question.strip() for question in questions]
+            logger.warning(f"{self.__class__.__name__} {self.wid}: unexpected questions {questions}")
+        except Exception as e:
+            logger.warning(f"{self.__class__.__name__} {self.wid}: failed to word the questions: {e}")
+        return [fallback_question(field) for field in fields]
+
+    @step(pass_context=True)
+    async def ask_question(self, ctx: Context, ev: AskQuestionEvent) -> InputRequiredEvent:
+        ctx.data["position"] = ev.position
+        question = ctx.data["questions"][ev.position]
+        if ev.note:
+            question = f"{ev.note} {question}"
+        return InputRequiredEvent(prefix=question, field=ctx.data["form"]["fields"][ev.position]["name"])
+
+    @step(pass_context=True)
+    async def collect_answer(self, ctx: Context, ev: HumanResponseEvent) -> AskQuestionEvent | SubmitFormEvent | StopEvent:
+        if CANCEL_PATTERN.match(ev.response):
+            return StopEvent(result={"status": "cancelled", "message": "No problem, I cancelled the download."})
+
+        position = ctx.data["position"]
+        field = ctx.data["form"]["fields"][position]
+        answer = ev.response.strip()
+        if not answer and field.get("required"):
+            return AskQuestionEvent(position=position, note="This field is required.")
+        if answer and field.get("type") == "email" and not EMAIL_PATTERN.match(answer):
+            return AskQuestionEvent(position=position, note="That does not look like an email address.")
+
+        ctx.data["answers"][field["name"]] = answer
+        if position + 1 < len(ctx.data["questions"]):
+            return AskQuestionEvent(position=position + 1)
+        return SubmitFormEvent()
+
+    @step(pass_context=True)
+    async def submit(self, ctx: Context, ev: SubmitFormEvent) -> StopEvent:
+        # hidden fields are not submitted, same as the agent flow
+        request_url = create_sharpspring_url({"embedCode": ctx.data["form"]["embedCode"], **ctx.data["answers"]})
+        try:
+            response = await asyncio.to_thread(http_client.get, request_url)
+        except Exception as e:
+            logger.error(f"{self.__class__.__name__} {self.wid}: submission failed: {e}")
+            return StopEvent(result={"status": "failed", "message": f"Sorry, the form could not be submitted: {e}"})
+
+        if response.status_code >= 400:
+            return StopEvent(result={
+                "status": "failed",
+                "message": f"Sorry, the form could not be submitted (status {response.status_code})."
+            })
+        return StopEvent(result={
+            "status": "submitted",
+            "message": f"Thank you, the guide will be sent to your email. Source: {ctx.data['url']}"
+        })
+
+
+class _EventLoopThread:
+    """Event loop running in a daemon thread, the workflow runs live on it between the HTTP requests."""
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def run(self, coroutine, timeout: Optional[float] = None):
+        with self._lock:
+            # the thread does not survive a fork, gunicorn workers start their own
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever, name="guide-workflows", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+
+_event_loop = _EventLoopThread()
+
+
+class DownloadGuideSession:
+    def __init__(self, llm: Optional[LLM] = None, state: Optional[dict] = None) -> None:
+
+        """
+        Initialize the DownloadGuideSession, the guide download of one visitor session.
+
+        Args:
+            llm (Optional[LLM]): The LLM wording the questions, Settings.llm when None.
+            state (Optional[dict]): The `state` of a download in progress, e.g. started by another worker, to resume it.
+        """
+
+        self.workflow = DownloadGuideWorkflow(llm=llm)
+        self.handler = None
+        self.result: Optional[dict] = None
+        # progress of the run, updated at every question
+        self.state: Optional[dict] = state
+
+    @property
+    def active(self) -> bool:
+        return self.result is None and (self.handler is not None or self.state is not None)
+
+    def start(self, url: str) -> dict:
+
+        """
+        Start the download of the guide of a page.
+
+        Returns:
+            dict: {"status": "question", "message": <first question>, "field"} or the final {"status", "message"}
+            when the page has no download form or it could not be read.
+        """
+
+        async def _start():
+            self.handler = self.workflow.run(url=url)
+            return await self._next()
+
+        return _event_loop.run(_start())
+
+    def close(self) -> None:
+        """Stop the live run, e.g. once the download continued on another worker."""
+        if self.handler is not None and not self.handler.done():
+            self.handler.get_loop().call_soon_threadsafe(self.handler.cancel)
+
+    def answer(self, response: str) -> dict:
+
+        """
+        Pass the visitor's answer to the current question.
+
+        Returns:
+            dict: The next question, or the final {"status", "message"} once the form was submitted or cancelled.
+        """
+
+        async def _answer():
+            if self.handler is None:
+                # resumed, the run asks the current question again before taking the answer
+                self.handler = self.workflow.run(state=self.state)
+                await self._next()
+            self.handler.ctx.send_event(HumanResponseEvent(response=response))
+            return await self._next()
+
+        return _event_loop.run(_answer())
 
+    async def _next(self) -> dict:
+        async for event in self.handler.stream_events():
+            if isinstance(event, InputRequiredEvent):
+                self.state = {name: self.handler.ctx.data[name] for name in STATE_KEYS}
+                return {"status": "question", "message": event.prefix, "field": event.get("field")}
+        try:
+            self.result = await self.handler
+        except Exception as e:
+            logger.exception(f"DownloadGuideWorkflow {self.workflow.wid} failed")
+            self.result = {"status": "failed", "message": f"Sorry, the guide download failed: {e}"}
+        return self.result
@@ -15,17 +15,18 @@ if not logger.hasHandlers():
 
 
 class HumanInTheLoopWorkflow(Workflow):
-    async def run(self, *args, **kwargs):
+    def run(self, *args, **kwargs):
+        # the handler is returned rather than awaited, so callers can stream its events and answer
+        # InputRequiredEvents with HumanResponseEvents, awaiting it still returns the result
         self.loop = asyncio.get_running_loop()
-        try:
-                result = await super().run(*args, **kwargs)
-                logger.debug(f"{self.__class__.__name__}: HITL workflow succeeded")
-                return result
-        
-        except Exception as e:
-                logger.error(f"Workflow failed with exception: {e}")
-                raise 
-        finally:
-            
-            logger.debug(f"{self.__class__.__name__}: MLflow run ended")
+        handler = super().run(*args, **kwargs)
+        handler.add_done_callback(self._log_result)
+        return handler
 
+    def _log_result(self, handler) -> None:
+        if handler.cancelled():
+            logger.debug(f"{self.__class__.__name__}: HITL workflow cancelled")
+        elif handler.exception() is not None:
+            logger.error(f"Workflow failed with exception: {handler.exception()}")
+        else:
+            logger.debug(f"{self.__class__.__name__}: HITL workflow succeeded")
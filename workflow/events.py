@@ -27,4 +27,19 @@ class AccountBalanceEvent(Event):
 class TransferMoneyEvent(Event):
     request: str
 
-# more events here
\ No newline at end of file
+# more events here
+
+# Download guide workflow
+class FormDetectedEvent(Event):
+    url: str
+    form: dict
+
+
+class AskQuestionEvent(Event):
+    # position of the question in ctx.data["questions"], note is prepended when the question is asked again
+    position: int
+    note: Optional[str] = None
+
+
+class SubmitFormEvent(Event):
+    pass